@@ -0,0 +1,66 @@
+-- Schema for the cost rollups maintained by openai_connector_with_cost_tracking.py.
+-- Run it once in the Supabase SQL editor.
+
+create table if not exists openai_cost_rollups (
+    id bigint generated by default as identity primary key,
+    granularity text not null,
+    bucket text not null,
+    model text not null,
+    request_count bigint not null default 0,
+    input_tokens bigint not null default 0,
+    output_tokens bigint not null default 0,
+    total_tokens bigint not null default 0,
+    cost numeric(14, 6) not null default 0,
+    updated_at timestamptz,
+    constraint openai_cost_rollups_bucket_key unique (granularity, bucket, model)
+);
+
+-- Adds the per-request deltas in `rows` to their buckets. Each row is updated with
+-- a single INSERT ... ON CONFLICT, so concurrent writers never overwrite each other.
+create or replace function increment_cost_rollups(rows jsonb)
+returns setof openai_cost_rollups
+language sql
+as $$
+    insert into openai_cost_rollups as rollup (
+        granularity, bucket, model, request_count, input_tokens, output_tokens, total_tokens, cost, updated_at
+    )
+    select granularity, bucket, model, request_count, input_tokens, output_tokens, total_tokens, cost, updated_at
+    from jsonb_to_recordset(rows) as delta (
+        granularity text,
+        bucket text,
+        model text,
+        request_count bigint,
+        input_tokens bigint,
+        output_tokens bigint,
+        total_tokens bigint,
+        cost numeric,
+        updated_at timestamptz
+    )
+    on conflict (granularity, bucket, model) do update set
+        request_count = rollup.request_count + excluded.request_count,
+        input_tokens = rollup.input_tokens + excluded.input_tokens,
+        output_tokens = rollup.output_tokens + excluded.output_tokens,
+        total_tokens = rollup.total_tokens + excluded.total_tokens,
+        cost = rollup.cost + excluded.cost,
+        updated_at = greatest(rollup.updated_at, excluded.updated_at)
+    returning *;
+$$;
+
+-- Inserts the raw openai_requests row and adds its rollup deltas. A function call is a
+-- single transaction, so the rollups never count a request whose row was not stored.
+create or replace function record_request_cost(request jsonb, rows jsonb)
+returns setof openai_cost_rollups
+language sql
+as $$
+    insert into openai_requests (model, input_tokens, output_tokens, total_tokens, cost)
+    select model, input_tokens, output_tokens, total_tokens, cost
+    from jsonb_to_record(request) as r (
+        model text,
+        input_tokens bigint,
+        output_tokens bigint,
+        total_tokens bigint,
+        cost numeric
+    );
+
+    select * from increment_cost_rollups(rows);
+$$;
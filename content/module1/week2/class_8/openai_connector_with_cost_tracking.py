@@ -1,8 +1,21 @@
 import asyncio
+import json
+import logging
 import os
-from typing import List, Dict
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Dict, Optional
 from openai import AsyncOpenAI
-from supabase import create_client, Client
+
+# The SQLite stand-in ships with the FastAPI template; import it from the repository root
+sys.path.append(str(Path(__file__).resolve().parents[4]))
+from fastapi_template.fast_api.connections.sqlite_backend import create_client_from_env
+
+logger = logging.getLogger(__name__)
 
 # Constants
 MODEL_TEMPERATURE = 0
@@ -12,14 +25,283 @@ OPENAI_PRICING = {
     'gpt-4-turbo': {'input': 0.01 / 1000, 'output': 0.03 / 1000},
     'gpt-3.5-turbo': {'input': 0.0005 / 1000, 'output': 0.0015 / 1000}
 }
+REQUESTS_TABLE = "openai_requests"
+COST_ROLLUPS_TABLE = "openai_cost_rollups"
+# Database functions that add rollup deltas atomically, alone or together with the
+# raw request row (see cost_rollups.sql)
+COST_ROLLUPS_FUNCTION = "increment_cost_rollups"
+RECORD_REQUEST_FUNCTION = "record_request_cost"
+ROLLUP_COUNTERS = ("request_count", "input_tokens", "output_tokens", "total_tokens")
+ROLLUP_COLUMNS = ("granularity", "bucket", "model", *ROLLUP_COUNTERS, "cost", "updated_at")
+ROLLUP_BUCKET_FORMATS = {
+    'hour': '%Y-%m-%dT%H:00',
+    'day': '%Y-%m-%d'
+}
+# Cheaper fallback used by the spend guard when a model's budget is exhausted
+MODEL_DOWNGRADES = {
+    'gpt-4-turbo': 'gpt-4o',
+    'gpt-4o': 'gpt-3.5-turbo'
+}
+TOTAL_BUDGET_KEY = '*'
+SPEND_GUARD_RECONCILE_SECONDS = 60
 
 # Get environment variables
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Monthly budgets in USD: a total budget plus optional per-model budgets, e.g. '{"gpt-4o": 50}'
+OPENAI_MONTHLY_BUDGET = os.getenv("OPENAI_MONTHLY_BUDGET")
+OPENAI_MODEL_BUDGETS = os.getenv("OPENAI_MODEL_BUDGETS")
+
+# Initialize Supabase client (set SUPABASE_BACKEND=sqlite to run against a local database)
+supabase = create_client_from_env(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+class CostRollups:
+    """Incrementally maintained per-model, per-hour and per-day usage aggregates.
+
+    Each request adds one row per granularity to COST_ROLLUPS_TABLE, keyed by
+    (granularity, bucket, model), so cost questions read a handful of rollup rows
+    instead of scanning openai_requests. The rows are deltas applied by the
+    COST_ROLLUPS_FUNCTION database function with INSERT ... ON CONFLICT DO UPDATE
+    SET cost = cost + excluded.cost, so any number of processes can write to the
+    same bucket without losing updates. RECORD_REQUEST_FUNCTION inserts the raw
+    REQUESTS_TABLE row and applies its deltas in the same transaction, so the
+    rollups never drift from the rows they summarize. cost_rollups.sql creates
+    the table, its unique (granularity, bucket, model) constraint and both functions.
+    """
+
+    def __init__(self, client, table: str = COST_ROLLUPS_TABLE) -> None:
+        self.client = client
+        self.table = table
+        if hasattr(client, "register_function"):
+            # Local SQLite backend: register the same increment the SQL function performs
+            client.register_function(COST_ROLLUPS_FUNCTION, self._increment_sqlite)
+            client.register_function(RECORD_REQUEST_FUNCTION, self._record_request_sqlite)
+
+    def record(self, model: str, input_tokens: int, output_tokens: int, total_tokens: int,
+               cost: float, timestamp: Optional[datetime] = None) -> List[Dict]:
+        """Returns the per-granularity delta rows for one request."""
+        timestamp = timestamp or datetime.now(timezone.utc)
+        return [{
+            "granularity": granularity,
+            "bucket": timestamp.strftime(bucket_format),
+            "model": model,
+            "request_count": 1,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": total_tokens,
+            "cost": cost,
+            "updated_at": timestamp.isoformat()
+        } for granularity, bucket_format in ROLLUP_BUCKET_FORMATS.items()]
+
+    def flush(self, rows: List[Dict]):
+        """Adds delta rows to the stored rollups in one atomic call."""
+        return self.client.rpc(COST_ROLLUPS_FUNCTION, {"rows": rows}).execute()
+
+    def record_request(self, request: Dict, rows: List[Dict]):
+        """Inserts a raw request row and adds its delta rows to the rollups in one transaction."""
+        return self.client.rpc(RECORD_REQUEST_FUNCTION, {"request": request, "rows": rows}).execute()
+
+    def _increment_sqlite(self, client, rows: List[Dict]) -> List[Dict]:
+        table = f'"{self.table}"'
+        client.ensure_index(self.table, ["granularity", "bucket", "model"], unique=True)
+        client.ensure_columns(self.table, ROLLUP_COLUMNS)
+        # Column names are interpolated into the statement: only the known rollup columns are accepted
+        assignments = ", ".join(f"{column} = {column} + excluded.{column}" for column in ROLLUP_COUNTERS)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(ROLLUP_COLUMNS)}) VALUES ({', '.join('?' for _ in ROLLUP_COLUMNS)}) "
+            f"ON CONFLICT (granularity, bucket, model) DO UPDATE SET {assignments}, "
+            "cost = round(cost + excluded.cost, 6), updated_at = max(updated_at, excluded.updated_at) "
+            "RETURNING *"
+        )
+        updated = []
+        for row in rows:
+            unknown = set(row) - set(ROLLUP_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown rollup columns: {', '.join(sorted(unknown))}")
+            cursor = client.connection.execute(sql, [row[column] for column in ROLLUP_COLUMNS])
+            updated.extend(dict(stored) for stored in cursor.fetchall())
+        return updated
+
+    def _record_request_sqlite(self, client, request: Dict, rows: List[Dict]) -> List[Dict]:
+        # Runs inside the rpc transaction: the insert is rolled back if the increment fails
+        client.table(REQUESTS_TABLE).insert(request).execute()
+        return self._increment_sqlite(client, rows)
+
+    def query(self, granularity: str = 'day', model: Optional[str] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict]:
+        """Returns rollup rows for a granularity, optionally filtered by model and bucket range (inclusive)."""
+        if granularity not in ROLLUP_BUCKET_FORMATS:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        bucket_format = ROLLUP_BUCKET_FORMATS[granularity]
+        query = self.client.table(self.table).select("*").eq("granularity", granularity)
+        if model:
+            query = query.eq("model", model)
+        if start:
+            query = query.gte("bucket", start.strftime(bucket_format))
+        if end:
+            query = query.lte("bucket", end.strftime(bucket_format))
+        return query.order("bucket").execute().data
+
+
+class BudgetExceededError(Exception):
+    """Raised when a request cannot be reserved against the remaining budget."""
+
+
+@dataclass
+class SpendReservation:
+    model: str
+    amount: float
+
+
+class SpendGuard:
+    """Pre-call budget check backed by in-memory counters.
+
+    Budgets are keyed by model name, plus TOTAL_BUDGET_KEY for all models. Each
+    call reserves its worst-case estimated cost before hitting the API and then
+    commits the real cost (or releases the reservation on failure). Models
+    without an OPENAI_PRICING entry cannot be estimated and are rejected.
+
+    The first reservation waits for stored month-to-date usage to load, and
+    fails if it can't be loaded; async callers can run ensure_loaded() in a
+    thread beforehand so that database read doesn't block their event loop. After that the counters are reconciled every
+    reconcile_interval seconds in a background thread, so the hot path is a
+    lock and a few dict lookups. A reconcile adds the commits made while it was
+    loading to the stored totals, so no spend is dropped. Callers should store
+    a request's cost before committing it; the overlap is then counted twice
+    until the next reconcile instead of being missed.
+    """
+
+    def __init__(self, budgets: Dict[str, float], usage_loader: Optional[Callable[[str], float]] = None,
+                 reconcile_interval: float = SPEND_GUARD_RECONCILE_SECONDS) -> None:
+        self.budgets = dict(budgets)
+        self.usage_loader = usage_loader
+        self.reconcile_interval = reconcile_interval
+        self._spent = {key: 0.0 for key in self.budgets}
+        self._reserved = {key: 0.0 for key in self.budgets}
+        # Spend committed since the running reconcile started loading
+        self._committed_since_load = {key: 0.0 for key in self.budgets}
+        self._lock = threading.Lock()
+        # Serializes reconciles; never taken on the hot path once usage is loaded
+        self._reconcile_lock = threading.RLock()
+        self._loaded = usage_loader is None
+        self._last_reconcile = float('-inf')
+        self._reconciling = False
+
+    @staticmethod
+    def estimate_cost(model: str, prompt: List[Dict[str, str]], max_tokens: int) -> float:
+        """Upper-bound cost estimate: ~4 characters per input token and a full max_tokens reply."""
+        pricing = OPENAI_PRICING.get(model)
+        if not pricing:
+            raise ValueError(f"No pricing for model {model}")
+        input_tokens = sum(len(message.get("content") or "") for message in prompt) // 4 + 4 * len(prompt)
+        return input_tokens * pricing["input"] + max_tokens * pricing["output"]
+
+    def _fits(self, model: str, amount: float) -> bool:
+        for key in (model, TOTAL_BUDGET_KEY):
+            budget = self.budgets.get(key)
+            if budget is not None and self._spent[key] + self._reserved[key] + amount > budget:
+                return False
+        return True
+
+    def _adjust(self, model: str, reserved: float = 0.0, spent: float = 0.0) -> None:
+        for key in (model, TOTAL_BUDGET_KEY):
+            if key in self.budgets:
+                self._reserved[key] += reserved
+                self._spent[key] += spent
+                self._committed_since_load[key] += spent
+
+    def reserve(self, model: str, prompt: List[Dict[str, str]], max_tokens: int,
+                allow_downgrade: bool = True) -> SpendReservation:
+        """Reserves the estimated cost, downgrading the model if allowed, or raises BudgetExceededError."""
+        if not self.budgets:
+            return SpendReservation(model, 0.0)
+        self.ensure_loaded()
+        self._maybe_reconcile()
+
+        candidate = model
+        with self._lock:
+            while candidate:
+                if candidate not in OPENAI_PRICING:
+                    raise BudgetExceededError(f"No pricing for model {candidate}; its cost cannot be budgeted")
+                amount = self.estimate_cost(candidate, prompt, max_tokens)
+                if self._fits(candidate, amount):
+                    self._adjust(candidate, reserved=amount)
+                    return SpendReservation(candidate, amount)
+                candidate = MODEL_DOWNGRADES.get(candidate) if allow_downgrade else None
+        raise BudgetExceededError(f"Budget exhausted for model {model}")
+
+    def commit(self, reservation: SpendReservation, actual_cost: float) -> None:
+        """Replaces a reservation with the actual cost of the request."""
+        with self._lock:
+            self._adjust(reservation.model, reserved=-reservation.amount, spent=actual_cost)
+
+    def release(self, reservation: SpendReservation) -> None:
+        """Drops a reservation for a request that failed."""
+        with self._lock:
+            self._adjust(reservation.model, reserved=-reservation.amount)
+
+    def remaining(self, key: str = TOTAL_BUDGET_KEY) -> Optional[float]:
+        """Budget left for a key after spent and in-flight reservations, or None if unbounded."""
+        with self._lock:
+            if key not in self.budgets:
+                return None
+            return self.budgets[key] - self._spent[key] - self._reserved[key]
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def ensure_loaded(self) -> None:
+        """Loads stored month-to-date usage once, or raises BudgetExceededError if it can't be loaded."""
+        if self._loaded:
+            return
+        with self._reconcile_lock:
+            if self._loaded:
+                return
+            try:
+                self.reconcile()
+            except Exception as e:
+                raise BudgetExceededError("Month-to-date usage could not be loaded; refusing to spend") from e
+
+    def _maybe_reconcile(self) -> None:
+        if self.usage_loader is None:
+            return
+        with self._lock:
+            if self._reconciling or time.monotonic() - self._last_reconcile < self.reconcile_interval:
+                return
+            self._reconciling = True
+        threading.Thread(target=self._reconcile_in_background, daemon=True).start()
+
+    def _reconcile_in_background(self) -> None:
+        try:
+            self.reconcile()
+        except Exception as e:
+            logger.warning(f"Spend guard reconciliation failed: {e}")
+        finally:
+            with self._lock:
+                self._reconciling = False
+
+    def reconcile(self) -> None:
+        """Sets the spent counters to stored month-to-date usage plus what was committed while loading it."""
+        with self._reconcile_lock:
+            with self._lock:
+                self._last_reconcile = time.monotonic()
+                self._committed_since_load = {key: 0.0 for key in self.budgets}
+            stored = {key: self.usage_loader(key) for key in self.budgets}
+            with self._lock:
+                for key, value in stored.items():
+                    self._spent[key] = value + self._committed_since_load[key]
+                self._loaded = True
+
+
+def load_budgets() -> Dict[str, float]:
+    """Reads the monthly budgets configured in the environment."""
+    budgets = json.loads(OPENAI_MODEL_BUDGETS) if OPENAI_MODEL_BUDGETS else {}
+    if OPENAI_MONTHLY_BUDGET:
+        budgets[TOTAL_BUDGET_KEY] = float(OPENAI_MONTHLY_BUDGET)
+    return {key: float(value) for key, value in budgets.items()}
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 class OpenaiConnector:
     def __init__(self, api_key: str) -> None:
@@ -31,13 +313,16 @@ class OpenaiConnector:
         """
         os.environ["OPENAI_API_KEY"] = api_key
         self.client = AsyncOpenAI()  # Use async OpenAI client
+        self.rollups = CostRollups(supabase)
+        self.spend_guard = SpendGuard(load_budgets(), usage_loader=self.month_to_date_cost)
 
     async def get_gpt_reply(self,
                             prompt: List[Dict[str, str]],
                             temperature: float = MODEL_TEMPERATURE,
                             max_tokens: int = REPLY_MAX_TOKENS,
                             response_format=None,
-                            model: str = 'gpt-4o') -> str:
+                            model: str = 'gpt-4o',
+                            allow_downgrade: bool = True) -> str:
         """Asynchronously generates a GPT reply based on the given prompt, tracks token usage, and logs cost to Supabase.
 
         Args:
@@ -45,17 +330,31 @@ class OpenaiConnector:
             model (str): The model to use for generating the reply. Defaults to 'gpt-4o'.
             temperature (float): Controls the randomness of the reply. Defaults to MODEL_TEMPERATURE.
             max_tokens (int): The maximum number of tokens in the generated reply. Defaults to REPLY_MAX_TOKENS.
+            allow_downgrade (bool): Fall back to a cheaper model when the budget for `model` is exhausted.
 
         Returns:
             str: The generated GPT reply.
+
+        Raises:
+            BudgetExceededError: If no allowed model fits in the remaining budget.
         """
-        response = await self.client.chat.completions.create(
-            model=model,
-            messages=prompt,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            response_format=response_format
-        )
+        if not self.spend_guard.loaded:
+            # The first reservation reads stored usage from the database: keep it off the event loop
+            await asyncio.to_thread(self.spend_guard.ensure_loaded)
+        reservation = self.spend_guard.reserve(model, prompt, max_tokens, allow_downgrade)
+        model = reservation.model
+
+        try:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format=response_format
+            )
+        except Exception:
+            self.spend_guard.release(reservation)
+            raise
 
         reply_content = response.choices[0].message.content
         usage = response.usage
@@ -66,8 +365,14 @@ class OpenaiConnector:
             total_tokens = usage.total_tokens
             cost = self.calculate_cost(model, input_tokens, output_tokens)
 
-            # Save cost to Supabase
-            await self.save_request_cost(model, input_tokens, output_tokens, total_tokens, cost)
+            # Save cost to Supabase before committing it, so a concurrent reconcile can't miss it
+            try:
+                await self.save_request_cost(model, input_tokens, output_tokens, total_tokens, cost)
+            finally:
+                self.spend_guard.commit(reservation, cost)
+        else:
+            # Without usage data keep the estimate as the spent amount
+            self.spend_guard.commit(reservation, reservation.amount)
 
         return reply_content
 
@@ -80,7 +385,7 @@ class OpenaiConnector:
         return 0.0
 
     async def save_request_cost(self, model: str, input_tokens: int, output_tokens: int, total_tokens: int, cost: float):
-        """Inserts request cost details into Supabase."""
+        """Inserts request cost details into Supabase and adds them to the hourly/daily rollups in one transaction."""
         data = {
             "model": model,
             "input_tokens": input_tokens,
@@ -88,8 +393,36 @@ class OpenaiConnector:
             "total_tokens": total_tokens,
             "cost": cost
         }
-        response = supabase.table("openai_requests").insert(data).execute()
-        return response
+        rollup_rows = self.rollups.record(model, input_tokens, output_tokens, total_tokens, cost)
+        return self.rollups.record_request(data, rollup_rows)
+
+    def get_usage(self, granularity: str = 'day', model: Optional[str] = None,
+                  start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict:
+        """Returns aggregated requests, tokens and cost from the rollups table.
+
+        Args:
+            granularity (str): 'hour' or 'day'. Defaults to 'day'.
+            model (Optional[str]): Restrict to a single model.
+            start (Optional[datetime]): First bucket to include (UTC).
+            end (Optional[datetime]): Last bucket to include (UTC).
+
+        Returns:
+            Dict: Totals plus the per-bucket rows under "buckets".
+        """
+        rows = self.rollups.query(granularity, model, start, end)
+        summary = {"request_count": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "cost": 0.0}
+        for row in rows:
+            for field in summary:
+                summary[field] += row.get(field) or 0
+        summary["cost"] = round(summary["cost"], 6)
+        summary["buckets"] = rows
+        return summary
+
+    def month_to_date_cost(self, budget_key: str = TOTAL_BUDGET_KEY) -> float:
+        """Month-to-date cost for a spend guard key, read from the daily rollups."""
+        month_start = datetime.now(timezone.utc).replace(day=1)
+        model = None if budget_key == TOTAL_BUDGET_KEY else budget_key
+        return self.get_usage('day', model=model, start=month_start)["cost"]
 
 
 # Initialize OpenAI Connector
@@ -104,5 +437,6 @@ if __name__ == "__main__":
         ]
         reply = await OPEN_AI_CONNECTOR.get_gpt_reply(prompt)
         print("Generated Reply:", reply)
+        print("Today's Usage:", OPEN_AI_CONNECTOR.get_usage('day', start=datetime.now(timezone.utc)))
 
     asyncio.run(test_openai_connector())
\ No newline at end of file
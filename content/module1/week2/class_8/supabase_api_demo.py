@@ -1,23 +1,125 @@
 # pip install supabase
+import copy
 import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
 
-from supabase import create_client, Client
+# The SQLite stand-in ships with the FastAPI template; import it from the repository root
+sys.path.append(str(Path(__file__).resolve().parents[4]))
+from fastapi_template.fast_api.connections.sqlite_backend import create_client_from_env
 
 # Retrieve Supabase credentials from environment variables
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-# Check if the environment variables are set
-if not SUPABASE_URL or not SERVICE_ROLE_KEY:
-    raise ValueError("Missing Supabase URL or Service Role Key in environment variables.")
 
+# Read-through cache settings for select_data
+SELECT_CACHE_TTL_SECONDS = float(os.getenv("SELECT_CACHE_TTL_SECONDS", "60"))
+SELECT_CACHE_MAX_SIZE = int(os.getenv("SELECT_CACHE_MAX_SIZE", "1024"))
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SERVICE_ROLE_KEY)
+
+# Initialize Supabase client (set SUPABASE_BACKEND=sqlite to run against a local database)
+supabase = create_client_from_env(SUPABASE_URL, SERVICE_ROLE_KEY)
+
+
+class SelectCache:
+    """In-process LRU cache with TTL for select_data responses, keyed by (table, email).
+
+    Every invalidation bumps the key's generation. A read-through fetch records
+    the generation before querying and only stores its response if no write
+    invalidated the key in the meantime. Only the most recent max_size
+    generations are remembered; older keys report the floor of the pruned ones,
+    which can skip a cache fill but never stores a stale response.
+    """
+
+    def __init__(self, ttl_seconds: float = SELECT_CACHE_TTL_SECONDS, max_size: int = SELECT_CACHE_MAX_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._generations = OrderedDict()  # key -> generation of its last invalidation
+        self._generation_floor = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached response for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, response = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(response)
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def generation(self, key) -> int:
+        """Return the key's current generation; record it before fetching and pass it to set."""
+        with self._lock:
+            return self._generations.get(key, self._generation_floor)
+
+    def set(self, key, response, generation=None) -> bool:
+        """Store a copy of a response, evicting the least recently used entries past max_size.
+
+        If generation is given and the key was invalidated since it was read,
+        the response may predate the write and is not stored.
+        """
+        with self._lock:
+            if generation is not None and self._generations.get(key, self._generation_floor) != generation:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        """Drop a single key after a write to the same row."""
+        with self._lock:
+            self._clock += 1
+            self._generations[key] = self._clock
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.max_size:
+                _, pruned = self._generations.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, pruned)
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+select_cache = SelectCache()
 
 def insert_data(table: str, data: dict):
     """Insert a record into a Supabase table."""
     response = supabase.table(table).insert(data).execute()
+    # A cached "no rows" answer for this email is now stale
+    select_cache.invalidate((table, data.get('email')))
     return response
 
 def update_data(table: str, email: str, updates: dict):
@@ -28,16 +130,33 @@ def update_data(table: str, email: str, updates: dict):
         .eq('email',email)
         .execute()
     )
+    select_cache.invalidate((table, email))
+    if 'email' in updates:
+        select_cache.invalidate((table, updates['email']))
     return response
 
-def select_data(table: str, email: str = None):
-    """Select records from a Supabase table based on optional filters."""
+def select_data(table: str, email: str = None, use_cache: bool = True):
+    """Select records from a Supabase table based on optional filters.
+
+    Responses are served from select_cache when available; pass use_cache=False
+    to force a round-trip to Supabase. Callers get their own copy and may
+    modify it freely.
+    """
+    key = (table, email)
+    if use_cache:
+        cached = select_cache.get(key)
+        if cached is not None:
+            return cached
+
+    # A write that lands while the query is in flight must win over its result
+    generation = select_cache.generation(key)
     response = (
         supabase.table(table)
         .select("*")
         .eq('email',email)
         .execute()
     )
+    select_cache.set(key, response, generation)
     return response
 
 # Example usage
@@ -54,3 +173,7 @@ if __name__ == "__main__":
     select_response = select_data("users", "john@example.com")
     first_result = select_response.data[0]['name']
     print("Select Response:", first_result)
+
+    # A second lookup for the same email is served from the cache
+    select_data("users", "john@example.com")
+    print("Select Cache Stats:", select_cache.stats())
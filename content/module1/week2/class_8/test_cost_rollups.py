@@ -0,0 +1,103 @@
+"""Tests for CostRollups against the local SQLite backend.
+
+Run from this directory with: python -m pytest test_cost_rollups.py
+"""
+import os
+import threading
+from datetime import datetime, timezone
+
+# The connector creates its clients at import time: point them at a local database
+os.environ["SUPABASE_BACKEND"] = "sqlite"
+os.environ["SQLITE_DB_PATH"] = ":memory:"
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+
+from openai_connector_with_cost_tracking import REQUESTS_TABLE, CostRollups
+# Importable once the connector has added the repository root to sys.path
+from fastapi_template.fast_api.connections.sqlite_backend import SQLiteClient
+
+MORNING = datetime(2024, 5, 1, 9, 15, tzinfo=timezone.utc)
+AFTERNOON = datetime(2024, 5, 1, 15, 40, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "rollups.db")
+
+
+def test_record_builds_one_delta_row_per_granularity():
+    rows = CostRollups(SQLiteClient(":memory:")).record("gpt-4o", 100, 50, 150, 0.00125, MORNING)
+
+    assert {(row["granularity"], row["bucket"]) for row in rows} == {
+        ("hour", "2024-05-01T09:00"),
+        ("day", "2024-05-01")
+    }
+    assert all(row["request_count"] == 1 and row["cost"] == 0.00125 for row in rows)
+
+
+def test_flush_adds_deltas_to_existing_buckets(db_path):
+    rollups = CostRollups(SQLiteClient(db_path))
+    rollups.flush(rollups.record("gpt-4o", 100, 50, 150, 0.00125, MORNING))
+    rollups.flush(rollups.record("gpt-4o", 200, 10, 210, 0.00115, AFTERNOON))
+    rollups.flush(rollups.record("gpt-3.5-turbo", 10, 10, 20, 0.00002, AFTERNOON))
+
+    [day] = rollups.query("day", model="gpt-4o")
+    assert day["request_count"] == 2
+    assert day["input_tokens"] == 300
+    assert day["total_tokens"] == 360
+    assert day["cost"] == pytest.approx(0.0024)
+    assert day["updated_at"] == AFTERNOON.isoformat()
+
+    hours = rollups.query("hour", model="gpt-4o")
+    assert [hour["bucket"] for hour in hours] == ["2024-05-01T09:00", "2024-05-01T15:00"]
+    assert len(rollups.query("day")) == 2
+
+
+def test_record_request_stores_row_and_rollups_together(db_path):
+    client = SQLiteClient(db_path)
+    rollups = CostRollups(client)
+    request = {"model": "gpt-4o", "input_tokens": 100, "output_tokens": 50, "total_tokens": 150, "cost": 0.00125}
+    rollups.record_request(request, rollups.record("gpt-4o", 100, 50, 150, 0.00125, MORNING))
+
+    assert len(client.table(REQUESTS_TABLE).select("*").execute().data) == 1
+    assert rollups.query("day")[0]["request_count"] == 1
+
+    # A failing increment rolls back the raw row as well
+    bad_rows = [{**row, "cost) VALUES (0); --": 1} for row in rollups.record("gpt-4o", 1, 1, 2, 0.001, MORNING)]
+    with pytest.raises(ValueError):
+        rollups.record_request(request, bad_rows)
+    assert len(client.table(REQUESTS_TABLE).select("*").execute().data) == 1
+    assert rollups.query("day")[0]["request_count"] == 1
+
+
+def test_query_filters_by_bucket_range(db_path):
+    rollups = CostRollups(SQLiteClient(db_path))
+    for day in (1, 2, 3):
+        rollups.flush(rollups.record("gpt-4o", 1, 1, 2, 0.001, MORNING.replace(day=day)))
+
+    rows = rollups.query("day", start=MORNING.replace(day=2), end=MORNING.replace(day=3))
+    assert [row["bucket"] for row in rows] == ["2024-05-02", "2024-05-03"]
+    with pytest.raises(ValueError):
+        rollups.query("week")
+
+
+def test_concurrent_writers_do_not_lose_updates(db_path):
+    # Two clients (separate connections) on the same database, like two processes
+    writers = [CostRollups(SQLiteClient(db_path)) for _ in range(2)]
+    requests_per_writer = 100
+
+    def write(rollups):
+        for _ in range(requests_per_writer):
+            rollups.flush(rollups.record("gpt-4o", 10, 5, 15, 0.0025, MORNING))
+
+    threads = [threading.Thread(target=write, args=(rollups,)) for rollups in writers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    [day] = writers[0].query("day")
+    assert day["request_count"] == 2 * requests_per_writer
+    assert day["input_tokens"] == 2 * requests_per_writer * 10
+    assert day["cost"] == pytest.approx(2 * requests_per_writer * 0.0025)
@@ -0,0 +1,134 @@
+"""Tests for SpendGuard budget reservations and reconciliation.
+
+Run from this directory with: python -m pytest test_spend_guard.py
+"""
+import os
+import threading
+
+# The connector creates its clients at import time: point them at a local database
+os.environ["SUPABASE_BACKEND"] = "sqlite"
+os.environ["SQLITE_DB_PATH"] = ":memory:"
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import pytest
+
+from openai_connector_with_cost_tracking import TOTAL_BUDGET_KEY, BudgetExceededError, SpendGuard
+
+PROMPT = [{"role": "user", "content": "x" * 400}]
+MAX_TOKENS = 100
+
+
+def estimate(model):
+    return SpendGuard.estimate_cost(model, PROMPT, MAX_TOKENS)
+
+
+def test_no_budgets_never_blocks():
+    guard = SpendGuard({})
+    reservation = guard.reserve("unpriced-model", PROMPT, MAX_TOKENS)
+    assert reservation.amount == 0.0
+    assert guard.remaining() is None
+
+
+def test_reserve_commit_and_release_adjust_remaining():
+    guard = SpendGuard({TOTAL_BUDGET_KEY: 1.0})
+    reservation = guard.reserve("gpt-4o", PROMPT, MAX_TOKENS)
+    assert guard.remaining() == pytest.approx(1.0 - estimate("gpt-4o"))
+
+    guard.commit(reservation, 0.001)
+    assert guard.remaining() == pytest.approx(0.999)
+
+    guard.release(guard.reserve("gpt-4o", PROMPT, MAX_TOKENS))
+    assert guard.remaining() == pytest.approx(0.999)
+
+
+def test_downgrades_when_model_budget_is_exhausted():
+    guard = SpendGuard({"gpt-4o": estimate("gpt-4o") * 1.5, TOTAL_BUDGET_KEY: 10.0})
+    first = guard.reserve("gpt-4o", PROMPT, MAX_TOKENS)
+    second = guard.reserve("gpt-4o", PROMPT, MAX_TOKENS)
+
+    assert first.model == "gpt-4o"
+    assert second.model == "gpt-3.5-turbo"
+    with pytest.raises(BudgetExceededError):
+        guard.reserve("gpt-4o", PROMPT, MAX_TOKENS, allow_downgrade=False)
+
+
+def test_total_budget_rejects_when_nothing_fits():
+    guard = SpendGuard({TOTAL_BUDGET_KEY: estimate("gpt-3.5-turbo") / 2})
+    with pytest.raises(BudgetExceededError):
+        guard.reserve("gpt-4o", PROMPT, MAX_TOKENS)
+
+
+def test_unpriced_model_is_rejected():
+    guard = SpendGuard({TOTAL_BUDGET_KEY: 100.0})
+    with pytest.raises(BudgetExceededError):
+        guard.reserve("unpriced-model", PROMPT, MAX_TOKENS)
+    with pytest.raises(ValueError):
+        SpendGuard.estimate_cost("unpriced-model", PROMPT, MAX_TOKENS)
+
+
+def test_first_reservation_loads_stored_usage():
+    guard = SpendGuard({TOTAL_BUDGET_KEY: 1.0}, usage_loader=lambda key: 1.0 - estimate("gpt-4o") / 2)
+    with pytest.raises(BudgetExceededError):
+        guard.reserve("gpt-4o", PROMPT, MAX_TOKENS, allow_downgrade=False)
+    assert guard.remaining() == pytest.approx(estimate("gpt-4o") / 2)
+
+
+def test_fails_closed_when_usage_cannot_be_loaded():
+    def broken_loader(key):
+        raise ConnectionError("database unavailable")
+
+    guard = SpendGuard({TOTAL_BUDGET_KEY: 1.0}, usage_loader=broken_loader)
+    with pytest.raises(BudgetExceededError) as excinfo:
+        guard.reserve("gpt-3.5-turbo", PROMPT, MAX_TOKENS)
+    assert isinstance(excinfo.value.__cause__, ConnectionError)
+
+
+def test_reconcile_keeps_commits_made_while_loading():
+    loading = threading.Event()
+    proceed = threading.Event()
+    stored = {"value": 0.0}
+
+    def slow_loader(key):
+        loading.set()
+        proceed.wait(5)
+        # The commit below happened after the stored total was read
+        return stored["value"]
+
+    guard = SpendGuard({TOTAL_BUDGET_KEY: 1.0}, usage_loader=lambda key: 0.0)
+    reservation = guard.reserve("gpt-3.5-turbo", PROMPT, MAX_TOKENS)
+    guard.usage_loader = slow_loader
+    thread = threading.Thread(target=guard.reconcile)
+    thread.start()
+    assert loading.wait(5)
+    guard.commit(reservation, 0.25)
+    proceed.set()
+    thread.join(5)
+
+    assert guard.remaining() == pytest.approx(0.75)
+
+    # The next reconcile sees the stored cost and nothing is counted twice
+    stored["value"] = 0.25
+    guard.reconcile()
+    assert guard.remaining() == pytest.approx(0.75)
+
+
+def test_concurrent_reservations_never_overspend():
+    amount = estimate("gpt-3.5-turbo")
+    guard = SpendGuard({TOTAL_BUDGET_KEY: amount * 10.5})
+    granted = []
+
+    def reserve():
+        for _ in range(10):
+            try:
+                granted.append(guard.reserve("gpt-3.5-turbo", PROMPT, MAX_TOKENS))
+            except BudgetExceededError:
+                pass
+
+    threads = [threading.Thread(target=reserve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(granted) == 10
+    assert guard.remaining() >= 0
@@ -0,0 +1,118 @@
+"""Contexto de la conversación para el modelo, acotado por un presupuesto de tokens.
+
+El prompt que se envía es: un mensaje de sistema con el resumen de los turnos
+viejos, los turnos más recientes completos y el mensaje nuevo del usuario, sin
+superar CHAT_CONTEXT_TOKENS. Así los tokens de prompt (y con ellos la
+latencia y el costo) dejan de crecer con el largo de la conversación.
+
+El resumen es incremental: el estado de cada conversación guarda cuántos
+mensajes ya están resumidos. Mientras los turnos recientes entran en el
+presupuesto no se vuelve a resumir. Cuando dejan de entrar, los más viejos se
+pliegan al resumen hasta que los recientes ocupan CONTEXT_REFILL_RATIO del
+espacio disponible, de modo que el resumen se recalcula cada varios turnos y
+no en cada uno.
+"""
+import logging
+import os
+
+from token_accounting import count_message_tokens, count_tokens, message_tokens
+
+logger = logging.getLogger(__name__)
+
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "1500"))
+# Tokens reservados para el resumen dentro del presupuesto
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "250"))
+# Fracción del espacio para turnos recientes que queda ocupada después de resumir
+CONTEXT_REFILL_RATIO = 0.5
+
+ROLE_NAMES = {"user": "Usuario", "assistant": "Asistente"}
+SUMMARY_PREFIX = "Resumen de la conversación anterior: "
+
+SUMMARY_PROMPT = """Resumen de la conversación hasta ahora:
+{summary}
+
+Mensajes nuevos:
+{transcript}
+
+Escribe un resumen actualizado de toda la conversación, en menos de {max_words} palabras, \
+conservando datos, nombres, preferencias y decisiones del usuario. Responde solo con el resumen."""
+
+
+def truncate_to_tokens(text, max_tokens, keep_end=False):
+    """Recorta `text` por palabras hasta `max_tokens` tokens (conserva el final si `keep_end`)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        piece = words[-middle:] if keep_end else words[:middle]
+        if count_tokens(" ".join(piece)) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    if low == 0:
+        return ""
+    return " ".join(words[-low:] if keep_end else words[:low])
+
+
+class ContextBuilder:
+    """Arma los mensajes de contexto de un turno a partir del historial y el estado del resumen.
+
+    `summarize(prompt)` es la llamada al modelo que escribe el resumen; sin ella
+    (o si falla) se usa un resumen extractivo con lo último de la transcripción.
+    """
+
+    def __init__(self, summarize=None, budget=CHAT_CONTEXT_TOKENS, summary_tokens=CHAT_SUMMARY_TOKENS,
+                 refill_ratio=CONTEXT_REFILL_RATIO):
+        self.summarize = summarize
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.refill_ratio = refill_ratio
+
+    def _summarize(self, summary, messages):
+        transcript = "\n".join(f"{ROLE_NAMES[message['role']]}: {message['content']}" for message in messages)
+        if self.summarize is not None:
+            try:
+                prompt = SUMMARY_PROMPT.format(
+                    summary=summary or "(vacío)",
+                    transcript=transcript,
+                    max_words=int(self.summary_tokens * 0.6)
+                )
+                return truncate_to_tokens(self.summarize(prompt).strip(), self.summary_tokens)
+            except Exception as e:
+                logger.warning(f"No se pudo resumir con el modelo, se usa un resumen extractivo: {e}")
+        return truncate_to_tokens(f"{summary}\n{transcript}".strip(), self.summary_tokens, keep_end=True)
+
+    def build(self, history, prompt, state=None):
+        """(mensajes de contexto, nuevo estado) para responder `prompt` después de `history`.
+
+        `state` es el que devolvió la llamada anterior para la misma conversación
+        ({"covered": mensajes resumidos, "summary": texto}), o None.
+        """
+        messages = [
+            {"role": message["role"], "content": message.get("content") or ""}
+            for message in history if message.get("role") in ROLE_NAMES
+        ]
+        covered, summary = 0, ""
+        if state and state["covered"] <= len(messages):
+            covered, summary = state["covered"], state["summary"]
+
+        summary_reserve = self.summary_tokens + message_tokens({"content": SUMMARY_PREFIX})
+        available = self.budget - summary_reserve - count_message_tokens([{"role": "user", "content": prompt}])
+        window_tokens = sum(message_tokens(message) for message in messages[covered:])
+        if window_tokens > available:
+            # Plegar los turnos más viejos al resumen hasta dejar lugar para varios turnos más
+            target = max(0, available) * self.refill_ratio
+            start = covered
+            while start < len(messages) and window_tokens > target:
+                window_tokens -= message_tokens(messages[start])
+                start += 1
+            summary = self._summarize(summary, messages[covered:start])
+            covered = start
+
+        context = []
+        if summary:
+            context.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+        context.extend(messages[covered:])
+        return context, {"covered": covered, "summary": summary}
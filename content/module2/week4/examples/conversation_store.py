@@ -0,0 +1,1024 @@
+"""Backends de almacenamiento para el historial de conversaciones del chatbot.
+
+- JsonConversationStore: el formato original, un único `conversations.json`.
+  Las ráfagas de mensajes se agrupan en una sola escritura atómica
+  (archivo temporal + rename) protegida con un lock de archivo.
+- JsonlConversationStore: log append-only (un registro JSONL por mensaje) más
+  un índice pequeño con los offsets de cada conversación. Escribir un mensaje
+  cuesta O(1) sin importar el tamaño del historial.
+- SQLiteConversationStore: tablas de conversaciones y mensajes con índices y
+  WAL; listar y cargar conversaciones no depende del tamaño del historial.
+
+El backend se elige con la variable de entorno CHAT_HISTORY_BACKEND
+("jsonl" por defecto, "json" o "sqlite").
+
+Todos exponen la misma interfaz: has_conversation, get_conversation,
+get_messages, append_message, delete_conversations, delete_unchanged, compact,
+list_conversations(offset, limit, query), count_conversations(query),
+count_messages, iter_conversations e iter_updated_since(since). Los listados
+devuelven solo metadatos (id, created_at, updated_at, message_count,
+first_line); los mensajes se cargan por conversación. `updated_at` es el
+timestamp del último mensaje (o created_at si no tiene).
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from itertools import islice
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", "jsonl")
+
+# Cada cuántos mensajes se agregan los cambios del índice a su log (el resto se recupera
+# leyendo la cola del log de mensajes)
+INDEX_FLUSH_EVERY = 50
+# Compactar (en segundo plano) cuando lo escrito desde la última compactación supera el
+# tamaño compactado (mínimo 1 MB), así cada mensaje paga O(1) amortizado por las compactaciones
+COMPACT_MIN_BYTES = 1024 * 1024
+# Conversaciones cuyos mensajes se mantienen en memoria
+MESSAGE_CACHE_SIZE = 128
+# Largo máximo de la vista previa (primera línea del primer mensaje) en los listados
+FIRST_LINE_LENGTH = 80
+# Versión del formato del índice JSONL; si cambia, el índice se reconstruye desde el log
+INDEX_VERSION = 3
+# Conversaciones por consulta al recorrer el store con iter_updated_since
+LIST_PAGE_SIZE = 500
+# Espera tras el último mensaje antes de escribir conversations.json, y demora máxima
+# desde el primer mensaje pendiente aunque sigan llegando mensajes
+FLUSH_DELAY_SECONDS = float(os.getenv("CHAT_HISTORY_FLUSH_DELAY", "0.2"))
+FLUSH_MAX_DELAY_SECONDS = float(os.getenv("CHAT_HISTORY_FLUSH_MAX_DELAY", "1.0"))
+
+# Un lock por archivo, compartido por todas las instancias del proceso
+_PATH_LOCKS = defaultdict(threading.RLock)
+
+
+class FileLock:
+    """Lock exclusivo entre procesos sobre un archivo `.lock` auxiliar."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._handle = None
+
+    def __enter__(self):
+        self._handle = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self._handle, fcntl.LOCK_EX)
+        else:
+            self._handle.seek(0)
+            msvcrt.locking(self._handle.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+        else:
+            self._handle.seek(0)
+            msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+        self._handle.close()
+        self._handle = None
+
+
+def _atomic_write_json(path, data, **kwargs):
+    """Escribe en un temporal y lo renombra: los lectores nunca ven un archivo a medias."""
+    tmp_file = Path(path).with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def _first_line(content):
+    lines = (content or "").strip().splitlines()
+    return lines[0][:FIRST_LINE_LENGTH] if lines else ""
+
+
+def _matches(conversation, query):
+    query = query.lower()
+    return conversation["id"].startswith(query) or query in conversation["first_line"].lower()
+
+
+def _updated_at(updated_at, message):
+    """`updated_at` de una conversación después de agregarle `message`."""
+    return max(updated_at, message.get("timestamp") or updated_at)
+
+
+def _updated_since(conversations, since):
+    """Conversaciones con actividad desde `since` (datetime o None), por fecha de creación."""
+    if since is not None:
+        since_iso = since.isoformat()
+        conversations = [conv for conv in conversations if conv["updated_at"] >= since_iso]
+    conversations.sort(key=lambda conv: (conv["created_at"], conv["id"]))
+    return conversations
+
+
+def _filter(conversations, query):
+    if not query:
+        return conversations
+    return [conv for conv in conversations if _matches(conv, query)]
+
+
+def _page(conversations, offset, limit, query=None):
+    """Filtra por `query`, ordena de la más reciente a la más antigua y aplica offset/limit."""
+    conversations = _filter(conversations, query)
+    conversations.sort(key=lambda conv: conv["created_at"], reverse=True)
+    end = None if limit is None else offset + limit
+    return conversations[offset:end]
+
+
+class JsonConversationStore:
+    """Historial completo en un solo archivo JSON.
+
+    El contenido se vuelve a leer solo cuando cambian el mtime o el tamaño del
+    archivo. Los mensajes nuevos quedan pendientes en memoria y un hilo los
+    escribe juntos FLUSH_DELAY_SECONDS después del último (nunca más de
+    FLUSH_MAX_DELAY_SECONDS después del primero). Cada escritura toma el lock
+    de archivo, vuelve a aplicar los mensajes pendientes sobre lo que haya en
+    disco (otros procesos pueden haber escrito) y reemplaza el archivo de
+    forma atómica.
+    """
+
+    def __init__(self, history_file):
+        self.history_file = Path(history_file)
+        self.file_lock = FileLock(self.history_file.with_name(self.history_file.name + ".lock"))
+        self.lock = _PATH_LOCKS[str(self.history_file.resolve())]
+        self.history = {}
+        self._file_stat = None
+        self._pending = []
+        self._first_pending_at = None
+        self._last_write_at = None
+        self._flush_requested = threading.Condition(self.lock)
+        self._refresh()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _stat_file(self):
+        try:
+            stat = self.history_file.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _apply(self, history, op, *args):
+        if op == "delete":
+            for conversation_id in args[0]:
+                history.pop(conversation_id, None)
+            return
+        conversation_id, message, created_at = args
+        if conversation_id not in history:
+            history[conversation_id] = {"created_at": created_at, "messages": []}
+        history[conversation_id]["messages"].append(message)
+
+    def _refresh(self):
+        with self.lock:
+            file_stat = self._stat_file()
+            if file_stat == self._file_stat:
+                return
+            if file_stat is None:
+                self.history = {}
+            else:
+                with open(self.history_file, 'r') as f:
+                    self.history = json.load(f)
+            # Los cambios aún no escritos se mantienen sobre la versión de disco
+            for pending in self._pending:
+                self._apply(self.history, *pending)
+            self._file_stat = file_stat
+
+    def has_conversation(self, conversation_id):
+        self._refresh()
+        return conversation_id in self.history
+
+    def get_conversation(self, conversation_id):
+        self._refresh()
+        conversation = self.history.get(conversation_id)
+        if conversation is None:
+            return None
+        return {"created_at": conversation["created_at"], "messages": list(conversation["messages"])}
+
+    def get_messages(self, conversation_id):
+        """Copia de la lista de mensajes: la del store cambia con cada append."""
+        self._refresh()
+        conversation = self.history.get(conversation_id)
+        return list(conversation["messages"]) if conversation else []
+
+    def _queue(self, *pending):
+        with self.lock:
+            self._refresh()
+            self._apply(self.history, *pending)
+            self._pending.append(pending)
+            self._last_write_at = time.monotonic()
+            if self._first_pending_at is None:
+                self._first_pending_at = self._last_write_at
+            self._flush_requested.notify()
+
+    def append_message(self, conversation_id, message, created_at=None):
+        self._queue("message", conversation_id, message, created_at or datetime.now().isoformat())
+
+    def delete_conversations(self, conversation_ids):
+        """Elimina conversaciones del historial y devuelve cuántas existían."""
+        with self.lock:
+            self._refresh()
+            conversation_ids = [conv_id for conv_id in conversation_ids if conv_id in self.history]
+            if conversation_ids:
+                self._queue("delete", conversation_ids)
+            return len(conversation_ids)
+
+    def delete_unchanged(self, message_counts):
+        """Elimina las conversaciones que siguen teniendo la cantidad de mensajes de
+        `message_counts` ({id: cantidad}) y devuelve sus ids."""
+        with self.lock:
+            self._refresh()
+            conversation_ids = [
+                conv_id for conv_id, count in message_counts.items()
+                if conv_id in self.history and len(self.history[conv_id]["messages"]) == count
+            ]
+            if conversation_ids:
+                self._queue("delete", conversation_ids)
+            return conversation_ids
+
+    def compact(self):
+        """El archivo se reescribe entero en cada escritura: alcanza con escribir lo pendiente."""
+        self.flush()
+
+    def _flush_loop(self):
+        with self.lock:
+            while True:
+                while not self._pending:
+                    self._flush_requested.wait()
+                deadline = min(self._last_write_at + FLUSH_DELAY_SECONDS,
+                               self._first_pending_at + FLUSH_MAX_DELAY_SECONDS)
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._flush_requested.wait(remaining)
+                    continue
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Error guardando historial: {e}")
+                    self._flush_requested.wait(FLUSH_MAX_DELAY_SECONDS)
+
+    def flush(self):
+        """Escribe los mensajes pendientes de inmediato."""
+        with self.lock:
+            if not self._pending:
+                return
+            with self.file_lock:
+                self._refresh()
+                _atomic_write_json(self.history_file, self.history, indent=2)
+                self._file_stat = self._stat_file()
+            self._pending = []
+            self._first_pending_at = None
+
+    def _metadata(self):
+        return [{
+            "id": conv_id,
+            "created_at": data["created_at"],
+            "updated_at": _updated_at(data["created_at"], data["messages"][-1]) if data["messages"] else data["created_at"],
+            "message_count": len(data["messages"]),
+            "first_line": _first_line(data["messages"][0]["content"]) if data["messages"] else ""
+        } for conv_id, data in self.history.items()]
+
+    def list_conversations(self, offset=0, limit=None, query=None):
+        self._refresh()
+        return _page(self._metadata(), offset, limit, query)
+
+    def count_conversations(self, query=None):
+        self._refresh()
+        if query:
+            return len(_filter(self._metadata(), query))
+        return len(self.history)
+
+    def count_messages(self):
+        self._refresh()
+        return sum(len(data["messages"]) for data in self.history.values())
+
+    def iter_conversations(self):
+        self._refresh()
+        yield from list(self.history.items())
+
+    def iter_updated_since(self, since=None):
+        """Metadatos de las conversaciones con mensajes desde `since`, por fecha de creación."""
+        self._refresh()
+        yield from _updated_since(self._metadata(), since)
+
+    def close(self):
+        self.flush()
+
+
+class JsonlConversationStore:
+    """Log append-only de mensajes con índice de offsets por conversación.
+
+    Cada línea del log es un registro JSON:
+        {"op": "log", "generation": ...}   # primera línea, cambia al compactar
+        {"op": "conversation", "id": ..., "created_at": ...}
+        {"op": "message", "conversation_id": ..., "prev": <offset>, "message": {...}}
+        {"op": "delete", "id": ...}         # los mensajes se liberan al compactar
+
+    `prev` apunta al mensaje anterior de la misma conversación, por lo que
+    cargar una conversación solo lee sus propios mensajes. El índice guarda
+    por conversación `created_at`, `updated_at`, `message_count` y `last_offset`. En disco es
+    una foto completa (`conversations.idx.json`) que solo se reescribe al
+    compactar, más un log de cambios (`conversations.idx.log`) al que cada
+    INDEX_FLUSH_EVERY mensajes se agregan las entradas modificadas; al abrir,
+    lo que falte se recupera leyendo el log desde `log_size`.
+
+    En memoria, además, `_order` mantiene los pares (created_at, id) ordenados
+    y se actualiza con cada conversación nueva o eliminada: los listados
+    paginados recorren solo la página pedida, sin ordenar todo el índice.
+
+    La compactación corre en un hilo aparte y copia el log sin tomar los
+    locks; solo la etapa final (agregar lo escrito durante la copia y
+    reemplazar el archivo) bloquea a los escritores.
+    """
+
+    def __init__(self, history_dir, legacy_file=None):
+        self.history_dir = Path(history_dir)
+        self.log_file = self.history_dir / "conversations.jsonl"
+        self.index_file = self.history_dir / "conversations.idx.json"
+        self.index_log_file = self.history_dir / "conversations.idx.log"
+        self.lock = _PATH_LOCKS[str(self.log_file.resolve())]
+        self.file_lock = FileLock(self.log_file.with_name(self.log_file.name + ".lock"))
+        self._message_cache = OrderedDict()
+        self._compacting = False
+
+        with self.lock, self.file_lock:
+            if not self.log_file.exists():
+                conversations = {}
+                if legacy_file and Path(legacy_file).exists():
+                    with open(legacy_file, 'r') as f:
+                        conversations = json.load(f)
+                tmp_file = self.log_file.with_suffix(f".jsonl.{os.getpid()}.tmp")
+                generation = str(uuid.uuid4())
+                with open(tmp_file, 'wb') as f:
+                    self._write_log(f, generation, (
+                        (conv_id, data["created_at"], data["messages"]) for conv_id, data in conversations.items()
+                    ))
+                os.replace(tmp_file, self.log_file)
+            self._load_index()
+
+    # Índice
+
+    def _load_index(self):
+        self.index = {}
+        self.log_size = 0
+        self.compacted_size = 0
+        self._log_stat = self._stat_log()
+        self.generation = self._read_generation()
+        self._unflushed = 0
+        self._dirty = set()
+        self._needs_snapshot = True
+        try:
+            with open(self.index_file, 'r') as f:
+                stored = json.load(f)
+            if stored.get("version") == INDEX_VERSION and stored.get("generation") == self.generation:
+                self.index = stored["conversations"]
+                self.log_size = stored["log_size"]
+                self.compacted_size = stored.get("compacted_size", 0)
+                self._needs_snapshot = False
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        if not self._needs_snapshot:
+            self._replay_index_log()
+        self._rebuild_order()
+        self._replay_tail()
+        if self._needs_snapshot:
+            self.compacted_size = self.log_size
+
+    def _rebuild_order(self):
+        self._order = sorted((entry["created_at"], conv_id) for conv_id, entry in self.index.items())
+
+    def _stat_log(self):
+        stat = self.log_file.stat()
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _read_generation(self):
+        with open(self.log_file, 'rb') as f:
+            return json.loads(f.readline())["generation"]
+
+    def _replay_index_log(self):
+        """Aplica sobre la foto del índice los cambios agregados después de ella."""
+        try:
+            with open(self.index_log_file, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # registro incompleto al final del archivo
+                    delta = json.loads(line)
+                    # Cambios de otra generación o anteriores a la foto ya no aplican
+                    if delta["generation"] != self.generation or delta["log_size"] <= self.log_size:
+                        continue
+                    for conv_id, entry in delta["conversations"].items():
+                        if entry is None:
+                            self.index.pop(conv_id, None)
+                        else:
+                            self.index[conv_id] = entry
+                    self.log_size = delta["log_size"]
+        except FileNotFoundError:
+            pass
+
+    def _replay_tail(self):
+        """Aplica al índice los registros escritos después de `log_size`."""
+        with open(self.log_file, 'rb') as f:
+            f.seek(self.log_size)
+            offset = self.log_size
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # registro incompleto al final del archivo
+                self._apply(json.loads(line), offset)
+                offset += len(line)
+        self.log_size = offset
+
+    def _apply(self, record, offset):
+        if record["op"] == "conversation":
+            if record["id"] not in self.index:
+                self.index[record["id"]] = {
+                    "created_at": record["created_at"],
+                    "updated_at": record["created_at"],
+                    "message_count": 0,
+                    "first_line": "",
+                    "last_offset": None
+                }
+                bisect.insort(self._order, (record["created_at"], record["id"]))
+            self._dirty.add(record["id"])
+        elif record["op"] == "message":
+            entry = self.index[record["conversation_id"]]
+            if entry["message_count"] == 0:
+                entry["first_line"] = _first_line(record["message"].get("content"))
+            entry["message_count"] += 1
+            entry["updated_at"] = _updated_at(entry["updated_at"], record["message"])
+            entry["last_offset"] = offset
+            self._dirty.add(record["conversation_id"])
+            cached = self._message_cache.get(record["conversation_id"])
+            if cached is not None:
+                cached.append(record["message"])
+        elif record["op"] == "delete":
+            entry = self.index.pop(record["id"], None)
+            if entry is not None:
+                position = bisect.bisect_left(self._order, (entry["created_at"], record["id"]))
+                del self._order[position]
+            self._dirty.add(record["id"])
+            self._message_cache.pop(record["id"], None)
+
+    def _refresh(self):
+        """Sincroniza con escrituras de otras instancias del mismo archivo."""
+        if self._stat_log() == self._log_stat:
+            return
+        if self._read_generation() != self.generation:
+            # El log fue reemplazado por una compactación
+            self._message_cache.clear()
+            self._load_index()
+        else:
+            self._replay_tail()
+            self._log_stat = self._stat_log()
+
+    def _flush_index(self):
+        """Agrega al log del índice las entradas que cambiaron (con el lock de archivo tomado)."""
+        if self._needs_snapshot:
+            self._write_snapshot()
+            return
+        if self._dirty:
+            delta = {
+                "generation": self.generation,
+                "log_size": self.log_size,
+                "conversations": {conv_id: self.index.get(conv_id) for conv_id in self._dirty}
+            }
+            with open(self.index_log_file, 'ab') as f:
+                f.write((json.dumps(delta, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._dirty.clear()
+        self._unflushed = 0
+
+    def _write_snapshot(self):
+        """Reescribe la foto completa del índice y vacía su log de cambios."""
+        _atomic_write_json(self.index_file, {
+            "version": INDEX_VERSION,
+            "generation": self.generation,
+            "log_size": self.log_size,
+            "compacted_size": self.compacted_size,
+            "conversations": self.index
+        })
+        with open(self.index_log_file, 'wb'):
+            pass
+        self._needs_snapshot = False
+        self._dirty.clear()
+        self._unflushed = 0
+
+    # Escritura
+
+    def _append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        offset = self.log_size
+        with open(self.log_file, 'ab') as f:
+            f.write(line)
+        self._apply(record, offset)
+        self.log_size += len(line)
+        self._log_stat = self._stat_log()
+        return offset
+
+    def append_message(self, conversation_id, message, created_at=None):
+        with self.lock, self.file_lock:
+            self._refresh()
+            if conversation_id not in self.index:
+                self._append({
+                    "op": "conversation",
+                    "id": conversation_id,
+                    "created_at": created_at or datetime.now().isoformat()
+                })
+            self._append({
+                "op": "message",
+                "conversation_id": conversation_id,
+                "prev": self.index[conversation_id]["last_offset"],
+                "message": message
+            })
+
+            self._unflushed += 1
+            if self._unflushed >= INDEX_FLUSH_EVERY:
+                self._flush_index()
+            if self.log_size - self.compacted_size > max(COMPACT_MIN_BYTES, self.compacted_size):
+                self._compact_in_background()
+
+    def delete_conversations(self, conversation_ids):
+        """Marca conversaciones como eliminadas; su espacio se libera en la próxima compactación."""
+        with self.lock, self.file_lock:
+            self._refresh()
+            deleted = 0
+            for conv_id in conversation_ids:
+                if conv_id in self.index:
+                    self._append({"op": "delete", "id": conv_id})
+                    deleted += 1
+            return deleted
+
+    def delete_unchanged(self, message_counts):
+        """Elimina las conversaciones que siguen teniendo la cantidad de mensajes de
+        `message_counts` ({id: cantidad}) y devuelve sus ids."""
+        with self.lock, self.file_lock:
+            self._refresh()
+            deleted = []
+            for conv_id, count in message_counts.items():
+                if conv_id in self.index and self.index[conv_id]["message_count"] == count:
+                    self._append({"op": "delete", "id": conv_id})
+                    deleted.append(conv_id)
+            return deleted
+
+    @staticmethod
+    def _write_record(f, record):
+        offset = f.tell()
+        f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        return offset
+
+    def _write_log(self, f, generation, conversations):
+        """Escribe un log con los mensajes de cada conversación contiguos y devuelve su índice.
+
+        `conversations` produce tuplas (id, created_at, mensajes).
+        """
+        index = {}
+        self._write_record(f, {"op": "log", "generation": generation})
+        for conv_id, created_at, messages in conversations:
+            self._write_record(f, {"op": "conversation", "id": conv_id, "created_at": created_at})
+            prev = None
+            updated_at = created_at
+            for message in messages:
+                prev = self._write_record(f, {
+                    "op": "message", "conversation_id": conv_id, "prev": prev, "message": message
+                })
+                updated_at = _updated_at(updated_at, message)
+            index[conv_id] = {
+                "created_at": created_at,
+                "updated_at": updated_at,
+                "message_count": len(messages),
+                "first_line": _first_line(messages[0]["content"]) if messages else "",
+                "last_offset": prev
+            }
+        return index
+
+    def _copy_tail(self, source, start, end, f, index):
+        """Copia al log nuevo los registros de `start` a `end` del log viejo, con `prev` traducido."""
+        source.seek(start)
+        for line in source.read(end - start).splitlines():
+            record = json.loads(line)
+            if record["op"] == "conversation":
+                self._write_record(f, record)
+                index.setdefault(record["id"], {
+                    "created_at": record["created_at"],
+                    "updated_at": record["created_at"],
+                    "message_count": 0,
+                    "first_line": "",
+                    "last_offset": None
+                })
+            elif record["op"] == "message":
+                entry = index[record["conversation_id"]]
+                record["prev"] = entry["last_offset"]
+                if entry["message_count"] == 0:
+                    entry["first_line"] = _first_line(record["message"].get("content"))
+                entry["message_count"] += 1
+                entry["updated_at"] = _updated_at(entry["updated_at"], record["message"])
+                entry["last_offset"] = self._write_record(f, record)
+            elif record["op"] == "delete":
+                self._write_record(f, record)
+                index.pop(record["id"], None)
+
+    def compact(self):
+        """Reescribe el log agrupando los mensajes por conversación y persiste el índice.
+
+        Las conversaciones se copian sin tomar los locks, leyendo el log tal como
+        estaba al empezar; después, con los locks, se agrega lo escrito durante
+        la copia y se reemplaza el archivo. Si otra instancia compactó en el
+        medio, la copia se descarta.
+        """
+        with self.lock:
+            self._refresh()
+            generation, cut = self.generation, self.log_size
+            entries = sorted(
+                ((conv_id, dict(entry)) for conv_id, entry in self.index.items()),
+                key=lambda item: item[1]["created_at"]
+            )
+            # El archivo abierto sigue siendo el mismo aunque otra compactación lo reemplace
+            source = open(self.log_file, 'rb')
+        tmp_file = self.log_file.with_suffix(f".jsonl.{os.getpid()}.{threading.get_ident()}.tmp")
+        new_generation = str(uuid.uuid4())
+        try:
+            with open(tmp_file, 'wb') as f:
+                index = self._write_log(f, new_generation, (
+                    (conv_id, entry["created_at"], self._read_chain(source, entry["last_offset"]))
+                    for conv_id, entry in entries
+                ))
+                with self.lock, self.file_lock:
+                    self._refresh()
+                    if self.generation != generation:
+                        return
+                    self._copy_tail(source, cut, self.log_size, f, index)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    os.replace(tmp_file, self.log_file)
+                    self.index = index
+                    self._rebuild_order()
+                    self.generation = new_generation
+                    self._log_stat = self._stat_log()
+                    self.log_size = self.compacted_size = self._log_stat[1]
+                    self._write_snapshot()
+        finally:
+            source.close()
+            tmp_file.unlink(missing_ok=True)
+
+    def _compact_in_background(self):
+        if self._compacting:
+            return
+        self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compactando el historial: {e}")
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def close(self):
+        with self.lock, self.file_lock:
+            self._refresh()
+            if self._unflushed or self._needs_snapshot:
+                self._flush_index()
+
+    # Lectura
+
+    @staticmethod
+    def _read_chain(f, offset):
+        """Mensajes de una conversación siguiendo `prev` desde su último offset."""
+        messages = []
+        while offset is not None:
+            f.seek(offset)
+            record = json.loads(f.readline())
+            messages.append(record["message"])
+            offset = record["prev"]
+        messages.reverse()
+        return messages
+
+    def _read_messages(self, conversation_id):
+        with open(self.log_file, 'rb') as f:
+            return self._read_chain(f, self.index[conversation_id]["last_offset"])
+
+    def has_conversation(self, conversation_id):
+        with self.lock:
+            self._refresh()
+            return conversation_id in self.index
+
+    def get_messages(self, conversation_id):
+        with self.lock:
+            self._refresh()
+            if conversation_id not in self.index:
+                return []
+            if conversation_id in self._message_cache:
+                self._message_cache.move_to_end(conversation_id)
+            else:
+                self._message_cache[conversation_id] = self._read_messages(conversation_id)
+                if len(self._message_cache) > MESSAGE_CACHE_SIZE:
+                    self._message_cache.popitem(last=False)
+            # Copia: _apply agrega los mensajes nuevos a la lista del caché
+            return list(self._message_cache[conversation_id])
+
+    def get_conversation(self, conversation_id):
+        with self.lock:
+            if not self.has_conversation(conversation_id):
+                return None
+            return {
+                "created_at": self.index[conversation_id]["created_at"],
+                "messages": self.get_messages(conversation_id)
+            }
+
+    def _metadata(self, conv_id):
+        entry = self.index[conv_id]
+        return {
+            "id": conv_id,
+            "created_at": entry["created_at"],
+            "updated_at": entry["updated_at"],
+            "message_count": entry["message_count"],
+            "first_line": entry["first_line"]
+        }
+
+    def list_conversations(self, offset=0, limit=None, query=None):
+        with self.lock:
+            self._refresh()
+            if not query:
+                # _order va de la más antigua a la más reciente: la página se toma desde el final
+                stop = max(len(self._order) - offset, 0)
+                start = 0 if limit is None else max(stop - limit, 0)
+                return [self._metadata(conv_id) for _, conv_id in reversed(self._order[start:stop])]
+            matches = (
+                conv for conv in (self._metadata(conv_id) for _, conv_id in reversed(self._order))
+                if _matches(conv, query)
+            )
+            return list(islice(matches, offset, None if limit is None else offset + limit))
+
+    def count_conversations(self, query=None):
+        with self.lock:
+            self._refresh()
+            if query:
+                return sum(1 for conv_id in self.index if _matches(self._metadata(conv_id), query))
+            return len(self.index)
+
+    def count_messages(self):
+        with self.lock:
+            self._refresh()
+            return sum(entry["message_count"] for entry in self.index.values())
+
+    def iter_conversations(self):
+        for conv in self.list_conversations():
+            data = self.get_conversation(conv["id"])
+            if data is not None:
+                yield conv["id"], data
+
+    def iter_updated_since(self, since=None):
+        """Metadatos de las conversaciones con mensajes desde `since`, por fecha de creación."""
+        since_iso = since.isoformat() if since else ""
+        with self.lock:
+            self._refresh()
+            conversations = [
+                self._metadata(conv_id) for _, conv_id in self._order
+                if self.index[conv_id]["updated_at"] >= since_iso
+            ]
+        yield from conversations
+
+
+class SQLiteConversationStore:
+    """Historial en SQLite con índices por fecha de creación y por conversación.
+
+    `conversations.message_count` y `updated_at` se mantienen al insertar cada
+    mensaje, así el listado paginado no necesita contar mensajes ni buscar el
+    último.
+    """
+
+    def __init__(self, history_dir, legacy_file=None):
+        self.db_file = Path(history_dir) / "conversations.db"
+        self.lock = _PATH_LOCKS[str(self.db_file.resolve())]
+        is_new = not self.db_file.exists()
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id TEXT PRIMARY KEY,
+                    created_at TEXT NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    first_line TEXT,
+                    updated_at TEXT
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id TEXT NOT NULL REFERENCES conversations(id),
+                    timestamp TEXT,
+                    role TEXT,
+                    content TEXT,
+                    extra TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_conversations_created_at ON conversations(created_at);
+                CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id);
+            """)
+            columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(conversations)")}
+            if "first_line" not in columns:
+                # Bases creadas antes de guardar la vista previa
+                self.connection.execute("ALTER TABLE conversations ADD COLUMN first_line TEXT")
+                rows = self.connection.execute(
+                    "SELECT conversation_id, content FROM messages WHERE id IN "
+                    "(SELECT MIN(id) FROM messages GROUP BY conversation_id)"
+                ).fetchall()
+                self.connection.executemany(
+                    "UPDATE conversations SET first_line = ? WHERE id = ?",
+                    [(_first_line(row["content"]), row["conversation_id"]) for row in rows]
+                )
+            if "updated_at" not in columns:
+                # Bases creadas antes de guardar la fecha del último mensaje
+                self.connection.execute("ALTER TABLE conversations ADD COLUMN updated_at TEXT")
+                self.connection.execute(
+                    "UPDATE conversations SET updated_at = MAX(created_at, COALESCE("
+                    "(SELECT MAX(timestamp) FROM messages WHERE conversation_id = conversations.id), created_at))"
+                )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at)"
+            )
+            if is_new and legacy_file and Path(legacy_file).exists():
+                with open(legacy_file, 'r') as f:
+                    for conv_id, data in json.load(f).items():
+                        self._insert_conversation(conv_id, data["created_at"])
+                        for message in data["messages"]:
+                            self._insert_message(conv_id, message)
+
+    def _insert_conversation(self, conversation_id, created_at):
+        self.connection.execute(
+            "INSERT OR IGNORE INTO conversations (id, created_at, updated_at) VALUES (?, ?, ?)",
+            (conversation_id, created_at, created_at)
+        )
+
+    def _insert_message(self, conversation_id, message):
+        extra = {k: v for k, v in message.items() if k not in ("timestamp", "role", "content")}
+        self.connection.execute(
+            "INSERT INTO messages (conversation_id, timestamp, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, message.get("timestamp"), message.get("role"), message.get("content"),
+             json.dumps(extra) if extra else None)
+        )
+        self.connection.execute(
+            "UPDATE conversations SET message_count = message_count + 1, "
+            "first_line = COALESCE(first_line, ?), "
+            "updated_at = MAX(COALESCE(updated_at, created_at), COALESCE(?, created_at)) WHERE id = ?",
+            (_first_line(message.get("content")), message.get("timestamp"), conversation_id)
+        )
+
+    @staticmethod
+    def _row_to_message(row):
+        message = {"timestamp": row["timestamp"], "role": row["role"], "content": row["content"]}
+        if row["extra"]:
+            message.update(json.loads(row["extra"]))
+        return message
+
+    def append_message(self, conversation_id, message, created_at=None):
+        with self.lock, self.connection:
+            self._insert_conversation(conversation_id, created_at or datetime.now().isoformat())
+            self._insert_message(conversation_id, message)
+
+    def delete_conversations(self, conversation_ids):
+        with self.lock, self.connection:
+            params = [(conv_id,) for conv_id in conversation_ids]
+            self.connection.executemany("DELETE FROM messages WHERE conversation_id = ?", params)
+            before = self.connection.total_changes
+            self.connection.executemany("DELETE FROM conversations WHERE id = ?", params)
+            return self.connection.total_changes - before
+
+    def delete_unchanged(self, message_counts):
+        """Elimina las conversaciones que siguen teniendo la cantidad de mensajes de
+        `message_counts` ({id: cantidad}) y devuelve sus ids."""
+        deleted = []
+        with self.lock, self.connection:
+            # El primer DELETE toma el lock de escritura: nadie agrega mensajes hasta el commit
+            for conv_id, count in message_counts.items():
+                self.connection.execute(
+                    "DELETE FROM messages WHERE conversation_id = ? AND "
+                    "(SELECT message_count FROM conversations WHERE id = ?) = ?",
+                    (conv_id, conv_id, count)
+                )
+                cursor = self.connection.execute(
+                    "DELETE FROM conversations WHERE id = ? AND message_count = ?", (conv_id, count)
+                )
+                if cursor.rowcount:
+                    deleted.append(conv_id)
+        return deleted
+
+    def compact(self):
+        """Devuelve al sistema las páginas liberadas por los borrados."""
+        with self.lock:
+            self.connection.execute("VACUUM")
+
+    def has_conversation(self, conversation_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        return row is not None
+
+    def get_messages(self, conversation_id):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT timestamp, role, content, extra FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,)
+            ).fetchall()
+        return [self._row_to_message(row) for row in rows]
+
+    def get_conversation(self, conversation_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT created_at FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"created_at": row["created_at"], "messages": self.get_messages(conversation_id)}
+
+    @staticmethod
+    def _search_clause(query):
+        if not query:
+            return "", ()
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return (
+            " WHERE id LIKE ? ESCAPE '\\' OR first_line LIKE ? ESCAPE '\\'",
+            (pattern + "%", "%" + pattern + "%")
+        )
+
+    def list_conversations(self, offset=0, limit=None, query=None):
+        where, params = self._search_clause(query)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, created_at, updated_at, message_count, COALESCE(first_line, '') AS first_line "
+                f"FROM conversations{where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (*params, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_conversations(self, query=None):
+        where, params = self._search_clause(query)
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM conversations{where}", params).fetchone()[0]
+
+    def count_messages(self):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(message_count), 0) FROM conversations").fetchone()[0]
+
+    def iter_conversations(self):
+        with self.lock:
+            ids = [row[0] for row in self.connection.execute("SELECT id FROM conversations ORDER BY created_at")]
+        for conv_id in ids:
+            data = self.get_conversation(conv_id)
+            if data is not None:
+                yield conv_id, data
+
+    def iter_updated_since(self, since=None):
+        """Metadatos de las conversaciones con mensajes desde `since`, por fecha de creación.
+
+        Pagina por (created_at, id), que no cambian: cada conversación aparece
+        una sola vez aunque reciba mensajes durante el recorrido.
+        """
+        since_iso = since.isoformat() if since else ""
+        cursor = ("", "")
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, created_at, updated_at, message_count, COALESCE(first_line, '') AS first_line "
+                    "FROM conversations WHERE updated_at >= ? AND (created_at, id) > (?, ?) "
+                    "ORDER BY created_at, id LIMIT ?",
+                    (since_iso, *cursor, LIST_PAGE_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            yield from (dict(row) for row in rows)
+            cursor = (rows[-1]["created_at"], rows[-1]["id"])
+
+    def close(self):
+        self.connection.close()
+
+
+def open_conversation_store(history_dir, backend=None):
+    """Crea el backend configurado en CHAT_HISTORY_BACKEND para `history_dir`."""
+    backend = backend or CHAT_HISTORY_BACKEND
+    history_dir = Path(history_dir)
+    legacy_file = history_dir / "conversations.json"
+    if backend == "json":
+        return JsonConversationStore(legacy_file)
+    if backend == "jsonl":
+        return JsonlConversationStore(history_dir, legacy_file=legacy_file)
+    if backend == "sqlite":
+        return SQLiteConversationStore(history_dir, legacy_file=legacy_file)
+    raise ValueError(f"Backend de historial no reconocido: {backend}")
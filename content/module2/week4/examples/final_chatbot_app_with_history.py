@@ -1,10 +1,17 @@
 import streamlit as st
+import asyncio
 import time
 import plotly.express as px
 import pandas as pd
 from datetime import datetime, timedelta
-from collections import deque, defaultdict
-from openai import OpenAI
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import heapq
+import math
+import threading
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 import os
 from dotenv import load_dotenv
 import logging
@@ -12,18 +19,111 @@ import json
 from pathlib import Path
 import uuid
 from streamlit.runtime.scriptrunner import get_script_run_ctx
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from context_builder import ContextBuilder
+from conversation_store import open_conversation_store
+from history_analytics import analyze_history
+from history_archive import ARCHIVE_DIR_NAME, HistoryArchive
+from history_export import ExportJob, default_export_path, export_history, export_incremental
+from history_search import HistorySearchIndex
+from semantic_cache import SemanticCache, default_threshold as semantic_cache_threshold
+from streaming_quantiles import StreamingSummary
+from token_accounting import count_message_tokens, estimate_usage, tokenizer_name, usage_from_response
 
 # Configuración de directorios
 HISTORY_DIR = Path("chat_history")
 HISTORY_DIR.mkdir(exist_ok=True)
 
-# Definir costos por modelo (por 1K tokens)
+# Caché de interacciones: tamaño y expiración configurables por despliegue
+CACHE_MAX_INTERACTIONS = int(os.getenv("CHAT_CACHE_SIZE", "3"))
+CACHE_TTL_MINUTES = float(os.getenv("CHAT_CACHE_TTL_MINUTES", "30"))
+
+# Conversaciones por página en el historial
+HISTORY_PAGE_SIZE = 20
+
+# Antigüedad a partir de la cual se archivan conversaciones (días)
+ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "30"))
+
+# Exportaciones más grandes no se ofrecen para descargar desde la app (MB)
+EXPORT_DOWNLOAD_MAX_MB = int(os.getenv("EXPORT_DOWNLOAD_MAX_MB", "50"))
+
+# Variable de entorno con la API key de cada modelo
+MODEL_API_KEY_ENV = {
+    "GPT-3.5": "GPT35_API_KEY",
+    "Deepseek": "DEEPSEEK_API_KEY",
+    "LLaMA-2": "LLAMA_API_KEY"
+}
+
+# Proveedor de cada modelo: prefijo de sus variables de entorno, endpoint y modelo por defecto.
+# Deepseek y LLaMA responden de forma simulada hasta que se configura <PREFIJO>_BASE_URL
+# (por ejemplo https://api.deepseek.com o el servidor local de mock_openai_server.py)
+MODEL_PROVIDERS = {
+    "GPT-3.5": {"env_prefix": "OPENAI", "base_url": "https://api.openai.com/v1", "model": "gpt-3.5-turbo"},
+    "Deepseek": {"env_prefix": "DEEPSEEK", "base_url": None, "model": "deepseek-chat"},
+    "LLaMA-2": {"env_prefix": "LLAMA", "base_url": None, "model": "llama-2-70b-chat"}
+}
+
+def provider_settings(model_name):
+    """Endpoint, modelo, timeout (s), reintentos y conexiones máximas del proveedor de `model_name`"""
+    provider = MODEL_PROVIDERS[model_name]
+    prefix = provider["env_prefix"]
+    return {
+        "base_url": os.getenv(f"{prefix}_BASE_URL", provider["base_url"]),
+        "model": os.getenv(f"{prefix}_MODEL", provider["model"]),
+        "timeout": float(os.getenv(f"{prefix}_TIMEOUT", "30")),
+        "max_retries": int(os.getenv(f"{prefix}_MAX_RETRIES", "2")),
+        "max_connections": int(os.getenv(f"{prefix}_MAX_CONNECTIONS", "20")),
+        # Pedir el conteo de tokens al final del streaming (stream_options); 0 si el servidor no lo soporta
+        "stream_usage": os.getenv(f"{prefix}_STREAM_USAGE", "1") == "1"
+    }
+
+# Cada cuántos segundos se verifica un modelo sano; tras un error se verifica en el siguiente uso,
+# pero no más de una vez cada MODEL_HEALTH_RECHECK_SECONDS
+MODEL_HEALTH_CHECK_INTERVAL = int(os.getenv("MODEL_HEALTH_CHECK_INTERVAL", "300"))
+MODEL_HEALTH_RECHECK_SECONDS = int(os.getenv("MODEL_HEALTH_RECHECK_SECONDS", "30"))
+
+# Configuración de los modelos al iniciar la sesión, y la que se usa fuera de Streamlit
+# (history_replay.py) cuando no se pasa `config`
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_TOKENS = 150
+
+def default_model_config():
+    return {"temperatura": DEFAULT_TEMPERATURE, "max_tokens": DEFAULT_MAX_TOKENS}
+
+# Prompts en vuelo a la vez por defecto en generate_batch
+MODEL_BATCH_CONCURRENCY = int(os.getenv("MODEL_BATCH_CONCURRENCY", "8"))
+
+# Costos por modelo (por 1K tokens), separados para tokens de entrada (prompt) y de salida (respuesta)
 MODEL_COSTS = {
-    "GPT-3.5": 0.002,  # $0.002 por 1K tokens
-    "Deepseek": 0.001, # $0.001 por 1K tokens (simulado)
-    "LLaMA-2": 0.0015  # $0.0015 por 1K tokens (simulado)
+    "GPT-3.5": {"input": 0.0005, "output": 0.0015},
+    "Deepseek": {"input": 0.00027, "output": 0.0011},  # precios de referencia de deepseek-chat
+    "LLaMA-2": {"input": 0.0009, "output": 0.0009}     # precios de referencia de un proveedor de llama-2-70b
 }
 
+def model_cost(model_name, input_tokens, output_tokens):
+    prices = MODEL_COSTS[model_name]
+    return (input_tokens * prices["input"] + output_tokens * prices["output"]) / 1000
+
+# Opción del selector de modelos que elige el modelo de cada request con ModelRouter
+AUTO_MODEL = "Auto"
+# Ventana del router: últimos N requests por modelo, y no más viejos que estos segundos
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "50"))
+ROUTER_WINDOW_SECONDS = int(os.getenv("ROUTER_WINDOW_SECONDS", "600"))
+# Con menos requests en la ventana un modelo se considera sin datos
+ROUTER_MIN_SAMPLES = 5
+# Tasa de errores a partir de la cual un modelo queda como último recurso
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+# Largo de prompt (tokens) con el que el costo pesa el doble que la latencia
+ROUTER_LONG_PROMPT_TOKENS = int(os.getenv("ROUTER_LONG_PROMPT_TOKENS", "500"))
+
+# Tamaño de los ring buffers de métricas por sesión: requests recientes por modelo (gráficos de
+# latencia) y registros de costo recientes (gráfico por minuto). Totales y percentiles no dependen de esto
+METRICS_RECENT_REQUESTS = int(os.getenv("METRICS_RECENT_REQUESTS", "200"))
+METRICS_RECENT_COSTS = int(os.getenv("METRICS_RECENT_COSTS", "1000"))
+
+# Módulos cuyos logs van al mismo archivo y consola que los de la app
+LIBRARY_LOGGERS = ("conversation_store", "context_builder", "semantic_cache", "token_accounting")
+
 class StreamlitLogger:
     _instance = None
     _logger = None
@@ -67,6 +167,13 @@ class StreamlitLogger:
             
             # Asegurar que los mensajes se propaguen
             logger.propagate = False
+
+            # Los módulos del historial registran con logging.getLogger(__name__)
+            for name in LIBRARY_LOGGERS:
+                library_logger = logging.getLogger(name)
+                library_logger.setLevel(logging.INFO)
+                library_logger.handlers = logger.handlers
+                library_logger.propagate = False
             
             return logger
         return self._logger
@@ -87,63 +194,195 @@ class StreamlitLogger:
             return self._logger
 
 class MetricsCollector:
+    """Métricas de la sesión en memoria constante.
+    
+    Latencia y TTFT se resumen por modelo con sketches de cuantiles (p50/p95/p99)
+    y se guardan solo los últimos valores en ring buffers para los gráficos.
+    """
     @staticmethod
     def initialize_metrics():
-        if 'metrics' not in st.session_state:
-            st.session_state.metrics = {
-                'requests_count': 0,
-                'error_count': 0,
-                'response_times': [],
-                'model_usage': {},
-                'token_usage': {},
-                'costs': [],
-                'costs_by_model': defaultdict(float)
-            }
+        defaults = {
+            'requests_count': 0,
+            'error_count': 0,
+            'latency': StreamingSummary(),
+            'ttft': StreamingSummary(),
+            'latency_by_model': {},
+            'ttft_by_model': {},
+            'recent_response_times': {},
+            'recent_ttft': {},
+            'model_usage': {},
+            'token_usage': {},
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'token_sources': {},
+            'costs': deque(maxlen=METRICS_RECENT_COSTS),
+            'costs_by_model': defaultdict(float)
+        }
+        metrics = st.session_state.setdefault('metrics', {})
+        # Las sesiones abiertas antes de agregar una métrica reciben solo las claves que les faltan
+        for key, value in defaults.items():
+            metrics.setdefault(key, value)
     
     def __init__(self):
         self.logger = StreamlitLogger().get_logger()
         MetricsCollector.initialize_metrics()
     
-    def log_request(self, model_name, response_time, tokens_used):
+    def log_request(self, model_name, response_time, usage, ttft=None):
+        """Registra un request.
+        
+        `usage` es el conteo de tokens de entrada y salida (ver token_accounting) y
+        `ttft` el tiempo hasta el primer token en respuestas en streaming.
+        """
+        tokens_used = usage["total_tokens"]
+        ttft_info = f", ttft={ttft:.2f}s" if ttft is not None else ""
         self.logger.info(
-            f"Request: modelo={model_name}, tiempo={response_time:.2f}s, "
-            f"tokens={tokens_used}"
+            f"Request: modelo={model_name}, tiempo={response_time:.2f}s{ttft_info}, "
+            f"tokens={usage['prompt_tokens']}+{usage['completion_tokens']} ({usage['source']})"
         )
         
         metrics = st.session_state.metrics
         metrics['requests_count'] += 1
-        metrics['response_times'].append(response_time)
         
         if model_name not in metrics['model_usage']:
             metrics['model_usage'][model_name] = 0
             metrics['token_usage'][model_name] = 0
+            metrics['latency_by_model'][model_name] = StreamingSummary()
+            metrics['ttft_by_model'][model_name] = StreamingSummary()
+            metrics['recent_response_times'][model_name] = deque(maxlen=METRICS_RECENT_REQUESTS)
+            metrics['recent_ttft'][model_name] = deque(maxlen=METRICS_RECENT_REQUESTS)
+        
+        metrics['latency'].add(response_time)
+        metrics['latency_by_model'][model_name].add(response_time)
+        metrics['recent_response_times'][model_name].append(response_time)
+        if ttft is not None:
+            metrics['ttft'].add(ttft)
+            metrics['ttft_by_model'][model_name].add(ttft)
+            metrics['recent_ttft'][model_name].append(ttft)
             
         metrics['model_usage'][model_name] += 1
         metrics['token_usage'][model_name] += tokens_used
+        metrics['input_tokens'] += usage['prompt_tokens']
+        metrics['output_tokens'] += usage['completion_tokens']
+        token_sources = metrics['token_sources']
+        token_sources[usage['source']] = token_sources.get(usage['source'], 0) + 1
         
         # Calcular y registrar costo
-        cost = (tokens_used / 1000) * MODEL_COSTS[model_name]
+        cost = model_cost(model_name, usage['prompt_tokens'], usage['completion_tokens'])
         metrics['costs'].append({
             'timestamp': datetime.now(),
             'model': model_name,
             'cost': cost,
-            'tokens': tokens_used
+            'tokens': tokens_used,
+            'input_tokens': usage['prompt_tokens'],
+            'output_tokens': usage['completion_tokens']
         })
         metrics['costs_by_model'][model_name] += cost
+        get_model_router().record_success(model_name, response_time)
         
         self.logger.info(
             f"Métricas actualizadas: total_requests={metrics['requests_count']}, "
             f"costo_actual=${cost:.4f}, costo_total=${sum(metrics['costs_by_model'].values()):.4f}"
         )
+        return cost
     
     def log_error(self, model_name, error_type):
         self.logger.error(f"Error en modelo {model_name}: {error_type}")
         st.session_state.metrics['error_count'] += 1
+        get_model_router().record_failure(model_name)
+
+@st.cache_resource
+def get_conversation_store():
+    """Store de historial único por proceso, compartido entre sesiones y reruns"""
+    return open_conversation_store(HISTORY_DIR)
+
+@st.cache_resource
+def get_search_index():
+    """Índice de texto completo sobre los mensajes, compartido por proceso"""
+    index = HistorySearchIndex(HISTORY_DIR / "search.db")
+    index.ensure_built(get_conversation_store())
+    return index
+
+@st.cache_resource
+def get_history_archive():
+    """Segmentos comprimidos con las conversaciones viejas, compartidos por proceso"""
+    return HistoryArchive(HISTORY_DIR / ARCHIVE_DIR_NAME)
+
+@st.cache_resource
+def semantic_cache_handle():
+    """Referencia al caché semántico una vez creado, para mostrar sus métricas sin cargar el modelo"""
+    return {}
+
+@st.cache_resource(show_spinner="Cargando modelo de embeddings...")
+def get_semantic_cache():
+    """Caché semántico de respuestas compartido por todas las sesiones del proceso"""
+    cache = SemanticCache()
+    semantic_cache_handle()["cache"] = cache
+    return cache
+
+@st.cache_data(ttl=600, show_spinner="Calculando estadísticas del historial...")
+def load_history_analytics():
+    """Estadísticas del historial completo (store activo y archivo), recalculadas cada 10 minutos"""
+    # Sin pool de procesos: hacer fork del proceso de Streamlit copia sus hilos y locks
+    return analyze_history(HISTORY_DIR, store=get_conversation_store(), workers=1)
+
+class InteractionCache:
+    """Últimas interacciones usuario/asistente con expiración por TTL.
+
+    Agregar una interacción es O(1); la expiración usa un heap ordenado por
+    reloj monotónico, así que solo se miran las entradas vencidas.
+    """
+    def __init__(self, max_size=CACHE_MAX_INTERACTIONS, ttl_minutes=CACHE_TTL_MINUTES):
+        self.max_size = max_size
+        self.ttl = timedelta(minutes=ttl_minutes)
+        self._entries = OrderedDict()  # seq -> interacción, de la más vieja a la más nueva
+        self._expiry_heap = []  # (expira_en_monotonic, seq)
+        self._seq = 0
+    
+    def add(self, user_message, assistant_message, timestamp=None):
+        timestamp = timestamp or datetime.now()
+        age = (datetime.now() - timestamp).total_seconds()
+        expires_at = time.monotonic() + self.ttl.total_seconds() - age
+        self._seq += 1
+        self._entries[self._seq] = {
+            "timestamp": timestamp,
+            "user_message": user_message,
+            "assistant_message": assistant_message
+        }
+        heapq.heappush(self._expiry_heap, (expires_at, self._seq))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self.expire()
+    
+    def expire(self):
+        now = time.monotonic()
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, seq = heapq.heappop(self._expiry_heap)
+            self._entries.pop(seq, None)
+        # Entradas desalojadas por tamaño siguen en el heap hasta vencer; acotar el heap
+        if len(self._expiry_heap) > 4 * self.max_size:
+            self._expiry_heap = [item for item in self._expiry_heap if item[1] in self._entries]
+            heapq.heapify(self._expiry_heap)
+    
+    def clear(self):
+        self._entries.clear()
+        self._expiry_heap.clear()
+    
+    def interactions(self):
+        self.expire()
+        return list(self._entries.values())
+    
+    def time_left(self, interaction):
+        return interaction["timestamp"] + self.ttl - datetime.now()
+    
+    def __len__(self):
+        self.expire()
+        return len(self._entries)
 
 class ConversationManager:
+    """Vista por sesión sobre el store compartido: conoce la conversación activa de la sesión"""
     def __init__(self):
         self.logger = StreamlitLogger().get_logger()
-        self.history_file = HISTORY_DIR / "conversations.json"
+        self.store = get_conversation_store()
         self.current_conversation_id = self._get_or_create_conversation_id()
         self._load_or_initialize_history()
         self.logger.info(f"ConversationManager inicializado. ID actual: {self.current_conversation_id}")
@@ -154,156 +393,535 @@ class ConversationManager:
         return st.session_state.conversation_id
     
     def _load_or_initialize_history(self):
-        if self.history_file.exists():
-            with open(self.history_file, 'r') as f:
-                self.history = json.load(f)
-        else:
-            self.history = {}
-        
-        if self.current_conversation_id not in self.history:
-            self.history[self.current_conversation_id] = {
-                "created_at": datetime.now().isoformat(),
-                "messages": []
-            }
+        # La conversación se persiste recién con su primer mensaje
+        if 'conversation_created_at' not in st.session_state:
+            st.session_state.conversation_created_at = datetime.now().isoformat()
     
     def save_message(self, message):
         self.logger.info(f"Guardando mensaje en conversación {self.current_conversation_id[:8]}")
-        self.history[self.current_conversation_id]["messages"].append({
-            "timestamp": datetime.now().isoformat(),
-            **message
-        })
-        
-        with open(self.history_file, 'w') as f:
-            json.dump(self.history, f, indent=2)
+        now = datetime.now()
+        stored_message = {"timestamp": now.isoformat(), **message}
+        if not self.store.has_conversation(self.current_conversation_id):
+            # Se archivó mientras estaba abierta: se restaura para no partirla en dos
+            self._restore_from_archive(self.current_conversation_id)
+        self.store.append_message(
+            self.current_conversation_id,
+            stored_message,
+            created_at=st.session_state.conversation_created_at
+        )
+        try:
+            get_search_index().add_message(self.current_conversation_id, stored_message)
+        except Exception as e:
+            self.logger.error(f"Error indexando mensaje para búsqueda: {str(e)}")
         
-        self._update_cache()
+        self._update_cache(stored_message, now)
         self.logger.debug(f"Mensaje guardado y caché actualizado")
     
-    def _update_cache(self):
-        messages = self.history[self.current_conversation_id]["messages"]
-        
-        st.session_state.conversation_cache.clear()
-        st.session_state.cache_timestamps.clear()
+    def _update_cache(self, message, timestamp):
+        """Agrega al caché solo el par usuario/asistente recién completado"""
+        if message["role"] == "user":
+            st.session_state.last_user_message = message
+        elif message["role"] == "assistant" and st.session_state.get("last_user_message"):
+            st.session_state.conversation_cache.add(st.session_state.last_user_message, message, timestamp)
+            st.session_state.last_user_message = None
+    
+    def _rebuild_cache(self):
+        """Reconstruye el caché desde las últimas interacciones de la conversación actual"""
+        messages = self.get_current_conversation()
+        cache = st.session_state.conversation_cache
+        cache.clear()
+        st.session_state.last_user_message = None
         
         interactions = []
-        for i in range(len(messages)-1, -1, -2):
-            if i > 0:
-                assistant_msg = messages[i]
-                user_msg = messages[i-1]
-                
-                interaction = {
-                    "timestamp": datetime.fromisoformat(assistant_msg["timestamp"]),
-                    "user_message": user_msg,
-                    "assistant_message": assistant_msg
-                }
-                interactions.insert(0, interaction)
-                
-                if len(interactions) >= 3:
-                    break
+        for i in range(len(messages)-1, 0, -2):
+            interactions.append((messages[i-1], messages[i]))
+            if len(interactions) >= cache.max_size:
+                break
         
-        for interaction in interactions:
-            st.session_state.conversation_cache.append(interaction)
-            st.session_state.cache_timestamps.append(interaction["timestamp"])
+        for user_msg, assistant_msg in reversed(interactions):
+            cache.add(user_msg, assistant_msg, datetime.fromisoformat(assistant_msg["timestamp"]))
     
     def get_current_conversation(self):
-        return self.history[self.current_conversation_id]["messages"]
+        return self.store.get_messages(self.current_conversation_id)
+    
+    def build_context(self, prompt, model=None):
+        """Mensajes previos de la conversación actual que entran en el presupuesto de tokens.
+        
+        Los turnos viejos los resume `model` (con generate, que pasa por su circuit
+        breaker); sin modelo, o si falla, el resumen es extractivo. El resumen se
+        guarda por conversación en la sesión y solo se recalcula cuando turnos
+        nuevos salen de la ventana.
+        """
+        history = self.get_current_conversation()
+        if history and history[-1]["role"] == "user" and history[-1].get("content") == prompt:
+            history = history[:-1]
+        
+        def summarize(summary_prompt):
+            start_time = time.time()
+            summary = model.generate(summary_prompt)
+            MetricsCollector().log_request(
+                model.name,
+                time.time() - start_time,
+                estimate_usage([{"role": "user", "content": summary_prompt}], summary)
+            )
+            self.logger.info(f"Resumen de contexto actualizado para conversación {self.current_conversation_id[:8]}")
+            return summary
+        
+        states = st.session_state.setdefault('context_summaries', {})
+        context, states[self.current_conversation_id] = ContextBuilder(summarize if model else None).build(
+            history, prompt, states.get(self.current_conversation_id)
+        )
+        return context
     
     def new_conversation(self):
         old_id = self.current_conversation_id
         st.session_state.conversation_id = str(uuid.uuid4())
+        st.session_state.conversation_created_at = datetime.now().isoformat()
         self.current_conversation_id = st.session_state.conversation_id
-        self.history[self.current_conversation_id] = {
-            "created_at": datetime.now().isoformat(),
-            "messages": []
-        }
         st.session_state.conversation_cache.clear()
-        st.session_state.cache_timestamps.clear()
+        st.session_state.last_user_message = None
         self.logger.info(f"Nueva conversación creada. ID anterior: {old_id[:8]}, Nuevo ID: {self.current_conversation_id[:8]}")
     
-    def list_conversations(self):
-        return [{
-            "id": conv_id,
-            "created_at": data["created_at"],
-            "message_count": len(data["messages"])
-        } for conv_id, data in self.history.items()]
+    def list_conversations(self, offset=0, limit=None, query=None):
+        """Metadatos de conversaciones (sin mensajes), de la más reciente a la más antigua"""
+        return self.store.list_conversations(offset=offset, limit=limit, query=query)
+
+    def _restore_from_archive(self, conversation_id):
+        """Devuelve una conversación archivada al store activo para poder continuarla"""
+        archive = get_history_archive()
+        archived = archive.load_conversation(conversation_id)
+        if archived is None:
+            return False
+        for message in archived["messages"]:
+            self.store.append_message(conversation_id, message, created_at=archived["created_at"])
+            get_search_index().add_message(conversation_id, message)
+        archive.release(conversation_id)
+        self.logger.info(f"Conversación {conversation_id[:8]} restaurada desde el archivo")
+        return True
 
     def load_conversation(self, conversation_id):
-        """Carga una conversación existente y actualiza el caché"""
-        if conversation_id in self.history:
+        """Carga una conversación existente (o archivada) y actualiza el caché"""
+        if self.store.has_conversation(conversation_id) or self._restore_from_archive(conversation_id):
             st.session_state.conversation_id = conversation_id
             self.current_conversation_id = conversation_id
-            # Actualizar el caché con las últimas 3 interacciones de esta conversación
-            self._update_cache()
+            # Actualizar el caché con las últimas interacciones de esta conversación
+            self._rebuild_cache()
             return True
         return False
 
+class AsyncRunner:
+    """Event loop en un hilo propio donde corren las llamadas async de los modelos.
+    
+    Un único loop por proceso permite reutilizar los clientes async (y sus
+    pools de conexiones) entre reruns y sesiones; el código de Streamlit, que
+    es síncrono, le envía corrutinas con `run`.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        # Hilos para modelos sin agenerate nativo (el default depende de la cantidad de CPUs)
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=32))
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+    
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+@st.cache_resource
+def get_async_runner():
+    return AsyncRunner()
+
 class ModelBase:
+    """Interfaz de los modelos.
+    
+    generate, generate_stream y agenerate pasan por el circuit breaker del
+    proveedor; los modelos implementan _generate y, si pueden, _generate_stream
+    y _agenerate.
+    """
     def __init__(self, name, api_key=None):
         self.name = name
-        env_key_map = {
-            "GPT-3.5": "GPT35_API_KEY",
-            "Deepseek": "DEEPSEEK_API_KEY",
-            "LLaMA-2": "LLAMA_API_KEY"
-        }
-        
-        env_key_name = env_key_map.get(name)
+        env_key_name = MODEL_API_KEY_ENV.get(name)
         if not env_key_name:
             raise ValueError(f"Nombre de modelo no reconocido: {name}")
             
         self.api_key = api_key or os.getenv(env_key_name)
         if not self.api_key:
             raise ValueError(f"No se encontró API key para el modelo {name} (variable: {env_key_name})")
+        # ModelRegistry lo reemplaza por el breaker compartido del proveedor
+        self.breaker = CircuitBreaker(name, logger=StreamlitLogger().get_logger())
+    
+    def generate(self, prompt, context=None):
+        """`context` son los mensajes previos de la conversación (ver ContextBuilder)"""
+        with self.breaker.call():
+            return self._generate(prompt, context)
+    
+    def generate_stream(self, prompt, context=None):
+        """Genera la respuesta en fragmentos.
+        
+        Al terminar, el generador devuelve (StopIteration.value) el conteo de
+        tokens informado por la API, o None si no lo hubo.
+        """
+        with self.breaker.call():
+            return (yield from self._generate_stream(prompt, context))
     
-    def generate(self, prompt):
+    async def agenerate(self, prompt, config=None, context=None):
+        """Versión async de generate.
+        
+        `config` es la configuración de la sesión (temperatura, max_tokens), que
+        se captura antes porque st.session_state no está disponible fuera del
+        hilo del script.
+        """
+        with self.breaker.call():
+            return await self._agenerate(prompt, config, context)
+    
+    def _generate(self, prompt, context=None, config=None):
+        """`config` es None en el hilo del script: cada modelo la lee de st.session_state"""
         raise NotImplementedError("Los modelos específicos deben implementar este método")
+    
+    def _generate_stream(self, prompt, context=None):
+        """Por defecto un solo fragmento con la respuesta completa"""
+        yield self._generate(prompt, context)
+    
+    async def _agenerate(self, prompt, config=None, context=None):
+        """Por defecto corre _generate en un hilo del loop, con la configuración ya capturada"""
+        return await asyncio.to_thread(self._generate, prompt, context, config or default_model_config())
+    
+    async def agenerate_batch(self, prompts, max_concurrency=MODEL_BATCH_CONCURRENCY, config=None):
+        """Respuestas en el mismo orden que `prompts`, con a lo sumo `max_concurrency` en vuelo.
+        
+        Un prompt que falla devuelve su excepción en su posición, sin cancelar el resto.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(prompt):
+            async with semaphore:
+                return await self.agenerate(prompt, config)
+        
+        return await asyncio.gather(*(run(prompt) for prompt in prompts), return_exceptions=True)
+    
+    def generate_batch(self, prompts, max_concurrency=MODEL_BATCH_CONCURRENCY, config=None):
+        """Versión síncrona de agenerate_batch para usar desde Streamlit"""
+        config = config or st.session_state.get("config")
+        return get_async_runner().run(self.agenerate_batch(prompts, max_concurrency, config))
+    
+    def health_check(self):
+        """True si el modelo puede atender requests; los modelos simulados siempre lo están"""
+        return True
 
-class OpenAIModel(ModelBase):
-    def __init__(self):
+class StreamTimer:
+    """Envuelve un stream de texto, mide el tiempo hasta el primer fragmento (TTFT)
+    y guarda en `usage` el conteo de tokens que devuelve generate_stream"""
+    def __init__(self, chunks, start_time):
+        self.chunks = chunks
+        self.start_time = start_time
+        self.ttft = None
+        self.usage = None
+    
+    def __iter__(self):
+        chunks = iter(self.chunks)
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration as stop:
+                self.usage = stop.value
+                return
+            if chunk and self.ttft is None:
+                self.ttft = time.time() - self.start_time
+            yield chunk
+
+class OpenAICompatibleModel(ModelBase):
+    """Modelo servido por un endpoint compatible con la API de OpenAI (/chat/completions).
+    
+    Cada proveedor tiene sus propios clientes (sync y async) con pool de
+    conexiones, timeout y reintentos; ver provider_settings. Si el proveedor no
+    tiene base URL configurada, el modelo responde de forma simulada.
+    """
+    def __init__(self, name):
+        self.logger = StreamlitLogger().get_logger()
         try:
-            super().__init__("GPT-3.5")
-            self.client = OpenAI(api_key=self.api_key)
-            self.logger = StreamlitLogger().get_logger()
-            self.logger.info("Modelo OpenAI inicializado correctamente")
+            super().__init__(name)
+            settings = provider_settings(name)
+            self.model = settings["model"]
+            self.base_url = settings["base_url"]
+            self.stream_usage = settings["stream_usage"]
+            if self.base_url is None:
+                self.client = self.async_client = None
+                self.logger.info(f"Modelo {name} en modo simulado (sin base URL configurada)")
+                return
+            
+            limits = httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_connections"]
+            )
+            client_options = {
+                "api_key": self.api_key,
+                "base_url": self.base_url,
+                "timeout": httpx.Timeout(settings["timeout"], connect=min(5.0, settings["timeout"])),
+                "max_retries": settings["max_retries"]
+            }
+            self.client = OpenAI(**client_options, http_client=DefaultHttpxClient(limits=limits))
+            self.async_client = AsyncOpenAI(**client_options, http_client=DefaultAsyncHttpxClient(limits=limits))
+            self.logger.info(f"Modelo {name} inicializado correctamente ({self.model} en {self.base_url})")
         except Exception as e:
-            self.logger = StreamlitLogger().get_logger()
-            self.logger.error(f"Error inicializando OpenAI: {str(e)}")
+            self.logger.error(f"Error inicializando {name}: {str(e)}")
             raise
     
-    def generate(self, prompt):
+    def simulate(self, prompt):
+        return f"Respuesta simulada de {self.name}: {prompt}"
+    
+    def _completion_params(self, prompt, config=None, context=None):
+        config = config or st.session_state.get("config") or default_model_config()
+        return {
+            "model": self.model,
+            "messages": (context or []) + [{"role": "user", "content": prompt}],
+            "temperature": config["temperatura"],
+            "max_tokens": config["max_tokens"]
+        }
+    
+    def _generate(self, prompt, context=None, config=None):
+        if self.client is None:
+            return self.simulate(prompt)
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=st.session_state.config["temperatura"],
-                max_tokens=st.session_state.config["max_tokens"]
+            response = self.client.chat.completions.create(**self._completion_params(prompt, config, context))
+            return response.choices[0].message.content
+        except Exception as e:
+            self.logger.error(f"Error en {self.name}: {str(e)}")
+            raise
+    
+    async def _agenerate(self, prompt, config=None, context=None):
+        if self.async_client is None:
+            return self.simulate(prompt)
+        try:
+            response = await self.async_client.chat.completions.create(
+                **self._completion_params(prompt, config, context)
             )
             return response.choices[0].message.content
         except Exception as e:
-            self.logger.error(f"Error en OpenAI: {str(e)}")
+            self.logger.error(f"Error en {self.name} (async): {str(e)}")
+            raise
+    
+    def _generate_stream(self, prompt, context=None):
+        if self.client is None:
+            yield self.simulate(prompt)
+            return
+        try:
+            params = self._completion_params(prompt, context=context)
+            if self.stream_usage:
+                # El último chunk trae el conteo de tokens (sin choices)
+                params["stream_options"] = {"include_usage": True}
+            usage = None
+            for chunk in self.client.chat.completions.create(**params, stream=True):
+                if getattr(chunk, "usage", None):
+                    usage = usage_from_response(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            return usage
+        except Exception as e:
+            self.logger.error(f"Error en {self.name} (streaming): {str(e)}")
             raise
+    
+    def health_check(self):
+        if self.client is None:
+            return True
+        try:
+            # Request liviano que reutiliza el pool de conexiones del cliente
+            self.client.with_options(timeout=5.0, max_retries=0).models.retrieve(self.model)
+            return True
+        except Exception as e:
+            self.logger.warning(f"Health check de {self.name} fallido: {str(e)}")
+            return False
 
-class DeepseekModel(ModelBase):
+class OpenAIModel(OpenAICompatibleModel):
+    def __init__(self):
+        super().__init__("GPT-3.5")
+
+class DeepseekModel(OpenAICompatibleModel):
     def __init__(self):
         super().__init__("Deepseek")
     
-    def generate(self, prompt):
+    def simulate(self, prompt):
         return f"Respuesta simulada de Deepseek: {prompt}"
 
-class LlamaModel(ModelBase):
+class LlamaModel(OpenAICompatibleModel):
     def __init__(self):
         super().__init__("LLaMA-2")
     
-    def generate(self, prompt):
+    def simulate(self, prompt):
         return f"Respuesta simulada de LLaMA: {prompt}"
 
-def get_model_instance(model_name):
-    model_map = {
+class ModelRegistry:
+    """Instancias de modelos compartidas por proceso.
+    
+    Cada modelo se construye una vez (con su cliente HTTP y pool de conexiones)
+    y se reutiliza en todos los reruns y sesiones. Se reconstruye solo si cambia
+    su configuración (API key o provider_settings) o si falla el health check, que corre cada
+    MODEL_HEALTH_CHECK_INTERVAL segundos o en el siguiente uso tras un error (como mucho cada
+    MODEL_HEALTH_RECHECK_SECONDS). Con el circuit breaker abierto no se verifica: los requests
+    no llegan al proveedor y reconstruir el modelo no cambia nada.
+    """
+    def __init__(self, factories):
+        self.factories = factories
+        self.lock = threading.Lock()
+        self._entries = {}
+        self.logger = StreamlitLogger().get_logger()
+        # Los breakers sobreviven a la reconstrucción de las instancias
+        self._breakers = {name: CircuitBreaker(name, logger=self.logger) for name in factories}
+    
+    @staticmethod
+    def _fingerprint(model_name):
+        api_key = os.getenv(MODEL_API_KEY_ENV.get(model_name, ""), "")
+        settings = json.dumps(provider_settings(model_name), sort_keys=True)
+        return hashlib.sha256(f"{api_key}\n{settings}".encode()).hexdigest()
+    
+    def get(self, model_name):
+        fingerprint = self._fingerprint(model_name)
+        with self.lock:
+            entry = self._entries.get(model_name)
+            if entry and entry["fingerprint"] == fingerprint:
+                if not self._needs_check(model_name, entry):
+                    return entry["instance"]
+                entry["checking"] = True
+            else:
+                if entry:
+                    self.logger.info(f"Reconstruyendo modelo {model_name}: cambió su configuración")
+                return self._build(model_name, fingerprint)
+        
+        # El health check (hasta 5 s de red) corre fuera del lock: mientras tanto los demás
+        # modelos, y este mismo en otras sesiones, se siguen atendiendo con la instancia actual
+        try:
+            healthy = entry["instance"].health_check()
+        except Exception as e:
+            self.logger.warning(f"Health check de {model_name} fallido: {str(e)}")
+            healthy = False
+        with self.lock:
+            entry["checking"] = False
+            entry["checked_at"] = time.monotonic()
+            entry["healthy"] = healthy
+            current = self._entries.get(model_name)
+            if healthy or current is not entry:
+                return current["instance"]
+            self.logger.warning(f"Reconstruyendo modelo {model_name}: health check fallido")
+            return self._build(model_name, fingerprint)
+    
+    def _needs_check(self, model_name, entry):
+        if entry["checking"] or self._breakers[model_name].is_open():
+            return False
+        age = time.monotonic() - entry["checked_at"]
+        return age >= (MODEL_HEALTH_CHECK_INTERVAL if entry["healthy"] else MODEL_HEALTH_RECHECK_SECONDS)
+    
+    def _build(self, model_name, fingerprint):
+        """Construye la instancia y la registra; se llama con el lock tomado"""
+        instance = self.factories[model_name]()
+        instance.breaker = self._breakers[model_name]
+        self._entries[model_name] = {
+            "instance": instance,
+            "fingerprint": fingerprint,
+            "healthy": True,
+            "checking": False,
+            "checked_at": time.monotonic()
+        }
+        return instance
+    
+    def breakers(self):
+        return dict(self._breakers)
+    
+    def is_open(self, model_name):
+        return self._breakers[model_name].is_open()
+    
+    def report_failure(self, model_name):
+        """Marca el modelo para verificarlo antes de volver a usarlo"""
+        with self.lock:
+            if model_name in self._entries:
+                self._entries[model_name]["healthy"] = False
+
+@st.cache_resource
+def get_model_registry():
+    """Registro de modelos único por proceso"""
+    return ModelRegistry({
         "GPT-3.5": OpenAIModel,
         "Deepseek": DeepseekModel,
         "LLaMA-2": LlamaModel
-    }
+    })
+
+class ModelRouter:
+    """Elige el modelo de cada request en modo Auto.
+    
+    Con los requests recientes de cada modelo (los de todas las sesiones) estima
+    el p95 de latencia y la tasa de errores. Cada modelo recibe un puntaje
+    relativo al mejor candidato: latencia p95 más costo estimado del request
+    (el costo pesa más cuanto más largo es el prompt), dividido por la
+    probabilidad de éxito. Los modelos degradados quedan al final y solo se
+    usan si fallan los demás. Un modelo sin datos recientes se asume tan rápido
+    como el mejor, así vuelve a probarse cuando sus errores salen de la ventana.
+    """
+    def __init__(self, model_names):
+        self.model_names = list(model_names)
+        self.lock = threading.Lock()
+        # (instante, latencia) por request; latencia None = error
+        self._requests = {name: deque(maxlen=ROUTER_WINDOW) for name in self.model_names}
+    
+    def record_success(self, model_name, response_time):
+        with self.lock:
+            if model_name in self._requests:
+                self._requests[model_name].append((time.monotonic(), response_time))
+    
+    def record_failure(self, model_name):
+        with self.lock:
+            if model_name in self._requests:
+                self._requests[model_name].append((time.monotonic(), None))
+    
+    def stats(self):
+        """Requests en la ventana, p95 de latencia (None sin datos suficientes) y tasa de errores por modelo"""
+        since = time.monotonic() - ROUTER_WINDOW_SECONDS
+        with self.lock:
+            windows = {name: [latency for at, latency in requests if at >= since]
+                       for name, requests in self._requests.items()}
+        stats = {}
+        for name, window in windows.items():
+            latencies = sorted(latency for latency in window if latency is not None)
+            enough = len(window) >= ROUTER_MIN_SAMPLES
+            stats[name] = {
+                "requests": len(window),
+                "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if enough and latencies else None,
+                "error_rate": (len(window) - len(latencies)) / len(window) if enough else 0.0
+            }
+        return stats
+    
+    def rank(self, prompt, max_tokens, available=None):
+        """Modelos de `available` (por defecto todos) ordenados del más conveniente al menos conveniente"""
+        candidates = [name for name in self.model_names if available is None or name in available]
+        if not candidates:
+            return []
+        stats = self.stats()
+        prompt_tokens = count_message_tokens([{"role": "user", "content": prompt}])
+        known_latencies = [stats[name]["p95"] for name in candidates if stats[name]["p95"] is not None]
+        best_latency = max(min(known_latencies), 1e-3) if known_latencies else 1.0
+        costs = {name: model_cost(name, prompt_tokens, max_tokens) for name in candidates}
+        best_cost = min(costs.values()) or 1.0
+        cost_weight = 1 + prompt_tokens / ROUTER_LONG_PROMPT_TOKENS
+        
+        def score(name):
+            latency = stats[name]["p95"] if stats[name]["p95"] is not None else best_latency
+            success = max(1 - stats[name]["error_rate"], 0.01)
+            return (latency / best_latency + cost_weight * costs[name] / best_cost) / success
+        
+        return sorted(candidates, key=lambda name: (stats[name]["error_rate"] > ROUTER_MAX_ERROR_RATE, score(name)))
+
+@st.cache_resource
+def get_model_router():
+    """Router único por proceso: aprende de los requests de todas las sesiones"""
+    return ModelRouter(MODEL_COSTS)
+
+def available_models():
+    """Modelos con API key configurada"""
+    return [name for name in MODEL_COSTS if os.getenv(MODEL_API_KEY_ENV[name])]
+
+def get_model_instance(model_name, prompt=""):
     try:
-        return model_map[model_name]()
+        if model_name == AUTO_MODEL:
+            ranked = get_model_router().rank(prompt, st.session_state.config["max_tokens"], available_models())
+            if not ranked:
+                raise ValueError("No hay modelos con API key configurada")
+            model_name = ranked[0]
+        return get_model_registry().get(model_name)
     except Exception as e:
         logger = StreamlitLogger().get_logger()
         logger.error(f"Error creando modelo {model_name}: {str(e)}")
@@ -314,7 +932,9 @@ def render_metrics():
     st.subheader("📈 Métricas de Uso")
     
     metrics = st.session_state.metrics
-    col1, col2, col3 = st.columns(3)
+    latency = metrics['latency']
+    ttft = metrics['ttft']
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.metric("Total Requests", metrics['requests_count'])
@@ -324,10 +944,38 @@ def render_metrics():
         st.metric("Error Rate", f"{error_rate:.2%}")
     
     with col3:
-        avg_time = sum(metrics['response_times']) / len(metrics['response_times']) if metrics['response_times'] else 0
-        st.metric("Avg Response Time", f"{avg_time:.2f}s")
+        st.metric(
+            "Latencia p95",
+            f"{latency.quantile(0.95) or 0:.2f}s",
+            f"p50 {latency.quantile(0.50) or 0:.2f}s",
+            delta_color="off"
+        )
+    
+    with col4:
+        # Latencia percibida: tiempo hasta que aparece el primer fragmento de la respuesta
+        st.metric(
+            "TTFT p95",
+            f"{ttft.quantile(0.95) or 0:.2f}s",
+            f"p50 {ttft.quantile(0.50) or 0:.2f}s",
+            delta_color="off"
+        )
     
     if metrics['model_usage']:
+        rows = []
+        for model_name, summary in metrics['latency_by_model'].items():
+            model_ttft = metrics['ttft_by_model'][model_name]
+            rows.append({
+                "Modelo": model_name,
+                "Requests": summary.count,
+                "Media (s)": summary.mean,
+                "p50 (s)": summary.quantile(0.50),
+                "p95 (s)": summary.quantile(0.95),
+                "p99 (s)": summary.quantile(0.99),
+                "Máx (s)": summary.max,
+                "TTFT p95 (s)": model_ttft.quantile(0.95)
+            })
+        st.dataframe(pd.DataFrame(rows).round(3), hide_index=True, use_container_width=True)
+        
         col1, col2 = st.columns(2)
         with col1:
             fig1 = px.pie(
@@ -338,13 +986,96 @@ def render_metrics():
             st.plotly_chart(fig1, use_container_width=True)
         
         with col2:
-            if metrics['response_times']:
+            recent = pd.DataFrame([
+                {"Request": i, "Segundos": value, "Serie": f"{model_name} · {series}"}
+                for series, by_model in (("Total", metrics['recent_response_times']), ("TTFT", metrics['recent_ttft']))
+                for model_name, values in by_model.items()
+                for i, value in enumerate(values)
+            ])
+            if not recent.empty:
                 fig2 = px.line(
-                    y=metrics['response_times'],
-                    title="Tiempos de Respuesta"
+                    recent,
+                    x="Request",
+                    y="Segundos",
+                    color="Serie",
+                    title=f"Tiempos de Respuesta (últimos {METRICS_RECENT_REQUESTS} por modelo)"
                 )
                 st.plotly_chart(fig2, use_container_width=True)
 
+def render_router_metrics():
+    st.subheader("🔀 Router Automático")
+    
+    stats = get_model_router().stats()
+    available = available_models()
+    ranking = get_model_router().rank("", st.session_state.config["max_tokens"], available)
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "Modelo": name,
+                "Disponible": name in available,
+                "Requests recientes": model_stats["requests"],
+                "Latencia p95 (s)": model_stats["p95"],
+                "Tasa de errores": f"{model_stats['error_rate']:.1%}",
+                "Costo / 1K tokens (entrada / salida)": (
+                    f"${MODEL_COSTS[name]['input']:.4f} / ${MODEL_COSTS[name]['output']:.4f}"
+                ),
+                "Orden en Auto": ranking.index(name) + 1 if name in ranking else None
+            }
+            for name, model_stats in stats.items()
+        ]),
+        hide_index=True,
+        use_container_width=True
+    )
+    st.caption(
+        f"Ventana: últimos {ROUTER_WINDOW} requests por modelo de los últimos {ROUTER_WINDOW_SECONDS // 60} min "
+        f"(todas las sesiones). El orden depende además del largo de cada prompt."
+    )
+
+def render_circuit_breakers():
+    st.subheader("🛡️ Circuit Breakers")
+    
+    labels = {
+        CircuitBreaker.CLOSED: "🟢 Cerrado",
+        CircuitBreaker.OPEN: "🔴 Abierto",
+        CircuitBreaker.HALF_OPEN: "🟡 Semiabierto"
+    }
+    breakers = get_model_registry().breakers()
+    cols = st.columns(len(breakers))
+    for col, (name, breaker) in zip(cols, breakers.items()):
+        snapshot = breaker.snapshot()
+        with col:
+            st.metric(name, labels[snapshot["state"]])
+            if snapshot["retry_in"] is not None:
+                st.caption(f"Requests de prueba en {snapshot['retry_in']:.0f}s")
+            st.caption(
+                f"Fallas seguidas: {snapshot['consecutive_failures']}/{breaker.failure_threshold} · "
+                f"Aperturas: {snapshot['trips']} · Rechazados: {snapshot['rejected']}"
+            )
+
+def render_semantic_cache_metrics():
+    st.subheader("⚡ Caché Semántico")
+    
+    # Las pestañas se renderizan en cada rerun: no cargar el modelo de embeddings solo para esto
+    semantic_cache = semantic_cache_handle().get("cache")
+    if semantic_cache is None:
+        st.info("El caché semántico se carga con la primera pregunta que lo usa")
+        return
+    stats = semantic_cache.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Tasa de Aciertos", f"{stats['hit_rate']:.1%}")
+    with col2:
+        st.metric("Respuestas desde Caché", f"{stats['hits']} / {stats['lookups']}")
+    with col3:
+        st.metric("Tiempo Ahorrado", f"{stats['saved_seconds']:.1f}s")
+    with col4:
+        st.metric("Costo Ahorrado", f"${stats['saved_cost']:.4f}", f"{stats['saved_tokens']} tokens")
+    
+    st.caption(
+        f"Embeddings: {stats['embedder']} · umbral por defecto {stats['threshold']:.2f} · "
+        f"{stats['entries']} respuestas guardadas"
+    )
+
 def render_cache_metrics():
     st.subheader("📊 Métricas de Caché")
     
@@ -354,8 +1085,9 @@ def render_cache_metrics():
         st.metric("Interacciones en Caché", len(st.session_state.conversation_cache))
     
     with col2:
-        if st.session_state.cache_timestamps:
-            oldest = min(st.session_state.cache_timestamps)
+        interactions = st.session_state.conversation_cache.interactions()
+        if interactions:
+            oldest = min(interaction["timestamp"] for interaction in interactions)
             age = datetime.now() - oldest
             st.metric("Edad del Caché", f"{int(age.total_seconds() / 60)} min")
         else:
@@ -364,12 +1096,14 @@ def render_cache_metrics():
 def render_cached_interactions():
     st.subheader("💬 Últimas Interacciones")
     
-    if not st.session_state.conversation_cache:
+    cache = st.session_state.conversation_cache
+    interactions = cache.interactions()
+    if not interactions:
         st.info("No hay interacciones en caché")
         return
     
-    for idx, interaction in enumerate(st.session_state.conversation_cache):
-        time_left = interaction["timestamp"] + timedelta(minutes=30) - datetime.now()
+    for idx, interaction in enumerate(interactions):
+        time_left = cache.time_left(interaction)
         
         with st.expander(f"Interacción {idx + 1} - Expira en {int(time_left.total_seconds() / 60)} min"):
             st.caption(f"Timestamp: {interaction['timestamp'].strftime('%H:%M:%S')}")
@@ -380,14 +1114,167 @@ def render_cached_interactions():
             with st.chat_message("assistant"):
                 st.markdown(interaction["assistant_message"]["content"])
 
+def render_export_controls(store):
+    """Exporta el historial a JSONL comprimido en un hilo aparte, sin bloquear el rerun"""
+    export_dir = HISTORY_DIR / "exports"
+    job = st.session_state.get("export_job")
+    
+    if job is not None and not job.done:
+        st.info("⏳ Exportando historial...")
+        st.button("Actualizar estado", key="export_refresh")
+        return
+    
+    with st.expander("📥 Exportar historial"):
+        mode = st.radio(
+            "Mensajes a exportar",
+            ["Todo", "Rango de fechas", "Desde la última exportación"],
+            key="export_mode"
+        )
+        since = until = None
+        if mode == "Rango de fechas":
+            since_date = st.date_input("Desde", value=datetime.now().date() - timedelta(days=7), key="export_since")
+            until_date = st.date_input("Hasta", value=datetime.now().date(), key="export_until")
+            since = datetime.combine(since_date, datetime.min.time())
+            until = datetime.combine(until_date + timedelta(days=1), datetime.min.time())
+        
+        if st.button("Exportar", key="export_start", use_container_width=True):
+            if mode == "Desde la última exportación":
+                job = ExportJob(export_incremental, store, export_dir)
+            else:
+                job = ExportJob(export_history, store, default_export_path(export_dir), since, until)
+            st.session_state.export_job = job
+            st.rerun()
+    
+    if job is not None:
+        if job.error:
+            st.error(f"Error exportando historial: {job.error}")
+        else:
+            result = job.result
+            st.caption(f"{result['conversations']} conversaciones, {result['messages']} mensajes")
+            # El archivo se lee solo cuando se pide la descarga, no en cada rerun posterior
+            if result["bytes"] > EXPORT_DOWNLOAD_MAX_MB * 1024 * 1024:
+                st.info(f"La exportación pesa {result['bytes'] / 1024 / 1024:.0f} MB: está en {result['path']}")
+            elif st.session_state.get("export_download") != result["path"]:
+                if st.button("Preparar Descarga", key="export_prepare", use_container_width=True):
+                    st.session_state.export_download = result["path"]
+                    st.rerun()
+            else:
+                with open(result["path"], "rb") as f:
+                    st.download_button(
+                        "Descargar Exportación",
+                        f,
+                        Path(result["path"]).name,
+                        "application/gzip",
+                        on_click=lambda: st.session_state.pop("export_download", None),
+                        use_container_width=True
+                    )
+
+def render_archive_controls(conversation_manager):
+    """Archiva conversaciones viejas y permite recuperar una archivada por ID"""
+    archive = get_history_archive()
+    with st.expander(f"🗄️ Archivo ({archive.count_conversations()} conversaciones)"):
+        days = st.number_input(
+            "Archivar conversaciones de más de (días)",
+            min_value=1,
+            value=ARCHIVE_AFTER_DAYS,
+            step=1,
+            key="archive_days"
+        )
+        if st.button("Archivar", key="archive_start", use_container_width=True):
+            with st.spinner("Archivando conversaciones..."):
+                summary = archive.archive_older_than(
+                    conversation_manager.store, days, search_index=get_search_index()
+                )
+            st.success(f"{summary['conversations']} conversaciones archivadas ({summary['messages']} mensajes)")
+        
+        archived_id = st.text_input("ID de conversación archivada", key="archive_load_id").strip()
+        if archived_id and st.button("Restaurar y cargar", key="archive_load"):
+            if conversation_manager.load_conversation(archived_id):
+                st.rerun()
+            else:
+                st.error("No se encontró la conversación en el archivo")
+
+def render_history_analytics():
+    """Mensajes por día, largo de mensajes, latencia de respuesta y profundidad de conversaciones"""
+    with st.expander("📊 Analítica del historial"):
+        if not st.checkbox("Calcular estadísticas", key="show_history_analytics"):
+            return
+        stats = load_history_analytics()
+        latency = stats["response_latency_seconds"]
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Conversaciones analizadas", stats["conversations"])
+        with col2:
+            st.metric("Latencia p50", f"{latency['p50']:.1f}s" if latency["count"] else "-")
+        with col3:
+            st.metric("Latencia p95", f"{latency['p95']:.1f}s" if latency["count"] else "-")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if stats["messages_per_day"]:
+                fig1 = px.bar(
+                    x=list(stats["messages_per_day"].keys()),
+                    y=list(stats["messages_per_day"].values()),
+                    labels={"x": "Día", "y": "Mensajes"},
+                    title="Mensajes por Día"
+                )
+                st.plotly_chart(fig1, use_container_width=True)
+        with col2:
+            if stats["conversation_depth"]:
+                fig2 = px.bar(
+                    x=list(stats["conversation_depth"].keys()),
+                    y=list(stats["conversation_depth"].values()),
+                    labels={"x": "Mensajes por conversación", "y": "Conversaciones"},
+                    title="Profundidad de Conversaciones"
+                )
+                st.plotly_chart(fig2, use_container_width=True)
+        
+        lengths = pd.DataFrame([
+            {"Rol": role, "Mensajes": values["count"], "Promedio": round(values["mean"]),
+             "p50": values["p50"], "p95": values["p95"]}
+            for role, values in stats["message_length"].items()
+        ])
+        if not lengths.empty:
+            st.caption("Largo de mensajes (caracteres)")
+            st.dataframe(lengths, hide_index=True, use_container_width=True)
+
+def render_message_search(conversation_manager):
+    """Búsqueda de texto completo (BM25) en el contenido de todos los mensajes"""
+    text = st.text_input(
+        "🔎 Buscar en mensajes",
+        placeholder="Palabras a buscar en todo el historial",
+        key="message_search_query"
+    ).strip()
+    if not text:
+        return
+    
+    start_time = time.time()
+    results = get_search_index().search(text, limit=HISTORY_PAGE_SIZE)
+    elapsed_ms = (time.time() - start_time) * 1000
+    st.caption(f"{len(results)} resultados en {elapsed_ms:.1f} ms")
+    
+    for idx, result in enumerate(results):
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            st.markdown(
+                f"**{result['role']}** · {(result['timestamp'] or '')[:16]} · "
+                f"`{result['conversation_id'][:8]}`  \n{result['snippet']}"
+            )
+        with col2:
+            if st.button("Abrir", key=f"search_open_{idx}_{result['conversation_id']}"):
+                if conversation_manager.load_conversation(result['conversation_id']):
+                    st.rerun()
+                else:
+                    st.error("Error al cargar la conversación")
+
 def render_history_dashboard():
     st.header("📚 Historial de Conversaciones")
     
     conversation_manager = ConversationManager()
-    conversations = conversation_manager.list_conversations()
     
-    total_convs = len(conversations)
-    total_msgs = sum(conv["message_count"] for conv in conversations)
+    total_convs = conversation_manager.store.count_conversations()
+    total_msgs = conversation_manager.store.count_messages()
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -395,21 +1282,41 @@ def render_history_dashboard():
     with col2:
         st.metric("Total Mensajes", total_msgs)
     with col3:
-        # Botón para descargar todo el historial
-        if st.button("📥 Descargar Todo"):
-            # Convertir el historial completo a JSON
-            full_history = json.dumps(conversation_manager.history, indent=2)
-            st.download_button(
-                "Descargar Historial Completo",
-                full_history,
-                "historial_completo.json",
-                "application/json",
-                use_container_width=True
-            )
+        render_export_controls(conversation_manager.store)
+    
+    render_archive_controls(conversation_manager)
+    render_history_analytics()
+    render_message_search(conversation_manager)
+    st.divider()
+    
+    # Filtro y paginación: solo se leen los metadatos de la página visible
+    query = st.text_input(
+        "Filtrar conversaciones",
+        placeholder="ID o primera línea del mensaje",
+        key="history_query"
+    ).strip()
+    total_matches = conversation_manager.store.count_conversations(query=query) if query else total_convs
+    total_pages = max(1, math.ceil(total_matches / HISTORY_PAGE_SIZE))
+    if st.session_state.get("history_page", 1) > total_pages:
+        st.session_state.history_page = total_pages
+    page = st.number_input("Página", min_value=1, max_value=total_pages, value=1, step=1, key="history_page")
+    st.caption(f"{total_matches} conversaciones · página {page} de {total_pages}")
+    
+    conversations = conversation_manager.list_conversations(
+        offset=(page - 1) * HISTORY_PAGE_SIZE,
+        limit=HISTORY_PAGE_SIZE,
+        query=query or None
+    )
     
     for conv in conversations:
-        with st.expander(f"Conversación {conv['id'][:8]} - {conv['created_at']}"):
+        title = conv["first_line"] or "Sin mensajes"
+        with st.expander(f"{conv['created_at'][:16]} · {title} ({conv['id'][:8]})"):
             st.write(f"Mensajes: {conv['message_count']}")
+            # Los mensajes se leen del store solo cuando se piden
+            if st.checkbox("Ver mensajes", key=f"show_{conv['id']}"):
+                for message in conversation_manager.store.get_messages(conv['id']):
+                    with st.chat_message(message["role"]):
+                        st.markdown(message["content"])
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Cargar", key=f"load_{conv['id']}"):
@@ -423,7 +1330,7 @@ def render_history_dashboard():
                 if st.button("Descargar", key=f"download_{conv['id']}"):
                     # Obtener solo esta conversación
                     single_conv = {
-                        conv['id']: conversation_manager.history[conv['id']]
+                        conv['id']: conversation_manager.store.get_conversation(conv['id'])
                     }
                     conv_json = json.dumps(single_conv, indent=2)
                     st.download_button(
@@ -454,36 +1361,104 @@ def chat_interface():
             st.markdown(prompt)
         
         with st.chat_message("assistant"):
-            with st.spinner("Pensando..."):
-                start_time = time.time()
-                try:
-                    modelo_actual = get_model_instance(st.session_state.config["modelo"])
-                    if modelo_actual:
+            start_time = time.time()
+            model_name = st.session_state.config["modelo"]
+            try:
+                config = st.session_state.config
+                if model_name == AUTO_MODEL:
+                    # Candidatos en orden de conveniencia; si uno falla se pasa al siguiente
+                    candidates = get_model_router().rank(prompt, config["max_tokens"], available_models())
+                    if not candidates:
+                        raise ValueError("No hay modelos con API key configurada")
+                    # Los proveedores con el circuit breaker abierto quedan al final
+                    candidates.sort(key=get_model_registry().is_open)
+                else:
+                    candidates = [model_name]
+                model_name = candidates[0]
+                
+                # Turnos recientes dentro del presupuesto de tokens, más el resumen de los anteriores
+                # El resumen lo hace el primer candidato con el circuit breaker cerrado; si no hay
+                # ninguno es extractivo, así un proveedor caído no frena cada turno
+                summarizer = next((name for name in candidates if not get_model_registry().is_open(name)), None)
+                context = conversation_manager.build_context(
+                    prompt, get_model_instance(summarizer) if summarizer else None
+                )
+                logger.info(f"Contexto: {len(context)} mensajes, {count_message_tokens(context)} tokens")
+                # El caché semántico se indexa por (modelo, pregunta): solo vale para el primer turno,
+                # con contexto la respuesta depende de la conversación (y sería de otro usuario)
+                semantic_cache = get_semantic_cache() if config["cache_semantico"] and not context else None
+                cached = (
+                    semantic_cache.lookup(model_name, prompt, config["umbral_similitud"])
+                    if semantic_cache else None
+                )
+                if cached:
+                    # Pregunta casi idéntica ya respondida por este modelo: no se llama al modelo
+                    logger.info(f"Respuesta desde caché semántico (similitud {cached['similarity']:.2f})")
+                    assistant_message = {"role": "assistant", "content": cached["answer"], "semantic_cache": True}
+                    conversation_manager.save_message(assistant_message)
+                    st.markdown(cached["answer"])
+                    st.caption(
+                        f"⚡ Respuesta del caché semántico (similitud {cached['similarity']:.2f} "
+                        f"con «{cached['question']}»)"
+                    )
+                else:
+                    for attempt, model_name in enumerate(candidates):
+                        modelo_actual = get_model_instance(model_name)
+                        if not modelo_actual:
+                            continue
                         logger.info(f"Generando respuesta con modelo {modelo_actual.name}")
-                        respuesta = modelo_actual.generate(prompt)
-                        tokens = len(prompt.split()) + len(respuesta.split())
+                        start_time = time.time()
+                        # Los fragmentos se muestran a medida que llegan
+                        stream = StreamTimer(modelo_actual.generate_stream(prompt, context), start_time)
+                        try:
+                            respuesta = st.write_stream(stream)
+                        except Exception as e:
+                            # Failover solo si todavía no se mostró nada y queda otro candidato
+                            if stream.ttft is not None or attempt == len(candidates) - 1:
+                                raise
+                            logger.warning(
+                                f"{model_name} falló ({type(e).__name__}), se reintenta con {candidates[attempt + 1]}"
+                            )
+                            if not isinstance(e, CircuitOpenError):
+                                MetricsCollector().log_error(model_name, type(e).__name__)
+                                get_model_registry().report_failure(model_name)
+                            continue
+                        # Conteo de la API si lo informó; si no, tokenizador local
+                        usage = stream.usage or estimate_usage(
+                            context + [{"role": "user", "content": prompt}], respuesta
+                        )
+                        tokens = usage["total_tokens"]
                         
                         response_time = time.time() - start_time
                         logger.info(
-                            f"Respuesta generada exitosamente en {response_time:.2f}s. "
-                            f"Tokens utilizados: {tokens}"
+                            f"Respuesta generada exitosamente en {response_time:.2f}s "
+                            f"(primer token en {stream.ttft or response_time:.2f}s). "
+                            f"Tokens utilizados: {tokens} ({usage['source']})"
                         )
                         
-                        MetricsCollector().log_request(
+                        cost = MetricsCollector().log_request(
                             modelo_actual.name,
                             response_time,
-                            tokens
+                            usage,
+                            ttft=stream.ttft
                         )
+                        if semantic_cache:
+                            semantic_cache.store(modelo_actual.name, prompt, respuesta, response_time, tokens, cost)
+                        if config["modelo"] == AUTO_MODEL:
+                            st.caption(f"🔀 Auto: respondió {modelo_actual.name}")
                         
                         assistant_message = {"role": "assistant", "content": respuesta}
                         conversation_manager.save_message(assistant_message)
-                        st.markdown(respuesta)
-                        
-                except Exception as e:
-                    error_msg = f"Error: {str(e)}"
-                    logger.error(f"Error generando respuesta: {error_msg}")
-                    MetricsCollector().log_error(st.session_state.config["modelo"], type(e).__name__)
-                    st.error(error_msg)
+                        break
+                    
+            except Exception as e:
+                error_msg = f"Error: {str(e)}"
+                logger.error(f"Error generando respuesta: {error_msg}")
+                # Rechazado por el circuit breaker: el proveedor no recibió el request, no es una falla suya
+                if not isinstance(e, CircuitOpenError):
+                    MetricsCollector().log_error(model_name, type(e).__name__)
+                    get_model_registry().report_failure(model_name)
+                st.error(error_msg)
 
 def render_sidebar():
     st.sidebar.title("⚙️ Configuración")
@@ -494,15 +1469,17 @@ def render_sidebar():
     
     modelo = st.sidebar.selectbox(
         "Selecciona el modelo",
-        ["GPT-3.5", "Deepseek", "LLaMA-2"],
-        help="Elige el modelo de lenguaje a utilizar"
+        [AUTO_MODEL, "GPT-3.5", "Deepseek", "LLaMA-2"],
+        index=1,
+        help="Elige el modelo de lenguaje a utilizar. Auto elige en cada mensaje según latencia p95, "
+             "tasa de errores, costo y largo del prompt, y pasa a otro modelo si el elegido falla"
     )
     
     temperatura = st.sidebar.slider(
         "Temperatura",
         min_value=0.0,
         max_value=1.0,
-        value=0.7,
+        value=DEFAULT_TEMPERATURE,
         help="Controla la creatividad de las respuestas"
     )
     
@@ -510,32 +1487,50 @@ def render_sidebar():
         "Máximo de tokens",
         min_value=50,
         max_value=2000,
-        value=150,
+        value=DEFAULT_MAX_TOKENS,
         help="Límite de tokens en la respuesta"
     )
     
+    cache_semantico = st.sidebar.checkbox(
+        "Caché semántico",
+        value=True,
+        help="Reutiliza respuestas a preguntas casi idénticas hechas al mismo modelo al empezar una conversación"
+    )
+    
+    umbral_similitud = st.sidebar.slider(
+        "Umbral de similitud",
+        min_value=0.5,
+        max_value=1.0,
+        value=float(semantic_cache_threshold()),
+        step=0.01,
+        disabled=not cache_semantico,
+        help="Similitud coseno mínima para reutilizar una respuesta"
+    )
+    
     if st.sidebar.button("Limpiar Chat"):
         st.session_state.conversation_cache.clear()
-        st.session_state.cache_timestamps.clear()
         ConversationManager().new_conversation()
         st.rerun()
     
     return {
         "modelo": modelo,
         "temperatura": temperatura,
-        "max_tokens": max_tokens
+        "max_tokens": max_tokens,
+        "cache_semantico": cache_semantico,
+        "umbral_similitud": umbral_similitud
     }
 
 def initialize_session_state():
     if 'conversation_cache' not in st.session_state:
-        st.session_state.conversation_cache = deque(maxlen=3)
-        st.session_state.cache_timestamps = deque(maxlen=3)
+        st.session_state.conversation_cache = InteractionCache()
+        st.session_state.last_user_message = None
     
     if 'config' not in st.session_state:
         st.session_state.config = {
             "modelo": "GPT-3.5",
-            "temperatura": 0.7,
-            "max_tokens": 150
+            **default_model_config(),
+            "cache_semantico": True,
+            "umbral_similitud": semantic_cache_threshold()
         }
     
     MetricsCollector.initialize_metrics()
@@ -551,11 +1546,21 @@ def render_cost_dashboard():
     total_cost = sum(costs_by_model.values())
     total_tokens = sum(metrics['token_usage'].values())
     
-    col1, col2 = st.columns(2)
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.metric("Costo Total", f"${total_cost:.4f}")
     with col2:
         st.metric("Total Tokens", f"{total_tokens:,}")
+    with col3:
+        st.metric("Tokens de Entrada", f"{metrics['input_tokens']:,}")
+    with col4:
+        st.metric("Tokens de Salida", f"{metrics['output_tokens']:,}")
+    
+    token_sources = metrics['token_sources']
+    if token_sources:
+        st.caption("Origen del conteo de tokens: " + ", ".join(
+            f"{source} ({count} requests)" for source, count in token_sources.items()
+        ) + f". Sin conteo de la API se usa {tokenizer_name()}.")
     
     # Gráfico de torta - Costo por modelo
     if costs_by_model:
@@ -570,8 +1575,8 @@ def render_cost_dashboard():
     # Gráfico de barras - Costo por minuto
     st.subheader("Costos por Minuto")
     if metrics['costs']:
-        # Agrupar costos por minuto y modelo
-        costs_df = pd.DataFrame(metrics['costs'])
+        # Agrupar costos por minuto y modelo (últimos METRICS_RECENT_COSTS requests)
+        costs_df = pd.DataFrame(list(metrics['costs']))
         costs_df['minute'] = costs_df['timestamp'].dt.strftime('%H:%M')
         costs_by_minute = costs_df.pivot_table(
             index='minute',
@@ -614,6 +1619,12 @@ def main():
     
     with tab3:
         render_metrics()
+        st.divider()
+        render_router_metrics()
+        st.divider()
+        render_circuit_breakers()
+        st.divider()
+        render_semantic_cache_metrics()
     
     with tab4:
         render_history_dashboard()
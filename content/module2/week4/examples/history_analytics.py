@@ -0,0 +1,313 @@
+"""Analítica offline sobre el historial de conversaciones.
+
+Calcula mensajes por día, largo de los mensajes por rol, latencia de
+respuesta (diferencia de timestamps usuario -> asistente) y distribución de
+profundidad de las conversaciones.
+
+- `conversations.json` se parsea de forma incremental con
+  JSONDecoder.raw_decode sobre bloques del archivo, sin `json.load` completo.
+- Los segmentos del archivo (history_archive) se leen línea por línea.
+- Los mensajes se agregan por lotes con numpy, en acumuladores que se pueden
+  combinar (contadores e histogramas de bins fijos), así cada segmento se
+  procesa en un proceso aparte y los resultados se suman al final.
+
+Uso desde la línea de comandos:
+    python history_analytics.py --workers 4
+    python history_analytics.py --json > stats.json
+"""
+import argparse
+import gzip
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from conversation_store import CHAT_HISTORY_BACKEND, open_conversation_store
+from history_archive import ARCHIVE_DIR_NAME, HistoryArchive
+
+# Tamaño de los bloques leídos de conversations.json
+JSON_CHUNK_SIZE = 1024 * 1024
+# Conversaciones agregadas por lote vectorizado
+ANALYTICS_BATCH_SIZE = 2000
+# Bins logarítmicos (20 por década, de 0.1 a 1e6) para largos en caracteres y latencias en segundos
+HISTOGRAM_EDGES = np.concatenate([[0.0], np.logspace(-1, 6, 141)])
+
+
+def iter_json_conversations(path, chunk_size=JSON_CHUNK_SIZE):
+    """(id, conversación) del objeto raíz de conversations.json, leyendo por bloques."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = "", 0, False
+        state = "start"
+        key = None
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    if state == "start":
+                        return  # archivo vacío
+                    raise ValueError(f"{path}: fin de archivo inesperado")
+                buffer, pos = buffer[pos:] + f.read(chunk_size), 0
+                eof = pos == len(buffer)
+                continue
+
+            char = buffer[pos]
+            if state == "start":
+                if char != "{":
+                    raise ValueError(f"{path}: se esperaba un objeto JSON")
+                pos += 1
+                state = "key"
+            elif state == "separator":
+                pos += 1
+                if char == "}":
+                    return
+                if char != ",":
+                    raise ValueError(f"{path}: se esperaba ',' en la posición {pos}")
+                state = "key"
+            elif state == "colon":
+                if char != ":":
+                    raise ValueError(f"{path}: se esperaba ':' en la posición {pos}")
+                pos += 1
+                state = "value"
+            elif state == "key" and char == "}":
+                return
+            else:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # Valor incompleto: leer al menos lo que ya hay en el buffer (crecimiento geométrico)
+                    more = f.read(max(chunk_size, len(buffer) - pos))
+                    eof = not more
+                    buffer, pos = buffer[pos:] + more, 0
+                    continue
+                pos = end
+                if state == "key":
+                    key = value
+                    state = "colon"
+                else:
+                    yield key, value
+                    state = "separator"
+
+
+def iter_segment_conversations(path):
+    """(id, conversación) de un segmento .jsonl.gz del archivo o de una exportación."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            yield record["id"], {"created_at": record["created_at"], "messages": record["messages"]}
+
+
+def _histogram(values):
+    return np.histogram(np.clip(values, 0, HISTOGRAM_EDGES[-1]), bins=HISTOGRAM_EDGES)[0]
+
+
+def _histogram_quantile(histogram, q):
+    """Cota superior del bin donde cae el cuantil q (error de un bin, ~12%)."""
+    total = histogram.sum()
+    if total == 0:
+        return None
+    return float(HISTOGRAM_EDGES[1:][np.searchsorted(np.cumsum(histogram), q * total)])
+
+
+class HistoryStats:
+    """Acumuladores combinables con `merge`; se pueden calcular por partes en distintos procesos."""
+
+    def __init__(self):
+        self.conversations = 0
+        self.messages = 0
+        self.messages_per_day = Counter()
+        self.depths = Counter()
+        self.length_histograms = {}
+        self.length_totals = Counter()
+        self.latency_histogram = np.zeros(len(HISTOGRAM_EDGES) - 1, dtype=np.int64)
+        self.latency_total = 0.0
+
+    def add_batch(self, conversations):
+        """Agrega una lista de listas de mensajes con operaciones vectorizadas."""
+        if not conversations:
+            return
+        depths = np.fromiter((len(messages) for messages in conversations), dtype=np.int64, count=len(conversations))
+        self.conversations += len(conversations)
+        unique_depths, depth_counts = np.unique(depths, return_counts=True)
+        self.depths.update(dict(zip(unique_depths.tolist(), depth_counts.tolist())))
+        messages = [message for conversation in conversations for message in conversation]
+        if not messages:
+            return
+        self.messages += len(messages)
+
+        conversation_ids = np.repeat(np.arange(len(conversations)), depths)
+        roles = np.array([message.get("role") or "" for message in messages])
+        lengths = np.fromiter((len(message.get("content") or "") for message in messages),
+                              dtype=np.float64, count=len(messages))
+        timestamps = np.array([message.get("timestamp") or "NaT" for message in messages], dtype="datetime64[us]")
+        valid = ~np.isnat(timestamps)
+
+        days, counts = np.unique(timestamps[valid].astype("datetime64[D]"), return_counts=True)
+        self.messages_per_day.update(dict(zip(np.datetime_as_string(days).tolist(), counts.tolist())))
+
+        for role in np.unique(roles):
+            role_lengths = lengths[roles == role]
+            histogram = self.length_histograms.setdefault(
+                str(role), np.zeros(len(HISTOGRAM_EDGES) - 1, dtype=np.int64)
+            )
+            histogram += _histogram(role_lengths)
+            self.length_totals[str(role)] += float(role_lengths.sum())
+
+        # Respuesta = mensaje de asistente inmediatamente después de uno de usuario en la misma conversación
+        responses = (
+            (conversation_ids[1:] == conversation_ids[:-1])
+            & (roles[:-1] == "user") & (roles[1:] == "assistant")
+            & valid[:-1] & valid[1:]
+        )
+        latencies = (timestamps[1:][responses] - timestamps[:-1][responses]) / np.timedelta64(1, "s")
+        latencies = latencies[latencies >= 0]
+        self.latency_histogram += _histogram(latencies)
+        self.latency_total += float(latencies.sum())
+
+    def merge(self, other):
+        self.conversations += other.conversations
+        self.messages += other.messages
+        self.messages_per_day.update(other.messages_per_day)
+        self.depths.update(other.depths)
+        for role, histogram in other.length_histograms.items():
+            if role in self.length_histograms:
+                self.length_histograms[role] += histogram
+            else:
+                self.length_histograms[role] = histogram.copy()
+        self.length_totals.update(other.length_totals)
+        self.latency_histogram += other.latency_histogram
+        self.latency_total += other.latency_total
+        return self
+
+    def _distribution(self, histogram, total):
+        count = int(histogram.sum())
+        return {
+            "count": count,
+            "mean": total / count if count else None,
+            "p50": _histogram_quantile(histogram, 0.50),
+            "p95": _histogram_quantile(histogram, 0.95),
+            "p99": _histogram_quantile(histogram, 0.99)
+        }
+
+    def summary(self):
+        return {
+            "conversations": self.conversations,
+            "messages": self.messages,
+            "messages_per_day": dict(sorted(self.messages_per_day.items())),
+            "message_length": {
+                role: self._distribution(histogram, self.length_totals[role])
+                for role, histogram in sorted(self.length_histograms.items())
+            },
+            "response_latency_seconds": self._distribution(self.latency_histogram, self.latency_total),
+            "conversation_depth": {int(depth): int(count) for depth, count in sorted(self.depths.items())}
+        }
+
+
+def analyze_conversations(conversations, include=None, batch_size=ANALYTICS_BATCH_SIZE):
+    """HistoryStats de un iterable de (id, conversación); `include` limita los IDs considerados."""
+    stats = HistoryStats()
+    batch = []
+    for conv_id, data in conversations:
+        if include is not None and conv_id not in include:
+            continue
+        batch.append(data["messages"])
+        if len(batch) >= batch_size:
+            stats.add_batch(batch)
+            batch = []
+    stats.add_batch(batch)
+    return stats
+
+
+def analyze_file(path, include=None):
+    """Analiza un conversations.json o un segmento .jsonl.gz (se ejecuta en un proceso aparte)."""
+    path = Path(path)
+    if path.name.endswith(".jsonl.gz"):
+        return analyze_conversations(iter_segment_conversations(path), include)
+    return analyze_conversations(iter_json_conversations(path), include)
+
+
+def analyze_history(history_dir, backend=None, workers=None, store=None):
+    """Estadísticas del store activo más los segmentos archivados.
+
+    Cada segmento es una tarea independiente; con más de una tarea se
+    reparten en `workers` procesos (por defecto, uno por CPU). Si se pasa
+    `store` se lee de él; si no, se abre uno y se cierra al terminar.
+    """
+    history_dir = Path(history_dir)
+    backend = backend or CHAT_HISTORY_BACKEND
+    tasks = []
+    owns_store = False
+
+    if backend == "json":
+        # El store JSON cargaría el archivo entero: se parsea por bloques
+        if (history_dir / "conversations.json").exists():
+            tasks.append((history_dir / "conversations.json", None))
+        store = None
+    elif store is None:
+        store = open_conversation_store(history_dir, backend)
+        owns_store = True
+
+    archive_dir = history_dir / ARCHIVE_DIR_NAME
+    if (archive_dir / "manifest.json").exists():
+        # Un segmento puede tener copias viejas de conversaciones restauradas o archivadas
+        # de nuevo: solo cuentan las que el manifiesto le asigna
+        archive = HistoryArchive(archive_dir)
+        owners = {}
+        for conv_id, segment in archive.conversation_segments().items():
+            owners.setdefault(segment, set()).add(conv_id)
+        for segment in archive.segments():
+            tasks.append((archive_dir / segment["file"], owners.get(segment["file"], set())))
+
+    stats = HistoryStats()
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(analyze_file, str(path), include) for path, include in tasks]
+                if store is not None:
+                    stats.merge(analyze_conversations(store.iter_conversations()))
+                for future in futures:
+                    stats.merge(future.result())
+        else:
+            if store is not None:
+                stats.merge(analyze_conversations(store.iter_conversations()))
+            for path, include in tasks:
+                stats.merge(analyze_file(path, include))
+    finally:
+        if owns_store:
+            store.close()
+    return stats.summary()
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="Estadísticas offline del historial del chatbot.")
+    parser.add_argument("--history-dir", default="chat_history", help="Directorio del historial")
+    parser.add_argument("--backend", default=None, help="json, jsonl o sqlite (por defecto CHAT_HISTORY_BACKEND)")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para los segmentos archivados")
+    parser.add_argument("--json", action="store_true", help="Imprimir el resumen completo en JSON")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = analyze_history(args.history_dir, args.backend, args.workers)
+    elapsed = time.perf_counter() - start
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{summary['conversations']} conversaciones, {summary['messages']} mensajes en {elapsed:.2f} s")
+        latency = summary["response_latency_seconds"]
+        if latency["count"]:
+            print(f"Latencia de respuesta: media {latency['mean']:.1f} s, p50 {latency['p50']:.1f} s, "
+                  f"p95 {latency['p95']:.1f} s")
+        for role, lengths in summary["message_length"].items():
+            print(f"Largo de mensajes ({role}): media {lengths['mean']:.0f}, p95 {lengths['p95']:.0f} caracteres")
+        depths = summary["conversation_depth"]
+        if depths:
+            print(f"Profundidad: {min(depths)}-{max(depths)} mensajes por conversación")
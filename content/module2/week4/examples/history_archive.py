@@ -0,0 +1,228 @@
+"""Archivo por niveles del historial de conversaciones.
+
+Las conversaciones creadas hace más de N días salen del store activo y se
+guardan en segmentos inmutables `chat_history/archive/segment_<fecha>.jsonl.gz`
+(una conversación por línea, con el mismo formato que history_export). Un
+manifiesto pequeño (`archive/manifest.json`) indica qué segmento contiene cada
+conversación, así cargar una conversación archivada solo descomprime su
+segmento y el store activo se mantiene chico. Al restaurar una conversación
+al store activo se la quita del manifiesto (`release`).
+
+El segmento y el manifiesto se escriben antes de borrar las conversaciones
+del store: si el proceso se corta a mitad de camino, una conversación puede
+quedar en ambos lados, pero nunca se pierde. El store se compacta una sola
+vez, después de borrar todos los lotes.
+
+Uso desde la línea de comandos (por ejemplo, un cron nocturno):
+    python history_archive.py --days 30
+    python history_archive.py --load <conversation_id>
+"""
+import argparse
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from conversation_store import FileLock, _atomic_write_json, open_conversation_store
+
+ARCHIVE_DIR_NAME = "archive"
+MANIFEST_FILE = "manifest.json"
+# Metadatos leídos por página al buscar conversaciones viejas
+ARCHIVE_PAGE_SIZE = 500
+# Conversaciones por segmento: acota lo que se descomprime para cargar una conversación
+SEGMENT_MAX_CONVERSATIONS = 1000
+
+
+class HistoryArchive:
+    """Segmentos gzip inmutables más un manifiesto conversación -> segmento."""
+
+    def __init__(self, archive_dir):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.archive_dir / MANIFEST_FILE
+        self.file_lock = FileLock(self.archive_dir / (MANIFEST_FILE + ".lock"))
+        self.lock = threading.RLock()
+        self._manifest = {"segments": [], "conversations": {}}
+        self._manifest_stat = None
+
+    # Manifiesto
+
+    def _refresh(self):
+        """Vuelve a leer el manifiesto si otro proceso lo reemplazó."""
+        try:
+            stat = self.manifest_file.stat()
+        except FileNotFoundError:
+            return
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        if file_stat != self._manifest_stat:
+            with open(self.manifest_file, 'r') as f:
+                self._manifest = json.load(f)
+            self._manifest_stat = file_stat
+
+    def _segment_path(self, now):
+        stem = f"segment_{now.strftime('%Y%m%d_%H%M%S')}"
+        path = self.archive_dir / f"{stem}.jsonl.gz"
+        suffix = 1
+        while path.exists():
+            path = self.archive_dir / f"{stem}_{suffix}.jsonl.gz"
+            suffix += 1
+        return path
+
+    def _write_segment(self, records, now):
+        """Escribe un segmento nuevo y lo agrega al manifiesto."""
+        path = self._segment_path(now)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+
+        with self.lock, self.file_lock:
+            self._refresh()
+            self._manifest["segments"].append({
+                "file": path.name,
+                "archived_at": now.isoformat(),
+                "conversations": len(records),
+                "messages": sum(len(record["messages"]) for record in records),
+                "oldest": min(record["created_at"] for record in records),
+                "newest": max(record["created_at"] for record in records),
+                "bytes": path.stat().st_size
+            })
+            for record in records:
+                self._manifest["conversations"][record["id"]] = path.name
+            _atomic_write_json(self.manifest_file, self._manifest)
+            self._manifest_stat = None
+        return path
+
+    # Archivado
+
+    def archive_older_than(self, store, days, search_index=None, now=None):
+        """Mueve al archivo las conversaciones creadas hace más de `days` días.
+
+        Se omiten las que recibieron mensajes después del corte (siguen en uso).
+        Una conversación que recibe un mensaje mientras se escribe su segmento
+        no se borra del store y sale del manifiesto: la copia vigente es la activa.
+        Devuelve un resumen con lo archivado.
+        """
+        now = now or datetime.now()
+        cutoff = (now - timedelta(days=days)).isoformat()
+
+        candidates = []
+        offset = 0
+        while True:
+            page = store.list_conversations(offset=offset, limit=ARCHIVE_PAGE_SIZE)
+            if not page:
+                break
+            offset += len(page)
+            candidates.extend(conv["id"] for conv in page if conv["created_at"] < cutoff)
+        # list_conversations va de la más reciente a la más antigua
+        candidates = list(dict.fromkeys(reversed(candidates)))
+
+        summary = {"conversations": 0, "messages": 0, "segments": []}
+        for start in range(0, len(candidates), SEGMENT_MAX_CONVERSATIONS):
+            records = []
+            for conv_id in candidates[start:start + SEGMENT_MAX_CONVERSATIONS]:
+                data = store.get_conversation(conv_id)
+                if data is None:
+                    continue
+                if data["messages"] and data["messages"][-1].get("timestamp", "") >= cutoff:
+                    continue
+                records.append({"id": conv_id, "created_at": data["created_at"], "messages": data["messages"]})
+            if not records:
+                continue
+
+            path = self._write_segment(records, now)
+            archived_ids = store.delete_unchanged({record["id"]: len(record["messages"]) for record in records})
+            if len(archived_ids) < len(records):
+                archived = set(archived_ids)
+                self._forget([record["id"] for record in records if record["id"] not in archived])
+                records = [record for record in records if record["id"] in archived]
+            if search_index is not None and archived_ids:
+                search_index.delete_conversations(archived_ids)
+
+            summary["conversations"] += len(records)
+            summary["messages"] += sum(len(record["messages"]) for record in records)
+            summary["segments"].append(str(path))
+
+        if summary["conversations"]:
+            # Liberar el espacio de todos los lotes de una vez
+            store.compact()
+        return summary
+
+    def release(self, conversation_id):
+        """Quita una conversación del manifiesto tras restaurarla al store activo.
+
+        El segmento no se modifica; el manifiesto indica qué copia es la vigente.
+        """
+        self._forget([conversation_id])
+
+    def _forget(self, conversation_ids):
+        with self.lock, self.file_lock:
+            self._refresh()
+            removed = [self._manifest["conversations"].pop(conv_id, None) for conv_id in conversation_ids]
+            if any(segment is not None for segment in removed):
+                _atomic_write_json(self.manifest_file, self._manifest)
+                self._manifest_stat = None
+
+    # Lectura
+
+    def has_conversation(self, conversation_id):
+        with self.lock:
+            self._refresh()
+            return conversation_id in self._manifest["conversations"]
+
+    def load_conversation(self, conversation_id):
+        """{"created_at", "messages"} de una conversación archivada, o None."""
+        with self.lock:
+            self._refresh()
+            segment = self._manifest["conversations"].get(conversation_id)
+        if segment is None:
+            return None
+        # json.dumps escribe "id" primero: se filtran las líneas sin decodificar el JSON
+        prefix = json.dumps({"id": conversation_id})[:-1] + ","
+        with gzip.open(self.archive_dir / segment, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith(prefix):
+                    record = json.loads(line)
+                    return {"created_at": record["created_at"], "messages": record["messages"]}
+        return None
+
+    def count_conversations(self):
+        with self.lock:
+            self._refresh()
+            return len(self._manifest["conversations"])
+
+    def conversation_segments(self):
+        """ID de conversación -> archivo del segmento que la contiene."""
+        with self.lock:
+            self._refresh()
+            return dict(self._manifest["conversations"])
+
+    def segments(self):
+        with self.lock:
+            self._refresh()
+            return list(self._manifest["segments"])
+
+
+if __name__ == "__main__":
+    from history_search import HistorySearchIndex
+
+    parser = argparse.ArgumentParser(description="Archiva conversaciones viejas del historial del chatbot.")
+    parser.add_argument("--history-dir", default="chat_history", help="Directorio del historial")
+    parser.add_argument("--backend", default=None, help="json, jsonl o sqlite (por defecto CHAT_HISTORY_BACKEND)")
+    parser.add_argument("--days", type=float, default=30, help="Archivar conversaciones creadas hace más de N días")
+    parser.add_argument("--load", metavar="CONVERSATION_ID", help="Mostrar una conversación archivada")
+    args = parser.parse_args()
+
+    history_dir = Path(args.history_dir)
+    archive = HistoryArchive(history_dir / ARCHIVE_DIR_NAME)
+    if args.load:
+        print(json.dumps(archive.load_conversation(args.load), indent=2, ensure_ascii=False))
+    else:
+        store = open_conversation_store(history_dir, args.backend)
+        search_index = HistorySearchIndex(history_dir / "search.db")
+        summary = archive.archive_older_than(store, args.days, search_index=search_index)
+        store.close()
+        print(json.dumps(summary, indent=2))
@@ -0,0 +1,179 @@
+"""Exportación del historial de conversaciones en JSONL comprimido con gzip.
+
+Se escribe una conversación por línea, leyendo del store una conversación por
+vez, así la memoria no depende del tamaño del historial. Soporta filtrar
+mensajes por rango de fechas y exportaciones incrementales ("desde la última
+exportación"). Con una fecha inicial solo se leen las conversaciones cuyo
+`updated_at` es posterior, así una exportación incremental cuesta según lo
+nuevo y no según el historial completo. Cada exportación incremental vuelve a
+leer los últimos EXPORT_OVERLAP_SECONDS de la anterior para incluir mensajes
+que se guardaron tarde, y omite los que ya había exportado.
+
+Uso desde la línea de comandos (por ejemplo, un cron nocturno):
+    python history_export.py --incremental
+    python history_export.py --since 2025-02-01 --until 2025-03-01 --out febrero.jsonl.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from conversation_store import _atomic_write_json, open_conversation_store
+
+EXPORT_STATE_FILE = "last_export.json"
+# Ventana que una exportación incremental vuelve a leer de la anterior: un mensaje
+# con timestamp previo al corte puede guardarse después de que se leyó su conversación
+EXPORT_OVERLAP_SECONDS = int(os.getenv("EXPORT_OVERLAP_SECONDS", "300"))
+
+
+def iter_export_records(store, since=None, until=None):
+    """Genera {"id", "created_at", "messages"} con los mensajes en [since, until).
+
+    Las conversaciones sin mensajes en el rango se omiten. Los candidatos salen
+    de store.iter_updated_since, que recorre por fecha de creación: cada
+    conversación aparece una vez aunque reciba mensajes durante la exportación.
+    """
+    since_iso = since.isoformat() if since else None
+    until_iso = until.isoformat() if until else None
+    for conv in store.iter_updated_since(since):
+        messages = [
+            message for message in store.get_messages(conv["id"])
+            if (since_iso is None or message.get("timestamp", "") >= since_iso)
+            and (until_iso is None or message.get("timestamp", "") < until_iso)
+        ]
+        if messages:
+            yield {"id": conv["id"], "created_at": conv["created_at"], "messages": messages}
+
+
+def message_key(conversation_id, message):
+    """Identifica un mensaje exportado (los mensajes no tienen id propio)."""
+    return (conversation_id, message.get("timestamp", ""), message.get("role"))
+
+
+def export_history(store, output_path, since=None, until=None):
+    """Escribe el historial filtrado en `output_path` (.jsonl.gz) y devuelve un resumen."""
+    return write_export(iter_export_records(store, since, until), output_path)
+
+
+def write_export(records, output_path):
+    """Escribe los registros en `output_path` (.jsonl.gz) y devuelve un resumen."""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    conversations = messages = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            conversations += 1
+            messages += len(record["messages"])
+    os.replace(tmp_path, output_path)
+    return {
+        "path": str(output_path),
+        "conversations": conversations,
+        "messages": messages,
+        "bytes": output_path.stat().st_size
+    }
+
+
+def default_export_path(export_dir, now=None):
+    """`historial_<fecha>.jsonl.gz` dentro de export_dir, sin pisar exportaciones previas."""
+    stem = f"historial_{(now or datetime.now()).strftime('%Y%m%d_%H%M%S')}"
+    path = Path(export_dir) / f"{stem}.jsonl.gz"
+    suffix = 1
+    while path.exists():
+        path = Path(export_dir) / f"{stem}_{suffix}.jsonl.gz"
+        suffix += 1
+    return path
+
+
+def load_export_state(export_dir):
+    """Estado de la última exportación incremental ({"until", "exported"}), o None.
+
+    `exported` son las claves de los mensajes exportados dentro de la ventana de
+    solapamiento, para no repetirlos en la próxima exportación.
+    """
+    try:
+        with open(Path(export_dir) / EXPORT_STATE_FILE, 'r') as f:
+            state = json.load(f)
+        return {
+            "until": datetime.fromisoformat(state["until"]),
+            "exported": {tuple(key) for key in state.get("exported", [])}
+        }
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def export_incremental(store, export_dir):
+    """Exporta los mensajes nuevos desde la última exportación incremental."""
+    export_dir = Path(export_dir)
+    state = load_export_state(export_dir)
+    until = datetime.now()
+    since, exported = None, set()
+    if state is not None:
+        since = state["until"] - timedelta(seconds=EXPORT_OVERLAP_SECONDS)
+        exported = state["exported"]
+    # Claves que la próxima exportación vuelve a leer: las de esta y las de la anterior
+    window_start = (until - timedelta(seconds=EXPORT_OVERLAP_SECONDS)).isoformat()
+    recent = {key for key in exported if key[1] >= window_start}
+
+    def new_records():
+        for record in iter_export_records(store, since, until):
+            messages = [message for message in record["messages"] if message_key(record["id"], message) not in exported]
+            if not messages:
+                continue
+            recent.update(
+                message_key(record["id"], message) for message in messages
+                if message.get("timestamp", "") >= window_start
+            )
+            yield {**record, "messages": messages}
+
+    summary = write_export(new_records(), default_export_path(export_dir, until))
+    _atomic_write_json(export_dir / EXPORT_STATE_FILE, {
+        "until": until.isoformat(),
+        "path": summary["path"],
+        "exported": list(recent)
+    })
+    return summary
+
+
+class ExportJob:
+    """Exportación en un hilo aparte para no bloquear el rerun de Streamlit."""
+
+    def __init__(self, target, *args, **kwargs):
+        self.result = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(target, args, kwargs), daemon=True)
+        self._thread.start()
+
+    def _run(self, target, args, kwargs):
+        try:
+            self.result = target(*args, **kwargs)
+        except Exception as e:
+            self.error = e
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta el historial del chatbot a JSONL comprimido.")
+    parser.add_argument("--history-dir", default="chat_history", help="Directorio del historial")
+    parser.add_argument("--backend", default=None, help="json, jsonl o sqlite (por defecto CHAT_HISTORY_BACKEND)")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Fecha inicial (ISO, inclusive)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="Fecha final (ISO, exclusiva)")
+    parser.add_argument("--incremental", action="store_true", help="Exportar solo lo nuevo desde la última exportación")
+    parser.add_argument("--out", help="Archivo de salida (.jsonl.gz)")
+    args = parser.parse_args()
+
+    store = open_conversation_store(args.history_dir, args.backend)
+    export_dir = Path(args.history_dir) / "exports"
+    if args.incremental:
+        summary = export_incremental(store, export_dir)
+    else:
+        out = args.out or default_export_path(export_dir)
+        summary = export_history(store, out, since=args.since, until=args.until)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,275 @@
+"""Reproducción del tráfico grabado en el historial (prueba de capacidad).
+
+Toma conversaciones guardadas (un directorio de historial, un
+conversations.json o un .jsonl.gz exportado o archivado) y vuelve a enviar
+los mensajes de usuario respetando los tiempos entre llegadas, acelerados
+por --speed (1x, 10x, 100x...). Cada conversación grabada es una sesión: sus
+turnos van en orden y cada uno espera la respuesta del anterior, así la
+concurrencia entre conversaciones es la del tráfico real.
+
+Cada turno hace el mismo camino que ConversationManager.save_message:
+mensaje de usuario al store, llamada al modelo, respuesta al store, y ambos
+al índice de búsqueda. El modelo es un mock con latencia configurable o
+DeepseekModel/LlamaModel de la app: simulados, o contra el endpoint de
+DEEPSEEK_BASE_URL / LLAMA_BASE_URL (por ejemplo mock_openai_server.py), con
+la temperatura y el máximo de tokens de --temperature / --max-tokens. La
+latencia del modelo no se acelera con --speed.
+
+Uso:
+    python history_replay.py --source chat_history --speed 10
+    python history_replay.py --source historial.jsonl.gz --speed 100 --max-p99 2.0
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from conversation_store import open_conversation_store
+from history_analytics import iter_json_conversations, iter_segment_conversations
+from history_search import HistorySearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Hilos para escrituras al store y modelos sin `agenerate`
+REPLAY_WORKERS = 32
+# Configuración de los modelos de la app (la de la barra lateral al iniciar la sesión)
+REPLAY_TEMPERATURE = 0.7
+REPLAY_MAX_TOKENS = 150
+
+
+class MockModel:
+    """Modelo falso con latencia log-normal (mediana `latency` segundos)."""
+
+    def __init__(self, latency=0.5, sigma=0.5, seed=None):
+        self.name = "mock"
+        self.latency = latency
+        self.sigma = sigma
+        self.random = random.Random(seed)
+
+    def _delay(self):
+        return self.latency * self.random.lognormvariate(0, self.sigma)
+
+    def generate(self, prompt):
+        time.sleep(self._delay())
+        return f"Respuesta simulada: {prompt}"
+
+    async def agenerate(self, prompt, config=None, context=None):
+        await asyncio.sleep(self._delay())
+        return f"Respuesta simulada: {prompt}"
+
+
+def load_sessions(source, limit=None):
+    """Turnos de usuario grabados: [[(timestamp, contenido), ...], ...] ordenados por el primer turno."""
+    source = Path(source)
+    if source.is_dir():
+        conversations = open_conversation_store(source).iter_conversations()
+    elif source.name.endswith(".jsonl.gz"):
+        conversations = iter_segment_conversations(source)
+    else:
+        conversations = iter_json_conversations(source)
+
+    sessions = []
+    for _, data in conversations:
+        turns = [
+            (datetime.fromisoformat(message["timestamp"]), message.get("content") or "")
+            for message in data["messages"]
+            if message.get("role") == "user" and message.get("timestamp")
+        ]
+        if turns:
+            sessions.append(turns)
+            if limit and len(sessions) >= limit:
+                break
+    sessions.sort(key=lambda turns: turns[0][0])
+    return sessions
+
+
+def schedule(sessions, speed, max_gap=None):
+    """Convierte timestamps grabados en segundos desde el inicio de la reproducción.
+
+    `max_gap` acota (en segundos ya acelerados) los huecos sin tráfico entre
+    dos mensajes consecutivos del conjunto, para no esperar noches enteras.
+    """
+    instants = sorted({timestamp for turns in sessions for timestamp, _ in turns})
+    offsets = {}
+    elapsed = 0.0
+    for previous, current in zip([instants[0]] + instants, instants):
+        gap = (current - previous).total_seconds() / speed
+        elapsed += gap if max_gap is None else min(gap, max_gap)
+        offsets[current] = elapsed
+    return [[(offsets[timestamp], content) for timestamp, content in turns] for turns in sessions]
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ReplayStats:
+    def __init__(self):
+        self.turn_latencies = []
+        self.write_latencies = []
+        self.lags = []
+        self.errors = 0
+        self.active = 0
+        self.peak_active = 0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def summary(self):
+        duration = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "turns": len(self.turn_latencies),
+            "errors": self.errors,
+            "duration_seconds": duration,
+            "turns_per_second": len(self.turn_latencies) / duration if duration else 0.0,
+            "peak_concurrency": self.peak_active,
+            "turn_latency_seconds": {
+                "p50": _percentile(self.turn_latencies, 0.50),
+                "p95": _percentile(self.turn_latencies, 0.95),
+                "p99": _percentile(self.turn_latencies, 0.99)
+            },
+            "writes": len(self.write_latencies),
+            "writes_per_second": len(self.write_latencies) / duration if duration else 0.0,
+            "write_latency_ms": {
+                "p50": (_percentile(self.write_latencies, 0.50) or 0) * 1000,
+                "p99": (_percentile(self.write_latencies, 0.99) or 0) * 1000
+            },
+            # Si el retraso crece durante la prueba, el sistema no sigue el ritmo del tráfico
+            "schedule_lag_p99_seconds": _percentile(self.lags, 0.99)
+        }
+
+
+async def replay(sessions, store, model, search_index=None, workers=REPLAY_WORKERS, config=None):
+    """Reproduce sesiones ya programadas (ver `schedule`) y devuelve ReplayStats.
+
+    `config` (temperatura, max_tokens) se pasa a `model.agenerate`: fuera de
+    Streamlit no hay st.session_state de donde leerla.
+    """
+    config = config or {"temperatura": REPLAY_TEMPERATURE, "max_tokens": REPLAY_MAX_TOKENS}
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    stats = ReplayStats()
+
+    def write(conversation_id, message, created_at):
+        start = time.perf_counter()
+        store.append_message(conversation_id, message, created_at=created_at)
+        if search_index is not None:
+            search_index.add_message(conversation_id, message)
+        stats.write_latencies.append(time.perf_counter() - start)
+
+    async def generate(prompt):
+        if hasattr(model, "agenerate"):
+            return await model.agenerate(prompt, config)
+        return await loop.run_in_executor(executor, model.generate, prompt)
+
+    async def run_session(turns):
+        conversation_id = str(uuid.uuid4())
+        created_at = None
+        for due, content in turns:
+            delay = stats.started_at + due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            stats.lags.append(max(0.0, -delay))
+            stats.active += 1
+            stats.peak_active = max(stats.peak_active, stats.active)
+            start = time.perf_counter()
+            try:
+                created_at = created_at or datetime.now().isoformat()
+                user_message = {"timestamp": datetime.now().isoformat(), "role": "user", "content": content}
+                await loop.run_in_executor(executor, write, conversation_id, user_message, created_at)
+                reply = await generate(content)
+                assistant_message = {
+                    "timestamp": datetime.now().isoformat(),
+                    "role": "assistant",
+                    "content": reply,
+                    "model": model.name
+                }
+                await loop.run_in_executor(executor, write, conversation_id, assistant_message, created_at)
+                stats.turn_latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                stats.errors += 1
+                logger.error(f"Error en turno de {conversation_id[:8]}: {e}")
+            finally:
+                stats.active -= 1
+
+    stats.started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_session(turns) for turns in sessions))
+    finally:
+        stats.finished_at = time.perf_counter()
+        executor.shutdown(wait=True)
+    return stats
+
+
+def create_model(name, latency):
+    if name == "mock":
+        return MockModel(latency=latency)
+    # Modelos de la app: necesitan DEEPSEEK_API_KEY / LLAMA_API_KEY y, para llamar a un endpoint, <PREFIJO>_BASE_URL
+    from final_chatbot_app_with_history import DeepseekModel, LlamaModel
+    return {"Deepseek": DeepseekModel, "LLaMA-2": LlamaModel}[name]()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce el tráfico grabado del chatbot (prueba de capacidad).")
+    parser.add_argument("--source", default="chat_history",
+                        help="Directorio de historial, conversations.json o .jsonl.gz con el tráfico grabado")
+    parser.add_argument("--target-dir", default="replay_history", help="Directorio del historial de la prueba")
+    parser.add_argument("--backend", default=None, help="json, jsonl o sqlite (por defecto CHAT_HISTORY_BACKEND)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor de aceleración (1, 10, 100...)")
+    parser.add_argument("--max-gap", type=float, default=None,
+                        help="Hueco máximo sin tráfico, en segundos ya acelerados")
+    parser.add_argument("--conversations", type=int, default=None, help="Limitar la cantidad de conversaciones")
+    parser.add_argument("--model", default="mock", choices=["mock", "Deepseek", "LLaMA-2"])
+    parser.add_argument("--mock-latency", type=float, default=0.5, help="Mediana de latencia del mock (s)")
+    parser.add_argument("--temperature", type=float, default=REPLAY_TEMPERATURE,
+                        help="Temperatura de los modelos de la app")
+    parser.add_argument("--max-tokens", type=int, default=REPLAY_MAX_TOKENS,
+                        help="Máximo de tokens por respuesta de los modelos de la app")
+    parser.add_argument("--no-index", action="store_true", help="No escribir en el índice de búsqueda")
+    parser.add_argument("--json", action="store_true", help="Imprimir el resumen en JSON")
+    parser.add_argument("--max-p99", type=float, default=None,
+                        help="Salir con error si el p99 de latencia por turno supera estos segundos")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    if Path(args.target_dir).resolve() == Path(args.source).resolve():
+        raise SystemExit("--target-dir no puede ser el historial de origen")
+    sessions = load_sessions(args.source, args.conversations)
+    if not sessions:
+        raise SystemExit(f"No hay mensajes de usuario con timestamp en {args.source}")
+
+    target_dir = Path(args.target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    store = open_conversation_store(target_dir, args.backend)
+    search_index = None if args.no_index else HistorySearchIndex(target_dir / "search.db")
+    planned = schedule(sessions, args.speed, args.max_gap)
+    print(f"Reproduciendo {sum(len(turns) for turns in planned)} turnos de {len(planned)} conversaciones "
+          f"en ~{max(turns[-1][0] for turns in planned):.0f} s a {args.speed:g}x")
+
+    model = create_model(args.model, args.mock_latency)
+    config = {"temperatura": args.temperature, "max_tokens": args.max_tokens}
+    summary = asyncio.run(replay(planned, store, model, search_index, config=config)).summary()
+    store.close()
+
+    if args.json or not summary["turns"]:
+        print(json.dumps(summary, indent=2))
+    else:
+        latency = summary["turn_latency_seconds"]
+        print(f"Turnos: {summary['turns']} ({summary['errors']} errores) en {summary['duration_seconds']:.1f} s, "
+              f"{summary['turns_per_second']:.1f} turnos/s, concurrencia máxima {summary['peak_concurrency']}")
+        print(f"Latencia por turno: p50 {latency['p50']:.3f} s, p95 {latency['p95']:.3f} s, p99 {latency['p99']:.3f} s")
+        print(f"Escrituras: {summary['writes']} ({summary['writes_per_second']:.1f}/s), "
+              f"p50 {summary['write_latency_ms']['p50']:.2f} ms, p99 {summary['write_latency_ms']['p99']:.2f} ms")
+        print(f"Retraso sobre lo programado (p99): {summary['schedule_lag_p99_seconds']:.3f} s")
+
+    p99 = summary["turn_latency_seconds"]["p99"]
+    if args.max_p99 is not None and (p99 is None or p99 > args.max_p99):
+        raise SystemExit(f"p99 de latencia por turno por encima de {args.max_p99} s")
@@ -0,0 +1,235 @@
+"""Caché semántico de respuestas del chatbot.
+
+Antes de llamar al modelo se busca una pregunta anterior parecida: los
+prompts se convierten en embeddings normalizados y se comparan por coseno
+(un producto matriz-vector con numpy) contra las preguntas ya respondidas por
+el mismo modelo. Si la mejor similitud supera el umbral y la entrada no
+venció su TTL, se devuelve la respuesta guardada.
+
+Las entradas no guardan el contexto de la conversación: el chatbot solo
+consulta el caché en turnos sin mensajes previos.
+
+Embeddings:
+- sentence-transformers (SEMANTIC_CACHE_MODEL, multilingüe por defecto) si
+  está instalado: reconoce paráfrasis ("¿Dónde está mi envío?" / "¿dónde
+  está mi pedido?").
+- Si no, n-gramas de caracteres y palabras con hashing: solo reconoce
+  variantes cercanas (mayúsculas, tildes, signos, errores de tipeo), por eso
+  su umbral por defecto es más alto.
+
+Configuración por variables de entorno: SEMANTIC_CACHE_MODEL,
+SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_MINUTES y
+SEMANTIC_CACHE_MAX_ENTRIES.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+SEMANTIC_CACHE_TTL_MINUTES = float(os.getenv("SEMANTIC_CACHE_TTL_MINUTES", "60"))
+# Similitud mínima para reutilizar una respuesta; sin definir, la del embedder
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD") or 0) or None
+# Entradas por modelo; al superarlo se descartan las más viejas
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+# Embeddings de prompts recientes, para no calcularlos dos veces entre lookup y store
+EMBEDDING_MEMO_SIZE = 256
+
+
+class HashingEmbedder:
+    """Bolsa de n-gramas (palabras y trigramas de caracteres) proyectada con hashing."""
+
+    default_threshold = 0.9
+
+    def __init__(self, dimensions=1024):
+        self.name = "hashing"
+        self.dimensions = dimensions
+
+    @staticmethod
+    def _normalize(text):
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = "".join(char for char in text if not unicodedata.combining(char))
+        return re.sub(r"[^\w]+", " ", text).strip()
+
+    def encode(self, text):
+        normalized = self._normalize(text)
+        features = normalized.split()
+        padded = f" {normalized} "
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in features:
+            digest = zlib.crc32(feature.encode("utf-8"))
+            # El bit alto decide el signo: las colisiones tienden a cancelarse
+            vector[digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceTransformerEmbedder:
+    default_threshold = 0.85
+
+    def __init__(self, model_name=SEMANTIC_CACHE_MODEL):
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, text):
+        return self.model.encode([text], normalize_embeddings=True)[0].astype(np.float32)
+
+
+def create_embedder(model_name=SEMANTIC_CACHE_MODEL):
+    """sentence-transformers si está disponible (y el modelo se puede cargar); si no, hashing."""
+    if SentenceTransformer is not None:
+        try:
+            return SentenceTransformerEmbedder(model_name)
+        except Exception as e:
+            logger.warning(f"No se pudo cargar {model_name}, se usa HashingEmbedder: {e}")
+    return HashingEmbedder()
+
+
+def default_threshold():
+    """Umbral por defecto sin cargar el modelo de embeddings (para mostrarlo en la UI)."""
+    if SEMANTIC_CACHE_THRESHOLD is not None:
+        return SEMANTIC_CACHE_THRESHOLD
+    embedder = SentenceTransformerEmbedder if SentenceTransformer is not None else HashingEmbedder
+    return embedder.default_threshold
+
+
+class _ScopeIndex:
+    """Matriz de embeddings (filas normalizadas) con las entradas de un modelo."""
+
+    def __init__(self, dimensions):
+        self.vectors = np.zeros((64, dimensions), dtype=np.float32)
+        self.expires_at = np.zeros(64)
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, vector, entry, expires_at):
+        size = len(self.entries)
+        if size == len(self.vectors):
+            # Duplicar la capacidad: agregar es O(1) amortizado
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.expires_at = np.concatenate([self.expires_at, np.zeros_like(self.expires_at)])
+        self.vectors[size] = vector
+        self.expires_at[size] = expires_at
+        self.entries.append(entry)
+
+    def keep(self, mask):
+        """Conserva solo las filas marcadas en `mask`."""
+        kept = np.flatnonzero(mask)
+        capacity = max(64, 2 * len(kept))
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+        expires_at = np.zeros(capacity)
+        vectors[:len(kept)] = self.vectors[kept]
+        expires_at[:len(kept)] = self.expires_at[kept]
+        self.vectors, self.expires_at = vectors, expires_at
+        self.entries = [self.entries[i] for i in kept]
+
+    def best_match(self, vector, now):
+        size = len(self.entries)
+        if size == 0:
+            return None, 0.0
+        similarities = self.vectors[:size] @ vector
+        similarities[self.expires_at[:size] <= now] = -np.inf
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+
+class SemanticCache:
+    """Respuestas previas indexadas por el embedding de la pregunta, separadas por modelo."""
+
+    def __init__(self, embedder=None, threshold=None, ttl_minutes=SEMANTIC_CACHE_TTL_MINUTES,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.embedder = embedder or create_embedder()
+        if threshold is None:
+            threshold = SEMANTIC_CACHE_THRESHOLD or self.embedder.default_threshold
+        self.threshold = threshold
+        self.ttl_seconds = ttl_minutes * 60
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._scopes = {}
+        self._memo = OrderedDict()
+        self._stats = {"lookups": 0, "hits": 0, "saved_seconds": 0.0, "saved_tokens": 0, "saved_cost": 0.0}
+
+    def _embed(self, prompt):
+        with self.lock:
+            vector = self._memo.get(prompt)
+            if vector is not None:
+                self._memo.move_to_end(prompt)
+                return vector
+        # El embedding se calcula fuera del lock: no bloquea a otras sesiones
+        vector = self.embedder.encode(prompt)
+        with self.lock:
+            self._memo[prompt] = vector
+            if len(self._memo) > EMBEDDING_MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return vector
+
+    def lookup(self, scope, prompt, threshold=None):
+        """Entrada con la respuesta guardada si hay una pregunta similar vigente, o None."""
+        vector = self._embed(prompt)
+        with self.lock:
+            self._stats["lookups"] += 1
+            index = self._scopes.get(scope)
+            if index is None:
+                return None
+            best, similarity = index.best_match(vector, time.monotonic())
+            if best is None or similarity < (self.threshold if threshold is None else threshold):
+                return None
+            entry = index.entries[best]
+            entry["hits"] += 1
+            self._stats["hits"] += 1
+            self._stats["saved_seconds"] += entry["response_time"]
+            self._stats["saved_tokens"] += entry["tokens"]
+            self._stats["saved_cost"] += entry["cost"]
+            return {**entry, "similarity": similarity}
+
+    def store(self, scope, prompt, answer, response_time=0.0, tokens=0, cost=0.0):
+        """Guarda la respuesta que generó el modelo `scope` para `prompt`."""
+        vector = self._embed(prompt)
+        entry = {
+            "question": prompt,
+            "answer": answer,
+            "response_time": response_time,
+            "tokens": tokens,
+            "cost": cost,
+            "hits": 0
+        }
+        with self.lock:
+            index = self._scopes.setdefault(scope, _ScopeIndex(len(vector)))
+            now = time.monotonic()
+            index.add(vector, entry, now + self.ttl_seconds)
+            if len(index) > self.max_entries:
+                # Descartar vencidas y, si no alcanza, las más viejas
+                mask = index.expires_at[:len(index)] > now
+                overflow = int(mask.sum()) - self.max_entries
+                if overflow > 0:
+                    mask[np.flatnonzero(mask)[:overflow]] = False
+                index.keep(mask)
+
+    def clear(self):
+        with self.lock:
+            self._scopes.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self._stats)
+            stats["entries"] = sum(len(index) for index in self._scopes.values())
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["embedder"] = self.embedder.name
+        stats["threshold"] = self.threshold
+        return stats
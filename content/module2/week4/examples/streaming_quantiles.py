@@ -0,0 +1,111 @@
+"""Cuantiles de latencia en streaming con memoria constante.
+
+P2Quantile implementa el algoritmo P² (Jain y Chlamtac, 1985): estima un
+cuantil con 5 marcadores cuyas alturas se ajustan con interpolación
+parabólica a medida que llegan valores. Cada valor se procesa en O(1) y no se
+guardan las observaciones, así las métricas de una sesión larga ocupan lo
+mismo después de diez requests que después de un millón.
+
+StreamingSummary agrupa conteo, media, máximo y p50/p95/p99 de una serie.
+"""
+import bisect
+
+SUMMARY_QUANTILES = (0.50, 0.95, 0.99)
+
+
+class P2Quantile:
+    """Estimador P² del cuantil `q` (0 < q < 1)."""
+
+    def __init__(self, q):
+        self.q = q
+        self.count = 0
+        # Hasta la quinta observación, las observaciones ordenadas; después, las alturas de los marcadores
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, value):
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            bisect.insort(heights, value)
+            return
+
+        # Celda del valor y extremos
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect.bisect_right(heights, value) - 1
+        for i in range(cell + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Ajustar los marcadores intermedios que se alejaron de su posición deseada
+        positions = self.positions
+        for i in (1, 2, 3):
+            offset = self.desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (
+                offset <= -1 and positions[i - 1] - positions[i] < -1
+            ):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        n, h = self.positions, self.heights
+        return h[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i, step):
+        n, h = self.positions, self.heights
+        return h[i] + step * (h[i + step] - h[i]) / (n[i + step] - n[i])
+
+    def value(self):
+        """Estimación actual del cuantil, o None sin observaciones."""
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            # Con pocas observaciones, el cuantil exacto de la muestra
+            return self.heights[min(self.count - 1, int(self.q * self.count))]
+        return self.heights[2]
+
+
+class StreamingSummary:
+    """Conteo, media, máximo y cuantiles de una serie, en memoria constante."""
+
+    def __init__(self, quantiles=SUMMARY_QUANTILES):
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self.estimators = {q: P2Quantile(q) for q in quantiles}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+        for estimator in self.estimators.values():
+            estimator.add(value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        return self.estimators[q].value()
+
+    def summary(self):
+        result = {"count": self.count, "mean": self.mean, "max": self.max}
+        for q, estimator in self.estimators.items():
+            result[f"p{q * 100:g}"] = estimator.value()
+        return result
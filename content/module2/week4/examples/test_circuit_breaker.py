@@ -0,0 +1,145 @@
+"""Pruebas del circuit breaker por proveedor (pytest test_circuit_breaker.py)."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError, is_provider_failure
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class Clock:
+    """Reloj que se avanza a mano, en lugar de time.monotonic."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("modelo", failure_threshold=3, reset_seconds=30, half_open_calls=1)
+
+
+def fail(breaker, error=None):
+    with pytest.raises(type(error) if error else ProviderError):
+        with breaker.call():
+            raise error or ProviderError(503)
+
+
+def succeed(breaker):
+    with breaker.call():
+        pass
+
+
+def test_provider_failures():
+    assert is_provider_failure(ProviderError(None))
+    assert is_provider_failure(ProviderError(500))
+    assert is_provider_failure(ProviderError(429))
+    assert not is_provider_failure(ProviderError(400))
+    assert not is_provider_failure(ProviderError(404))
+
+
+def test_opens_after_consecutive_failures(breaker):
+    fail(breaker)
+    fail(breaker)
+    succeed(breaker)  # reinicia la cuenta
+    fail(breaker)
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open()
+    assert breaker.snapshot()["trips"] == 1
+
+
+def test_client_errors_do_not_open(breaker):
+    for _ in range(5):
+        fail(breaker, ProviderError(400))
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.consecutive_failures == 0
+
+
+def test_open_rejects_without_calling(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.now += 10
+
+    called = False
+    with pytest.raises(CircuitOpenError) as excinfo:
+        with breaker.call():
+            called = True
+    assert not called
+    assert excinfo.value.retry_in == pytest.approx(20)
+    assert breaker.snapshot()["rejected"] == 1
+    assert breaker.snapshot()["retry_in"] == pytest.approx(20)
+
+
+def test_half_open_trial_closes_on_success(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.now += 30
+    assert not breaker.is_open()
+
+    with breaker.call():
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        # Solo un request de prueba a la vez
+        with pytest.raises(CircuitOpenError):
+            with breaker.call():
+                pass
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_reopens_on_failure(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.now += 30
+
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()["trips"] == 2
+    assert breaker.snapshot()["retry_in"] == pytest.approx(30)
+
+
+def test_cancelled_trial_frees_its_slot(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.now += 30
+
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.call():
+            raise asyncio.CancelledError()
+    # Ni se cerró ni se volvió a abrir, y el siguiente request puede probar
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    succeed(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_generator_closed_early_is_not_a_failure(breaker):
+    def stream():
+        with breaker.call():
+            yield "uno"
+            yield "dos"
+
+    for _ in range(5):
+        chunks = stream()
+        next(chunks)
+        chunks.close()
+    assert breaker.consecutive_failures == 0
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,256 @@
+"""Pruebas de los backends del historial (pytest test_conversation_store.py)."""
+import json
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import conversation_store
+from conversation_store import JsonlConversationStore, SQLiteConversationStore, open_conversation_store
+
+BACKENDS = ["json", "jsonl", "sqlite"]
+
+
+def message(content, timestamp="2024-01-01T10:00:00", role="user"):
+    return {"timestamp": timestamp, "role": role, "content": content}
+
+
+def written(store):
+    """El store JSON escribe los mensajes con demora; los demás, en cada append."""
+    if hasattr(store, "flush"):
+        store.flush()
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def store(tmp_path, backend):
+    store = open_conversation_store(tmp_path, backend)
+    yield store
+    store.close()
+
+
+def test_append_and_read_back(store):
+    store.append_message("a", message("Hola\nsegunda línea"), created_at="2024-01-01T09:00:00")
+    store.append_message("a", message("Respuesta", "2024-01-01T10:00:05", "assistant"))
+    store.append_message("b", message("Otra"), created_at="2024-01-02T09:00:00")
+
+    assert store.has_conversation("a")
+    assert not store.has_conversation("c")
+    assert [m["content"] for m in store.get_messages("a")] == ["Hola\nsegunda línea", "Respuesta"]
+    assert store.get_conversation("a")["created_at"] == "2024-01-01T09:00:00"
+    assert store.get_conversation("c") is None
+    assert store.count_conversations() == 2
+    assert store.count_messages() == 3
+
+
+def test_list_is_newest_first_with_metadata(store):
+    store.append_message("viejo", message("Primera pregunta"), created_at="2024-01-01T09:00:00")
+    store.append_message("nuevo", message("Segunda pregunta"), created_at="2024-01-02T09:00:00")
+
+    listed = store.list_conversations()
+    assert [conv["id"] for conv in listed] == ["nuevo", "viejo"]
+    assert listed[1]["message_count"] == 1
+    assert listed[1]["first_line"] == "Primera pregunta"
+    assert [conv["id"] for conv in store.list_conversations(offset=1, limit=1)] == ["viejo"]
+    assert [conv["id"] for conv in store.list_conversations(query="segunda")] == ["nuevo"]
+    assert store.count_conversations(query="pregunta") == 2
+
+
+def test_extra_message_fields_are_kept(store):
+    store.append_message("a", {**message("Respuesta", role="assistant"), "model": "GPT-3.5", "semantic_cache": True})
+
+    assert store.get_messages("a") == [{**message("Respuesta", role="assistant"), "model": "GPT-3.5", "semantic_cache": True}]
+
+
+def test_returned_messages_are_copies(store):
+    store.append_message("a", message("uno"))
+    messages = store.get_messages("a")
+    conversation = store.get_conversation("a")
+
+    store.append_message("a", message("dos"))
+    written(store)
+    messages.append(message("agregado por quien llama"))
+    conversation["messages"].clear()
+
+    assert len(messages) == 2
+    assert [m["content"] for m in store.get_messages("a")] == ["uno", "dos"]
+
+
+def test_delete_conversations(store):
+    store.append_message("a", message("uno"))
+    store.append_message("b", message("dos"))
+
+    assert store.delete_conversations(["a", "inexistente"]) == 1
+    assert not store.has_conversation("a")
+    assert store.get_messages("a") == []
+    assert [conv_id for conv_id, _ in store.iter_conversations()] == ["b"]
+
+
+def test_delete_unchanged_skips_conversations_with_new_messages(store):
+    store.append_message("a", message("uno"))
+    store.append_message("b", message("dos"))
+    store.append_message("b", message("tres"))
+
+    assert store.delete_unchanged({"a": 1, "b": 1, "inexistente": 0}) == ["a"]
+    assert not store.has_conversation("a")
+    assert [m["content"] for m in store.get_messages("b")] == ["dos", "tres"]
+
+
+def test_iter_updated_since_uses_last_message(store, monkeypatch):
+    monkeypatch.setattr(conversation_store, "LIST_PAGE_SIZE", 2)
+    store.append_message("vieja-activa", message("hola", "2024-01-01T09:00:00"), created_at="2024-01-01T09:00:00")
+    store.append_message("vieja-activa", message("sigo acá", "2024-03-01T09:00:00"))
+    store.append_message("vieja", message("hola", "2024-01-02T09:00:00"), created_at="2024-01-02T09:00:00")
+    for i in range(3):
+        store.append_message(f"nueva-{i}", message("hola", f"2024-03-0{i + 2}T09:00:00"),
+                             created_at=f"2024-03-0{i + 2}T09:00:00")
+
+    updated = [conv["id"] for conv in store.iter_updated_since(datetime(2024, 2, 1))]
+    assert updated == ["vieja-activa", "nueva-0", "nueva-1", "nueva-2"]
+    assert len(list(store.iter_updated_since())) == 5
+
+
+def test_reopen_keeps_history(tmp_path, backend):
+    store = open_conversation_store(tmp_path, backend)
+    for i in range(5):
+        store.append_message("a", message(f"mensaje {i}"))
+    store.delete_conversations(["inexistente"])
+    store.close()
+
+    reopened = open_conversation_store(tmp_path, backend)
+    try:
+        assert [m["content"] for m in reopened.get_messages("a")] == [f"mensaje {i}" for i in range(5)]
+    finally:
+        reopened.close()
+
+
+def test_instances_see_each_others_writes(tmp_path, backend):
+    first = open_conversation_store(tmp_path, backend)
+    second = open_conversation_store(tmp_path, backend)
+    try:
+        first.append_message("a", message("desde la primera"))
+        written(first)
+        second.append_message("a", message("desde la segunda"))
+        written(second)
+        assert [m["content"] for m in first.get_messages("a")] == ["desde la primera", "desde la segunda"]
+    finally:
+        first.close()
+        second.close()
+
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_migrates_legacy_json(tmp_path, backend):
+    legacy = {"a": {"created_at": "2024-01-01T09:00:00", "messages": [message("del archivo viejo")]}}
+    (tmp_path / "conversations.json").write_text(json.dumps(legacy))
+
+    store = open_conversation_store(tmp_path, backend)
+    try:
+        assert store.get_conversation("a") == legacy["a"]
+    finally:
+        store.close()
+
+
+def test_jsonl_index_survives_unflushed_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr(conversation_store, "INDEX_FLUSH_EVERY", 3)
+    store = JsonlConversationStore(tmp_path)
+    for i in range(8):
+        store.append_message(f"c{i % 2}", message(f"mensaje {i}"))
+    # Sin close: el índice en disco no tiene los últimos mensajes, que se recuperan del log
+
+    reopened = JsonlConversationStore(tmp_path)
+    assert reopened.count_messages() == 8
+    assert [m["content"] for m in reopened.get_messages("c1")] == ["mensaje 1", "mensaje 3", "mensaje 5", "mensaje 7"]
+
+
+def test_jsonl_compact_drops_deleted_and_keeps_the_rest(tmp_path):
+    store = JsonlConversationStore(tmp_path)
+    for i in range(20):
+        store.append_message(f"c{i % 4}", message(f"mensaje {i}"))
+    store.delete_conversations(["c0", "c1"])
+    size_before = store.log_file.stat().st_size
+
+    store.compact()
+
+    assert store.log_file.stat().st_size < size_before
+    assert store.count_conversations() == 2
+    assert [m["content"] for m in store.get_messages("c2")] == [f"mensaje {i}" for i in range(2, 20, 4)]
+    store.append_message("c3", message("después de compactar"))
+    store.close()
+
+    reopened = JsonlConversationStore(tmp_path)
+    assert reopened.get_messages("c3")[-1]["content"] == "después de compactar"
+    assert reopened.count_messages() == 11
+
+
+def test_jsonl_pages_follow_creation_order_across_changes(tmp_path):
+    store = JsonlConversationStore(tmp_path)
+    # Creadas fuera de orden, con eliminaciones y una compactación en el medio
+    for day in (5, 1, 9, 3, 7, 2, 8):
+        store.append_message(f"d{day}", message("hola"), created_at=f"2024-01-0{day}T09:00:00")
+    store.delete_conversations(["d3", "d8"])
+    store.compact()
+    store.append_message("d4", message("hola"), created_at="2024-01-04T09:00:00")
+    store.close()
+
+    other = JsonlConversationStore(tmp_path)
+    for current in (store, other):
+        pages = [current.list_conversations(offset=offset, limit=2) for offset in range(0, 8, 2)]
+        assert [conv["id"] for page in pages for conv in page] == ["d9", "d7", "d5", "d4", "d2", "d1"]
+        assert [conv["id"] for conv in current.list_conversations(offset=5)] == ["d1"]
+        assert [conv["id"] for conv in current.iter_updated_since()] == ["d1", "d2", "d4", "d5", "d7", "d9"]
+
+
+def test_jsonl_other_instance_follows_compaction(tmp_path):
+    first = JsonlConversationStore(tmp_path)
+    second = JsonlConversationStore(tmp_path)
+    first.append_message("a", message("uno"))
+    first.append_message("b", message("dos"))
+    first.delete_conversations(["b"])
+
+    second.compact()
+    first.append_message("a", message("tres"))
+
+    assert [m["content"] for m in second.get_messages("a")] == ["uno", "tres"]
+    assert not second.has_conversation("b")
+
+
+def test_sqlite_adds_missing_columns_to_old_databases(tmp_path):
+    connection = sqlite3.connect(tmp_path / "conversations.db")
+    connection.executescript("""
+        CREATE TABLE conversations (id TEXT PRIMARY KEY, created_at TEXT NOT NULL,
+                                    message_count INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL,
+                               timestamp TEXT, role TEXT, content TEXT, extra TEXT);
+        INSERT INTO conversations VALUES ('a', '2024-01-01T09:00:00', 2);
+        INSERT INTO messages (conversation_id, timestamp, role, content)
+        VALUES ('a', '2024-01-01T09:00:01', 'user', 'Pregunta vieja'),
+               ('a', '2024-01-03T09:00:00', 'assistant', 'Respuesta');
+    """)
+    connection.commit()
+    connection.close()
+
+    store = SQLiteConversationStore(tmp_path)
+    try:
+        [conv] = store.list_conversations()
+        assert conv["first_line"] == "Pregunta vieja"
+        assert conv["updated_at"] == "2024-01-03T09:00:00"
+        assert conv["message_count"] == 2
+    finally:
+        store.close()
+
+
+def test_sqlite_compact_after_deletes(tmp_path):
+    store = SQLiteConversationStore(tmp_path)
+    try:
+        for i in range(200):
+            store.append_message(f"c{i}", message("x" * 1000))
+        store.delete_conversations([f"c{i}" for i in range(150)])
+        store.compact()
+        assert store.count_conversations() == 50
+        assert store.count_messages() == 50
+    finally:
+        store.close()
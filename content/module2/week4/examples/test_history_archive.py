@@ -0,0 +1,135 @@
+"""Pruebas del archivo de conversaciones (pytest test_history_archive.py)."""
+import gzip
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import history_archive
+from conversation_store import open_conversation_store
+from history_archive import ARCHIVE_DIR_NAME, HistoryArchive
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+class FakeSearchIndex:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_conversations(self, conversation_ids):
+        self.deleted.extend(conversation_ids)
+
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def store(tmp_path, request):
+    store = open_conversation_store(tmp_path, request.param)
+    # Viejas (enero), una vieja con actividad reciente y una nueva
+    for i in range(5):
+        store.append_message(f"vieja-{i}", {"timestamp": f"2024-01-0{i + 1}T10:00:00", "role": "user",
+                                            "content": f"pregunta {i}"}, created_at=f"2024-01-0{i + 1}T10:00:00")
+    store.append_message("vieja-activa", {"timestamp": "2024-01-10T10:00:00", "role": "user", "content": "hola"},
+                         created_at="2024-01-10T10:00:00")
+    store.append_message("vieja-activa", {"timestamp": "2024-05-30T10:00:00", "role": "user", "content": "sigo"})
+    store.append_message("nueva", {"timestamp": "2024-05-31T10:00:00", "role": "user", "content": "nueva"},
+                         created_at="2024-05-31T10:00:00")
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return HistoryArchive(tmp_path / ARCHIVE_DIR_NAME)
+
+
+def test_archives_old_idle_conversations(store, archive, monkeypatch):
+    monkeypatch.setattr(history_archive, "SEGMENT_MAX_CONVERSATIONS", 2)
+    compactions = []
+    monkeypatch.setattr(store, "compact", lambda: compactions.append(1))
+    search_index = FakeSearchIndex()
+
+    summary = archive.archive_older_than(store, 30, search_index=search_index, now=NOW)
+
+    assert summary["conversations"] == 5
+    assert len(summary["segments"]) == 3
+    # Una sola compactación por corrida, no una por lote
+    assert compactions == [1]
+    assert sorted(search_index.deleted) == [f"vieja-{i}" for i in range(5)]
+    assert sorted(conv["id"] for conv in store.list_conversations()) == ["nueva", "vieja-activa"]
+    assert archive.count_conversations() == 5
+    assert archive.load_conversation("vieja-3")["messages"][0]["content"] == "pregunta 3"
+    assert archive.load_conversation("nueva") is None
+
+
+def test_nothing_to_archive_skips_compaction(store, archive, monkeypatch):
+    compactions = []
+    monkeypatch.setattr(store, "compact", lambda: compactions.append(1))
+
+    summary = archive.archive_older_than(store, 365, now=NOW)
+
+    assert summary == {"conversations": 0, "messages": 0, "segments": []}
+    assert compactions == []
+    assert archive.segments() == []
+
+
+def test_message_during_archiving_keeps_conversation_active(store, archive, monkeypatch):
+    write_segment = archive._write_segment
+
+    def write_then_reply(records, now):
+        path = write_segment(records, now)
+        # Llega un mensaje después de leer la conversación y antes de borrarla
+        store.append_message("vieja-1", {"timestamp": "2024-06-01T11:59:00", "role": "user", "content": "volví"})
+        return path
+
+    monkeypatch.setattr(archive, "_write_segment", write_then_reply)
+    search_index = FakeSearchIndex()
+
+    summary = archive.archive_older_than(store, 30, search_index=search_index, now=NOW)
+
+    assert summary["conversations"] == 4
+    assert "vieja-1" not in search_index.deleted
+    assert [m["content"] for m in store.get_messages("vieja-1")] == ["pregunta 1", "volví"]
+    assert not archive.has_conversation("vieja-1")
+    assert archive.count_conversations() == 4
+
+
+def test_segments_have_export_format(store, archive):
+    summary = archive.archive_older_than(store, 30, now=NOW)
+
+    with gzip.open(summary["segments"][0], 'rt', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [record["id"] for record in records] == [f"vieja-{i}" for i in range(5)]
+    assert set(records[0]) == {"id", "created_at", "messages"}
+
+
+def test_restore_and_release(store, archive):
+    archive.archive_older_than(store, 30, now=NOW)
+    archived = archive.load_conversation("vieja-0")
+
+    # Lo que hace ConversationManager._restore_from_archive
+    for message in archived["messages"]:
+        store.append_message("vieja-0", message, created_at=archived["created_at"])
+    archive.release("vieja-0")
+
+    assert store.get_conversation("vieja-0") == archived
+    assert not archive.has_conversation("vieja-0")
+    assert "vieja-0" not in archive.conversation_segments()
+    assert archive.load_conversation("vieja-0") is None
+    assert archive.count_conversations() == 4
+
+    # Archivarla de nuevo la asigna al segmento nuevo
+    summary = archive.archive_older_than(store, 30, now=NOW)
+    assert summary["conversations"] == 1
+    assert archive.conversation_segments()["vieja-0"] == Path(summary["segments"][0]).name
+    assert archive.load_conversation("vieja-0") == archived
+
+
+def test_other_instance_sees_manifest_changes(store, archive, tmp_path):
+    other = HistoryArchive(tmp_path / ARCHIVE_DIR_NAME)
+    assert other.count_conversations() == 0
+
+    archive.archive_older_than(store, 30, now=NOW)
+    assert other.count_conversations() == 5
+
+    archive.release("vieja-1")
+    assert not other.has_conversation("vieja-1")
@@ -0,0 +1,78 @@
+"""Pruebas de los cuantiles en streaming (pytest test_streaming_quantiles.py)."""
+import random
+
+import numpy as np
+import pytest
+
+from streaming_quantiles import P2Quantile, StreamingSummary
+
+
+def test_empty_estimator_has_no_value():
+    assert P2Quantile(0.5).value() is None
+    assert StreamingSummary().summary() == {"count": 0, "mean": None, "max": None, "p50": None, "p95": None, "p99": None}
+
+
+def test_first_observations_give_exact_sample_quantile():
+    estimator = P2Quantile(0.5)
+    for value in (5, 1, 4):
+        estimator.add(value)
+    assert estimator.value() == 4
+    estimator.add(2)
+    estimator.add(3)
+    assert estimator.value() == 3
+
+
+@pytest.mark.parametrize("q", [0.5, 0.95, 0.99])
+@pytest.mark.parametrize("distribution", ["uniform", "lognormal"])
+def test_estimate_is_close_to_exact_quantile(q, distribution):
+    rng = random.Random(42)
+    if distribution == "uniform":
+        values = [rng.uniform(0, 10) for _ in range(20000)]
+    else:
+        # Latencias: cola larga a la derecha
+        values = [rng.lognormvariate(0, 0.75) for _ in range(20000)]
+    estimator = P2Quantile(q)
+    for value in values:
+        estimator.add(value)
+
+    exact = float(np.quantile(values, q))
+    assert estimator.value() == pytest.approx(exact, rel=0.05)
+
+
+def test_sorted_input_stays_within_observed_range():
+    estimator = P2Quantile(0.95)
+    for value in range(1, 1001):
+        estimator.add(value)
+    assert 1 <= estimator.value() <= 1000
+    assert estimator.value() == pytest.approx(950, rel=0.05)
+
+
+def test_constant_series():
+    estimator = P2Quantile(0.99)
+    for _ in range(100):
+        estimator.add(2.5)
+    assert estimator.value() == 2.5
+
+
+def test_summary_tracks_count_mean_max_and_quantiles():
+    summary = StreamingSummary()
+    rng = random.Random(7)
+    values = [rng.expovariate(1.0) for _ in range(5000)]
+    for value in values:
+        summary.add(value)
+
+    result = summary.summary()
+    assert result["count"] == 5000
+    assert result["mean"] == pytest.approx(sum(values) / len(values))
+    assert result["max"] == max(values)
+    assert set(result) == {"count", "mean", "max", "p50", "p95", "p99"}
+    assert result["p50"] < result["p95"] < result["p99"] <= result["max"]
+    assert summary.quantile(0.95) == pytest.approx(float(np.quantile(values, 0.95)), rel=0.05)
+
+
+def test_memory_does_not_grow_with_observations():
+    estimator = P2Quantile(0.5)
+    for value in range(100000):
+        estimator.add(value)
+    assert len(estimator.heights) == 5
+    assert len(estimator.positions) == 5
@@ -0,0 +1,94 @@
+"""Conteo de tokens para costos y presupuestos de contexto.
+
+El conteo exacto viene en el `usage` de cada respuesta de la API. Este
+módulo se usa cuando no está (modelos simulados, proveedores que no lo
+informan en streaming) y para medir prompts antes de enviarlos:
+
+- Con tiktoken instalado se cuenta con la codificación TOKENIZER_ENCODING
+  (cl100k_base, la de gpt-3.5-turbo; para otros modelos es una aproximación).
+- Si no, una heurística por palabras y signos de ~4 caracteres por token,
+  que en español se acerca mucho más que contar palabras.
+
+Los conteos de textos recientes se cachean, porque el historial de una
+conversación se vuelve a medir en cada turno.
+"""
+import logging
+import math
+import os
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+# Tokens extra por mensaje (rol y separadores) y para iniciar la respuesta, como cuenta la API de chat
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+# Textos distintos cuyo conteo se recuerda
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(name):
+    """Codificación de tiktoken (se carga una vez por proceso), o None para usar la heurística."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"No se pudo cargar la codificación {name}, se usa la heurística: {e}")
+        return None
+
+
+def tokenizer_name():
+    return f"tiktoken/{TOKENIZER_ENCODING}" if _get_encoding(TOKENIZER_ENCODING) else "heurística"
+
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def count_tokens(text):
+    encoding = _get_encoding(TOKENIZER_ENCODING)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Las palabras largas (y las que llevan tildes) se parten en varios tokens
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _PIECE_PATTERN.findall(text))
+
+
+def message_tokens(message):
+    """Tokens que ocupa un mensaje de chat dentro de un prompt."""
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content") or "")
+
+
+def count_message_tokens(messages):
+    """Tokens de prompt de una lista de mensajes de chat."""
+    return REPLY_PRIMING_TOKENS + sum(message_tokens(message) for message in messages)
+
+
+def usage_from_response(usage):
+    """Conteo informado por la API (`response.usage`), o None si no vino."""
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.prompt_tokens + usage.completion_tokens,
+        "source": "api"
+    }
+
+
+def estimate_usage(messages, completion):
+    """Conteo local con el mismo formato que usage_from_response."""
+    prompt_tokens = count_message_tokens(messages)
+    completion_tokens = count_tokens(completion)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "source": tokenizer_name()
+    }
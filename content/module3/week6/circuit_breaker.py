@@ -0,0 +1,138 @@
+"""Circuit breaker por proveedor de modelos.
+
+Cuando un proveedor falla varias veces seguidas, los requests siguientes
+fallan en el acto con CircuitOpenError en lugar de esperar su timeout; pasado
+un tiempo se dejan pasar requests de prueba para ver si se recuperó. Solo
+cuentan como fallas los errores del proveedor (ver is_provider_failure).
+
+Configuración por variables de entorno: CIRCUIT_FAILURE_THRESHOLD,
+CIRCUIT_RESET_SECONDS y CIRCUIT_HALF_OPEN_CALLS.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Fallas seguidas que lo abren, segundos abierto antes de dejar pasar requests de prueba
+# y cuántos requests de prueba pueden estar en vuelo
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))
+
+
+class CircuitOpenError(Exception):
+    """El proveedor está marcado como caído: el request falla sin llamarlo"""
+    def __init__(self, model_name, retry_in):
+        super().__init__(f"{model_name} no disponible (circuit breaker abierto, nuevo intento en {retry_in:.0f}s)")
+        self.model_name = model_name
+        self.retry_in = retry_in
+
+
+def is_provider_failure(error):
+    """Errores que indican un proveedor caído; los 4xx (salvo 429) son del request, no del proveedor"""
+    status_code = getattr(error, "status_code", None)
+    return status_code is None or status_code >= 500 or status_code == 429
+
+
+class CircuitBreaker:
+    """Estado de salud de un proveedor: cerrado, abierto o semiabierto.
+
+    Cerrado: los requests pasan y CIRCUIT_FAILURE_THRESHOLD fallas seguidas lo
+    abren. Abierto: durante CIRCUIT_RESET_SECONDS los requests fallan en el acto
+    con CircuitOpenError, sin esperar el timeout del proveedor. Semiabierto:
+    pasan hasta CIRCUIT_HALF_OPEN_CALLS requests de prueba; si uno responde se
+    cierra y si falla vuelve a abrirse.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds=CIRCUIT_RESET_SECONDS, half_open_calls=CIRCUIT_HALF_OPEN_CALLS, logger=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_calls = half_open_calls
+        self.lock = threading.Lock()
+        self.logger = logger or logging.getLogger(__name__)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_calls = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def _retry_in(self):
+        return self.opened_at + self.reset_seconds - time.monotonic()
+
+    def is_open(self):
+        """True si un request fallaría en el acto"""
+        with self.lock:
+            return self.state == self.OPEN and self._retry_in() > 0
+
+    def _acquire(self):
+        """Deja pasar el request (devuelve si es de prueba) o lanza CircuitOpenError"""
+        with self.lock:
+            if self.state == self.OPEN:
+                if self._retry_in() > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self._retry_in())
+                self.state = self.HALF_OPEN
+                self.trial_calls = 0
+                self.logger.info(f"Circuit breaker de {self.name} semiabierto: se prueba el proveedor")
+            if self.state == self.HALF_OPEN:
+                if self.trial_calls >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0)
+                self.trial_calls += 1
+                return True
+            return False
+
+    def _release(self, trial, success):
+        """Registra el resultado de un request; `success` None si se canceló antes de terminar"""
+        with self.lock:
+            if trial:
+                self.trial_calls = max(0, self.trial_calls - 1)
+            if success is None:
+                return
+            if success:
+                self.consecutive_failures = 0
+                if trial and self.state == self.HALF_OPEN:
+                    self.state = self.CLOSED
+                    self.logger.info(f"Circuit breaker de {self.name} cerrado: el proveedor respondió")
+                return
+            self.consecutive_failures += 1
+            if (trial and self.state == self.HALF_OPEN) or (
+                self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                self.logger.warning(
+                    f"Circuit breaker de {self.name} abierto tras {self.consecutive_failures} fallas seguidas"
+                )
+
+    @contextmanager
+    def call(self):
+        """Envuelve una llamada al proveedor"""
+        trial = self._acquire()
+        try:
+            yield
+        except Exception as e:
+            self._release(trial, not is_provider_failure(e))
+            raise
+        except BaseException:
+            # Cancelado (GeneratorExit, CancelledError): no dice nada del proveedor
+            self._release(trial, None)
+            raise
+        else:
+            self._release(trial, True)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in": max(0.0, self._retry_in()) if self.state == self.OPEN else None,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
@@ -0,0 +1,131 @@
+"""Búsqueda de texto completo sobre el historial de conversaciones.
+
+Usa una tabla virtual FTS5 de SQLite (`chat_history/search.db`) con ranking
+BM25 y fragmentos resaltados. El índice se actualiza mensaje a mensaje desde
+ConversationManager.save_message y se reconstruye desde el store si no
+coincide con la cantidad de mensajes guardados.
+
+Uso desde Python:
+    index = HistorySearchIndex("chat_history/search.db")
+    index.ensure_built(store)
+    index.search("envío pedido", limit=10)
+"""
+import sqlite3
+import threading
+from pathlib import Path
+
+SNIPPET_TOKENS = 12
+HIGHLIGHT_START = "**"
+HIGHLIGHT_END = "**"
+
+
+def build_match_query(text):
+    """Convierte texto libre en una consulta FTS5 segura: todas las palabras, la última como prefijo."""
+    terms = [term.replace('"', '""') for term in text.split()]
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*']
+    return " ".join(phrases)
+
+
+class HistorySearchIndex:
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            # remove_diacritics: "envio" encuentra "envío"
+            self.connection.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    content,
+                    conversation_id UNINDEXED,
+                    role UNINDEXED,
+                    timestamp UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+
+    def add_message(self, conversation_id, message):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO messages_fts (content, conversation_id, role, timestamp) VALUES (?, ?, ?, ?)",
+                (message.get("content") or "", conversation_id, message.get("role"), message.get("timestamp"))
+            )
+
+    def delete_conversations(self, conversation_ids):
+        """Quita del índice los mensajes de esas conversaciones (por ejemplo, al archivarlas)."""
+        with self.lock, self.connection:
+            # conversation_id no está indexado: una tabla temporal permite borrar con un solo recorrido
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS deleted_ids (id TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM deleted_ids")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO deleted_ids (id) VALUES (?)", [(conv_id,) for conv_id in conversation_ids]
+            )
+            self.connection.execute(
+                "DELETE FROM messages_fts WHERE conversation_id IN (SELECT id FROM deleted_ids)"
+            )
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM messages_fts").fetchone()[0]
+
+    def rebuild(self, store):
+        """Reindexa todos los mensajes del store."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM messages_fts")
+            for conv_id, data in store.iter_conversations():
+                self.connection.executemany(
+                    "INSERT INTO messages_fts (content, conversation_id, role, timestamp) VALUES (?, ?, ?, ?)",
+                    [(m.get("content") or "", conv_id, m.get("role"), m.get("timestamp")) for m in data["messages"]]
+                )
+            self.connection.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+
+    def ensure_built(self, store):
+        """Reconstruye el índice si no tiene la misma cantidad de mensajes que el store."""
+        if self.count() != store.count_messages():
+            self.rebuild(store)
+
+    def search(self, text, limit=20, offset=0):
+        """Mensajes que contienen todas las palabras, ordenados por BM25 (más relevante primero)."""
+        match = build_match_query(text)
+        if match is None:
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT conversation_id, role, timestamp, "
+                "snippet(messages_fts, 0, ?, ?, '…', ?) AS snippet, "
+                "bm25(messages_fts) AS score "
+                "FROM messages_fts WHERE messages_fts MATCH ? "
+                "ORDER BY score LIMIT ? OFFSET ?",
+                (HIGHLIGHT_START, HIGHLIGHT_END, SNIPPET_TOKENS, match, limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from conversation_store import open_conversation_store
+
+    parser = argparse.ArgumentParser(description="Busca en el historial del chatbot.")
+    parser.add_argument("query", help="Texto a buscar")
+    parser.add_argument("--history-dir", default="chat_history", help="Directorio del historial")
+    parser.add_argument("--backend", default=None, help="json, jsonl o sqlite (por defecto CHAT_HISTORY_BACKEND)")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    index = HistorySearchIndex(Path(args.history_dir) / "search.db")
+    index.ensure_built(open_conversation_store(args.history_dir, args.backend))
+    start = time.perf_counter()
+    results = index.search(args.query, limit=args.limit)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for result in results:
+        print(f"[{result['conversation_id'][:8]} {result['timestamp']} {result['role']}] {result['snippet']}")
+    print(f"{len(results)} resultados en {elapsed_ms:.1f} ms")
@@ -0,0 +1,153 @@
+"""Servidor local compatible con la API de OpenAI, para probar los proveedores sin llamar a ninguna API.
+
+Implementa lo que usa el chatbot:
+- POST /v1/chat/completions (con y sin "stream": true; con
+  stream_options.include_usage el último chunk trae el conteo de tokens)
+- GET /v1/models y /v1/models/<modelo> (health check)
+
+La latencia (log-normal, mediana --latency) y la tasa de errores 500
+(--error-rate) se configuran para ejercitar timeouts, reintentos y métricas.
+Cada proveedor puede apuntar a su propia instancia:
+
+    python mock_openai_server.py --port 8001 --latency 0.3
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8001/v1 DEEPSEEK_API_KEY=local streamlit run final_chatbot_app_with_history.py
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Valores por defecto; el CLI los reemplaza con los argumentos
+    latency = 0.3
+    sigma = 0.5
+    error_rate = 0.0
+    chunk_delay = 0.02
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {"error": {"message": message, "type": "mock_error", "code": status}})
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        elif self.path.startswith("/v1/models/"):
+            model = self.path[len("/v1/models/"):]
+            self._send_json(200, {"id": model, "object": "model", "created": int(time.time()), "owned_by": "mock"})
+        else:
+            self._send_error(404, f"Ruta desconocida: {self.path}")
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_error(404, f"Ruta desconocida: {self.path}")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+            prompt = request["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            self._send_error(400, "Se esperaba un JSON con 'messages'")
+            return
+
+        time.sleep(self.latency * random.lognormvariate(0, self.sigma))
+        if random.random() < self.error_rate:
+            self._send_error(500, "Error simulado")
+            return
+
+        model = request.get("model", "mock")
+        words = f"Respuesta simulada de {model}: {prompt}".split(" ")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        usage = {
+            "prompt_tokens": sum(len(message.get("content") or "") for message in request["messages"]) // 4 + 1,
+            "completion_tokens": len(words)
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.chunk_delay)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": usage
+            }
+            self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local compatible con la API de OpenAI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.3, help="Mediana de latencia por request (s)")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Dispersión de la latencia log-normal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de requests que responden 500")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="Pausa entre chunks en streaming (s)")
+    args = parser.parse_args()
+
+    MockOpenAIHandler.latency = args.latency
+    MockOpenAIHandler.sigma = args.sigma
+    MockOpenAIHandler.error_rate = args.error_rate
+    MockOpenAIHandler.chunk_delay = args.chunk_delay
+    server = ThreadingHTTPServer((args.host, args.port), MockOpenAIHandler)
+    print(f"Mock OpenAI en http://{args.host}:{args.port}/v1 (latencia {args.latency} s, errores {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,13 +1,10 @@
 import os
 
 from fastapi import HTTPException, APIRouter, Request
-from supabase import create_client
 
+from ..connections.database import SUPABASE_KEY
 from ..schemas.models import TemplateRequest
 
-# Initialize with your Supabase project URL and API key
-SUPABASE_URL = ""
-SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 API_KEY = os.getenv('API_KEY')
 
 # Create an APIRouter instance
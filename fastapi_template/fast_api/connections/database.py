@@ -0,0 +1,13 @@
+import os
+from functools import lru_cache
+
+from .sqlite_backend import create_client_from_env
+
+SUPABASE_URL = os.getenv('SUPABASE_URL', "")
+SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+
+
+@lru_cache(maxsize=1)
+def get_supabase():
+    """Shared Supabase client; SUPABASE_BACKEND=sqlite swaps in the local SQLite backend."""
+    return create_client_from_env(SUPABASE_URL, SUPABASE_KEY)
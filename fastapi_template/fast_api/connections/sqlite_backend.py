@@ -0,0 +1,358 @@
+"""Local SQLite stand-in for the Supabase client.
+
+Implements the subset of the supabase-py query builder used in this course
+(`table(...).insert/update/upsert/select/delete`, `eq`/`neq`/`gt`/`gte`/`lt`/`lte`,
+`order`, `limit` and `execute`) on top of SQLite, so the data path can be run,
+benchmarked and load-tested without a live Supabase project.
+
+Tables and columns are created on first use. Every column used in an `eq`
+filter gets an index, and `upsert(..., on_conflict=...)` columns get a unique
+index, so lookups stay indexed as the data grows.
+
+`rpc(fn, params)` calls functions registered on the client with
+`register_function`, the local counterpart of the Postgres functions that
+supabase-py calls through `rpc`.
+
+Select it with the environment variables:
+    SUPABASE_BACKEND=sqlite
+    SQLITE_DB_PATH=supabase_local.db   # or ":memory:"
+
+The class 8 scripts import this module from the repository root. Run the
+throughput benchmark from there too:
+    python -m fastapi_template.fast_api.connections.sqlite_backend --rows 10000
+"""
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Union
+
+SUPABASE_BACKEND = os.getenv("SUPABASE_BACKEND", "supabase")
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "supabase_local.db")
+
+_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+@dataclass
+class APIResponse:
+    """Mirrors the `data`/`count` attributes of a supabase-py response."""
+    data: List[Dict[str, Any]] = field(default_factory=list)
+    count: Optional[int] = None
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _to_sql_value(value):
+    # SQLite has no JSON column type; nested values are stored as JSON text
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class SQLiteClient:
+    def __init__(self, db_path: str = SQLITE_DB_PATH) -> None:
+        """
+        Opens (or creates) the SQLite database backing the client.
+
+        Args:
+            db_path (str): Path to the database file, or ":memory:".
+        """
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        if db_path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+        self._columns: Dict[str, set] = {}
+        self._indexes: set = set()
+        self._functions: Dict[str, Callable] = {}
+
+    def table(self, name: str) -> "SQLiteQueryBuilder":
+        return SQLiteQueryBuilder(self, name)
+
+    def register_function(self, name: str, function: Callable) -> None:
+        """Registers `function(client, **params)` to be called by rpc(name, params)."""
+        self._functions[name] = function
+
+    def rpc(self, fn: str, params: Optional[Dict] = None) -> "SQLiteRPC":
+        if fn not in self._functions:
+            raise ValueError(f"Unknown function: {fn}")
+        return SQLiteRPC(self, self._functions[fn], params or {})
+
+    def close(self) -> None:
+        self.connection.close()
+
+    # Schema helpers, called with self.lock held
+
+    def ensure_table(self, table: str) -> set:
+        if table not in self._columns:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {_quote(table)} ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')))"
+            )
+            rows = self.connection.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+            self._columns[table] = {row["name"] for row in rows}
+        return self._columns[table]
+
+    def ensure_columns(self, table: str, columns) -> None:
+        known = self.ensure_table(table)
+        missing = [column for column in columns if column not in known]
+        if not missing:
+            return
+        # Another connection to the same file may have added them already
+        rows = self.connection.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+        known.update(row["name"] for row in rows)
+        for column in missing:
+            if column not in known:
+                self.connection.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)}")
+                known.add(column)
+
+    def ensure_index(self, table: str, columns: List[str], unique: bool = False) -> None:
+        key = (table, tuple(columns), unique)
+        if key in self._indexes:
+            return
+        self.ensure_columns(table, columns)
+        name = "_".join(["uq" if unique else "idx", table, *columns])
+        self.connection.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {_quote(name)} "
+            f"ON {_quote(table)} ({', '.join(_quote(c) for c in columns)})"
+        )
+        self._indexes.add(key)
+
+
+class SQLiteRPC:
+    def __init__(self, client: SQLiteClient, function: Callable, params: Dict) -> None:
+        self.client = client
+        self.function = function
+        self.params = params
+
+    def execute(self) -> APIResponse:
+        # Like a Postgres function, the call runs in a single transaction
+        with self.client.lock:
+            self.client.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.function(self.client, **self.params) or []
+            except Exception:
+                self.client.connection.execute("ROLLBACK")
+                # Schema changes made by the call were rolled back too
+                self.client._columns.clear()
+                self.client._indexes.clear()
+                raise
+            self.client.connection.execute("COMMIT")
+        return APIResponse(data=rows, count=len(rows))
+
+
+class SQLiteQueryBuilder:
+    def __init__(self, client: SQLiteClient, table: str) -> None:
+        self.client = client
+        self.table_name = table
+        self.operation = "select"
+        self.columns = "*"
+        self.payload: List[Dict[str, Any]] = []
+        self.on_conflict: List[str] = []
+        self.filters: List[tuple] = []
+        self.order_by: List[str] = []
+        self.row_limit: Optional[int] = None
+        self.count_mode: Optional[str] = None
+
+    # Operations
+
+    def select(self, columns: str = "*", count: Optional[str] = None) -> "SQLiteQueryBuilder":
+        self.operation = "select"
+        self.columns = columns
+        self.count_mode = count
+        return self
+
+    def insert(self, data: Union[Dict, List[Dict]]) -> "SQLiteQueryBuilder":
+        self.operation = "insert"
+        self.payload = data if isinstance(data, list) else [data]
+        return self
+
+    def upsert(self, data: Union[Dict, List[Dict]], on_conflict: str = "") -> "SQLiteQueryBuilder":
+        self.operation = "upsert"
+        self.payload = data if isinstance(data, list) else [data]
+        self.on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()] or ["id"]
+        return self
+
+    def update(self, data: Dict) -> "SQLiteQueryBuilder":
+        self.operation = "update"
+        self.payload = [data]
+        return self
+
+    def delete(self) -> "SQLiteQueryBuilder":
+        self.operation = "delete"
+        return self
+
+    # Filters and modifiers
+
+    def _filter(self, op: str, column: str, value) -> "SQLiteQueryBuilder":
+        self.filters.append((op, column, value))
+        return self
+
+    def eq(self, column: str, value) -> "SQLiteQueryBuilder":
+        return self._filter("eq", column, value)
+
+    def neq(self, column: str, value) -> "SQLiteQueryBuilder":
+        return self._filter("neq", column, value)
+
+    def gt(self, column: str, value) -> "SQLiteQueryBuilder":
+        return self._filter("gt", column, value)
+
+    def gte(self, column: str, value) -> "SQLiteQueryBuilder":
+        return self._filter("gte", column, value)
+
+    def lt(self, column: str, value) -> "SQLiteQueryBuilder":
+        return self._filter("lt", column, value)
+
+    def lte(self, column: str, value) -> "SQLiteQueryBuilder":
+        return self._filter("lte", column, value)
+
+    def order(self, column: str, desc: bool = False) -> "SQLiteQueryBuilder":
+        self.order_by.append(f"{_quote(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size: int) -> "SQLiteQueryBuilder":
+        self.row_limit = size
+        return self
+
+    # Execution
+
+    def _where(self):
+        clauses, params = [], []
+        for op, column, value in self.filters:
+            if value is None and op in ("eq", "neq"):
+                clauses.append(f"{_quote(column)} IS {'NOT ' if op == 'neq' else ''}NULL")
+            else:
+                clauses.append(f"{_quote(column)} {_OPERATORS[op]} ?")
+                params.append(_to_sql_value(value))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def execute(self) -> APIResponse:
+        client = self.client
+        table = _quote(self.table_name)
+        with client.lock:
+            client.ensure_table(self.table_name)
+            for op, column, _ in self.filters:
+                if op == "eq":
+                    client.ensure_index(self.table_name, [column])
+                else:
+                    client.ensure_columns(self.table_name, [column])
+
+            if self.operation in ("insert", "upsert"):
+                if self.operation == "upsert":
+                    client.ensure_index(self.table_name, self.on_conflict, unique=True)
+                rows = []
+                for record in self.payload:
+                    client.ensure_columns(self.table_name, record.keys())
+                    columns = list(record.keys())
+                    sql = (
+                        f"INSERT INTO {table} ({', '.join(_quote(c) for c in columns)}) "
+                        f"VALUES ({', '.join('?' for _ in columns)})"
+                    )
+                    if self.operation == "upsert":
+                        updates = [c for c in columns if c not in self.on_conflict]
+                        conflict = ", ".join(_quote(c) for c in self.on_conflict)
+                        if updates:
+                            assignments = ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in updates)
+                            sql += f" ON CONFLICT ({conflict}) DO UPDATE SET {assignments}"
+                        else:
+                            sql += f" ON CONFLICT ({conflict}) DO NOTHING"
+                    cursor = client.connection.execute(
+                        sql + " RETURNING *", [_to_sql_value(record[c]) for c in columns]
+                    )
+                    rows.extend(dict(row) for row in cursor.fetchall())
+                return APIResponse(data=rows, count=len(rows))
+
+            where, params = self._where()
+
+            if self.operation == "update":
+                updates = self.payload[0]
+                client.ensure_columns(self.table_name, updates.keys())
+                assignments = ", ".join(f"{_quote(c)} = ?" for c in updates)
+                cursor = client.connection.execute(
+                    f"UPDATE {table} SET {assignments}{where} RETURNING *",
+                    [_to_sql_value(v) for v in updates.values()] + params,
+                )
+                rows = [dict(row) for row in cursor.fetchall()]
+                return APIResponse(data=rows, count=len(rows))
+
+            if self.operation == "delete":
+                cursor = client.connection.execute(f"DELETE FROM {table}{where} RETURNING *", params)
+                rows = [dict(row) for row in cursor.fetchall()]
+                return APIResponse(data=rows, count=len(rows))
+
+            if self.columns.strip() == "*":
+                columns = "*"
+            else:
+                names = [c.strip() for c in self.columns.split(",") if c.strip()]
+                client.ensure_columns(self.table_name, names)
+                columns = ", ".join(_quote(c) for c in names)
+            sql = f"SELECT {columns} FROM {table}{where}"
+            if self.order_by:
+                sql += " ORDER BY " + ", ".join(self.order_by)
+            if self.row_limit is not None:
+                sql += f" LIMIT {int(self.row_limit)}"
+            rows = [dict(row) for row in client.connection.execute(sql, params).fetchall()]
+            count = None
+            if self.count_mode == "exact":
+                count = client.connection.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+            return APIResponse(data=rows, count=count)
+
+
+def create_sqlite_client(db_path: str = SQLITE_DB_PATH) -> SQLiteClient:
+    """Create a client exposing the same query-builder chain as supabase.create_client."""
+    return SQLiteClient(db_path)
+
+
+def create_client_from_env(supabase_url: Optional[str], supabase_key: Optional[str]):
+    """Return a SQLite client when SUPABASE_BACKEND=sqlite, otherwise a real Supabase client."""
+    if SUPABASE_BACKEND == "sqlite":
+        return create_sqlite_client(SQLITE_DB_PATH)
+
+    from supabase import create_client
+
+    if not supabase_url or not supabase_key:
+        raise ValueError("Missing Supabase URL or Service Role Key in environment variables.")
+    return create_client(supabase_url, supabase_key)
+
+
+# Throughput benchmark for the data path used by the course helpers
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite Supabase stand-in.")
+    parser.add_argument("--db", default=":memory:", help="Database path (default: in-memory)")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of users to insert/select/update")
+    parser.add_argument("--min-ops", type=float, default=0.0,
+                        help="Exit with an error if any phase falls below this many ops/s")
+    args = parser.parse_args()
+
+    client = create_sqlite_client(args.db)
+    results = {}
+
+    start = time.perf_counter()
+    for i in range(args.rows):
+        client.table("users").insert({"name": f"User {i}", "email": f"user{i}@example.com"}).execute()
+    results["insert"] = args.rows / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(args.rows):
+        client.table("users").select("*").eq("email", f"user{i}@example.com").execute()
+    results["select"] = args.rows / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(args.rows):
+        client.table("users").update({"name": f"User {i} Updated"}).eq("email", f"user{i}@example.com").execute()
+    results["update"] = args.rows / (time.perf_counter() - start)
+
+    for phase, ops in results.items():
+        print(f"{phase:>6}: {ops:,.0f} ops/s")
+
+    if min(results.values()) < args.min_ops:
+        raise SystemExit(f"Throughput below {args.min_ops:,.0f} ops/s")